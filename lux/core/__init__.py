@@ -11,14 +11,29 @@
    :members:
    :member-order: bysource
 
+.. automodule:: lux.core.html
+   :members:
+   :member-order: bysource
+
 .. automodule:: lux.core.commands
    :members:
    :member-order: bysource
 
+.. automodule:: lux.core.conditional
+   :members:
+   :member-order: bysource
+
+.. automodule:: lux.core.green
+   :members:
+   :member-order: bysource
+
 '''
 from .commands import *
 from .extension import *
 from .app import *
 from .wrappers import *
+from .html import *
 from .engines import *
+from .conditional import *
+from .green import *
 from .mail import EmailBackend
@@ -1,8 +1,10 @@
 import sys
 import os
 import json
-from inspect import isclass, getfile
-from collections import OrderedDict
+from functools import partial
+from types import MappingProxyType
+from inspect import isclass
+from collections import OrderedDict, ChainMap
 from importlib import import_module
 
 import pulsar
@@ -16,9 +18,14 @@ from pulsar.utils.importer import module_attribute
 from .commands import ConsoleParser, CommandError
 from .extension import Extension, Parameter, EventHandler, EventMixin
 from .wrappers import wsgi_request, HeadMeta, error_handler
-from .engines import template_engine
+from .html import StaticDocument
+from .engines import template_engine, TemplateRegistry, TemplateContext
 from .cms import CMS
 from .cache import create_store
+from .dispatch import index_middleware
+from .metrics import Metrics, MetricsRouter, clock
+from .green import GreenDispatch
+from .manifest import CommandManifest
 
 
 __all__ = ['App',
@@ -93,6 +100,7 @@ def execute_app(app, argv=None, **params):
 
 
 class App(LazyWsgi):
+    _preloaded = None
 
     def __init__(self, config_file, script=None, argv=None, **params):
         self._params = params
@@ -100,9 +108,27 @@ class App(LazyWsgi):
         self._script = script
         self._argv = argv
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_preloaded', None)
+        return state
+
     def setup(self, environ=None):
+        if self._preloaded is not None:
+            return self._preloaded
         return Application(self)
 
+    def preload(self, application):
+        '''Use a fully built ``application`` as the WSGI handler.
+
+        Processes forked after this call share the configuration and the
+        handler of ``application`` rather than building their own.
+        '''
+        application.load_extensions()
+        application.get_handler()
+        self._preloaded = application
+        return application
+
     def commands(self):
         return Application(self, handler=False)
 
@@ -139,6 +165,11 @@ class Application(ConsoleParser, Extension, EventMixin):
 
         Used by the sessions extension
 
+    .. attribute:: extension_attributes
+
+        Names of the attributes set by extensions. Accessing one of them
+        loads the extensions of applications created for running commands
+
     '''
     cfg = None
     debug = False
@@ -146,6 +177,10 @@ class Application(ConsoleParser, Extension, EventMixin):
     admin = None
     handler = None
     auth_backend = None
+    green_dispatch = None
+    extension_attributes = frozenset(('all_contents', 'api', 'model_changes',
+                                      'odm', 'pagination', 'rate_limiter',
+                                      'total_count', 'write_behind'))
     _worker = None
     _WsgiHandler = WsgiHandler
     _config = [
@@ -156,6 +191,14 @@ class Application(ConsoleParser, Extension, EventMixin):
         Parameter('DESCRIPTION', None,
                   'A description to display before the argument help on the '
                   'command line when running commands'),
+        Parameter('EPILOG', None,
+                  'A text to display after the argument help on the '
+                  'command line when running commands'),
+        Parameter('COMMAND_MANIFEST', None,
+                  'Path of the JSON file caching the commands available to '
+                  'the application. If not set, a file in the cache '
+                  'directory of the user is used. Set to False to disable '
+                  'the cache'),
         Parameter('ENCODING', 'utf-8',
                   'Default encoding for text.'),
         Parameter('ERROR_HANDLER', error_handler,
@@ -206,7 +249,8 @@ class Application(ConsoleParser, Extension, EventMixin):
         Parameter('CACHE_SERVER', 'dummy://',
                   ('Cache server, can be a connection string to a valid '
                    'datastore which support the cache protocol or an object '
-                   'supporting the cache protocol')),
+                   'supporting the cache protocol. Use memory:// for an '
+                   'in-process cache')),
         Parameter('DEFAULT_FROM_EMAIL', '',
                   'Default email address to send email from'),
         Parameter('LOCALE', 'en_GB', 'Default locale', True),
@@ -222,8 +266,29 @@ class Application(ConsoleParser, Extension, EventMixin):
                   'Default locale'),
         Parameter('MD_EXTENSIONS', ['extra', 'meta', 'toc'],
                   'List/tuple of markdown extensions'),
+        Parameter('INDEX_ROUTERS', False,
+                  'Compile consecutive routers in the WSGI middleware into '
+                  'a prefix index so that a request is only dispatched to '
+                  'routers which can match its path'),
+        Parameter('METRICS_URL', None,
+                  'Url serving latency metrics in the Prometheus text format. '
+                  'When set, middleware, routers and event handlers are '
+                  'instrumented'),
+        Parameter('METRICS_ENABLED', True,
+                  'Record metrics when the application starts. It can be '
+                  'switched at runtime via the app.metrics.enabled flag'),
+        Parameter('METRICS_DIR', None,
+                  'Directory where each worker writes a snapshot of its '
+                  'metrics so that the metrics url aggregates all workers'),
+        Parameter('METRICS_INTERVAL', 5,
+                  'Interval in seconds between snapshots of metrics written '
+                  'into METRICS_DIR'),
         Parameter('GREEN_POOL', 0,
                   'Run the WSGI handle in a pool of greenlet'),
+        Parameter('GREEN_POOL_SELECTIVE', False,
+                  'Run the WSGI handler on the event loop and submit to the '
+                  'GREEN_POOL only middleware, routers and router methods '
+                  'declared as blocking'),
         Parameter('SECURE_PROXY_SSL_HEADER', None,
                   'A tuple representing a HTTP header/value combination that '
                   'signifies a request is secure.')
@@ -233,18 +298,35 @@ class Application(ConsoleParser, Extension, EventMixin):
         self.callable = callable
         self.meta.argv = callable._argv
         self.meta.script = callable._script
-        self.config = self._build_config(callable._config_file)
-        self.fire('on_config')
+        self.startup_times = OrderedDict()
+        self.config = self._build_config(callable._config_file,
+                                         lazy=not handler)
         if handler:
+            self.fire('on_config')
             self.get_handler()
 
+    def __getattr__(self, name):
+        # attributes set by extensions when loaded lazily, other names
+        # are skipped since lazy properties look them up via hasattr
+        config = self.__dict__.get('config')
+        if (isinstance(config, LazyConfig) and config.loader and
+                name in self.extension_attributes):
+            self.load_extensions()
+            return getattr(self, name)
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, name))
+
     def __call__(self, environ, start_response):
         '''The WSGI thing.'''
-        request = self.wsgi_request(environ)
-        if self.debug:
-            self.logger.debug('Serving request %s' % request.path)
-        self.fire('on_request', request)
-        return self.handler(environ, start_response)
+        metrics = self.metrics
+        if metrics and metrics.enabled:
+            start = clock()
+            try:
+                return self._serve(environ, start_response)
+            finally:
+                metrics.request.observe(clock() - start)
+                metrics.dump()
+        return self._serve(environ, start_response)
 
     @property
     def config_module(self):
@@ -271,6 +353,16 @@ class Application(ConsoleParser, Extension, EventMixin):
         if self._worker:
             return self._worker._loop
 
+    @lazyproperty
+    def metrics(self):
+        '''The :class:`.Metrics` of this application or ``None`` if
+        :setting:`METRICS_URL` is not set.
+        '''
+        cfg = self.config
+        if cfg['METRICS_URL']:
+            return Metrics(cfg['METRICS_ENABLED'], cfg['METRICS_DIR'],
+                           cfg['METRICS_INTERVAL'])
+
     @lazyproperty
     def cache_server(self):
         '''Return the Cache handler
@@ -285,8 +377,24 @@ class Application(ConsoleParser, Extension, EventMixin):
             self._worker = pulsar.get_actor()
             self.cms = CMS(self)
             self.handler = self._build_handler()
+            # Build the template index
+            self.templates
             self.fire('on_loaded')
-            if self.green_pool:
+            if self.metrics:
+                self.metrics.instrument(self.handler)
+            if self.green_pool and self.config['GREEN_POOL_SELECTIVE']:
+                handler = self.handler
+                self.green_dispatch = GreenDispatch(self)
+                count = self.green_dispatch.instrument(handler)
+                self.logger.info('Setup green dispatch for %d blocking '
+                                 'handlers', count)
+                middleware = [wait_for_body_middleware]
+                middleware.extend(handler.middleware)
+                self.handler = self._WsgiHandler(
+                    middleware,
+                    response_middleware=handler.response_middleware,
+                    async=True)
+            elif self.green_pool:
                 green = WsgiGreen(self.handler, self.green_pool)
                 self.logger.info('Setup green Wsgi handler')
                 self.handler = WsgiHandler((wait_for_body_middleware, green),
@@ -320,11 +428,16 @@ class Application(ConsoleParser, Extension, EventMixin):
         request.cache.app = self
         return request
 
-    def html_document(self, request):
-        '''Build the HTML document.
-
-        Usually there is no need to call directly this method.
-        Instead one can use the :attr:`.WsgiRequest.html_document`.
+    @lazyproperty
+    def html_skeleton(self):
+        '''The request-independent part of the HTML document.
+
+        It is built once and contains the head elements specified in the
+        config (meta tags, scripts and the javascript context) as well as
+        the static contributions of extensions via the
+        ``on_html_skeleton`` event, and of ``on_html_document`` handlers
+        decorated with :func:`.static_html`. It is pre-rendered into the
+        :attr:`static_document` shared by the documents of requests.
         '''
         cfg = self.config
         site_url = cfg['SITE_URL']
@@ -358,38 +471,47 @@ class Application(ConsoleParser, Extension, EventMixin):
         for entry in cfg['HTML_META'] or ():
             head.add_meta(**entry)
 
+        self.fire('on_html_skeleton', doc)
+        return doc
+
+    @lazyproperty
+    def static_document(self):
+        '''The :class:`.StaticDocument` with the pre-rendered markup of the
+        :attr:`html_skeleton` and of the :setting:`HTML_LINKS`.
+        '''
+        return StaticDocument(self.html_skeleton, self.config['HTML_LINKS'])
+
+    def html_document(self, request):
+        '''Build the HTML document.
+
+        The document is a :class:`.Document` sharing the pre-rendered
+        markup of the :attr:`static_document`, it is passed to the
+        ``on_html_document`` event.
+
+        Usually there is no need to call directly this method.
+        Instead one can use the :attr:`.WsgiRequest.html_document`.
+        '''
+        static = self.static_document
+        doc = static.document()
         self.fire('on_html_document', request, doc)
         #
         # Add links last
-        links = head.links
-        for link in cfg['HTML_LINKS']:
-            if isinstance(link, dict):
-                links.append(**link)
-            else:
-                links.append(link)
+        static.add_links(doc)
         return doc
 
     @lazyproperty
     def commands(self):
-        '''Load all commands from installed applications'''
-        cmnds = OrderedDict()
-        for e in self.config['EXTENSIONS']:
-            try:
-                modname = e + ('.core' if e == 'lux' else '') + '.commands'
-                mod = import_module(modname)
-                if hasattr(mod, '__path__'):
-                    path = os.path.dirname(getfile(mod))
-                    try:
-                        commands = tuple((f[:-3] for f in os.listdir(path)
-                                          if not f.startswith('_') and
-                                          f.endswith('.py')))
-                        if commands:
-                            cmnds[e] = commands
-                    except OSError:
-                        continue
-            except ImportError:
-                pass    # No management module
-        return cmnds
+        '''Ordered dictionary of commands from installed applications.
+
+        Commands are read from the :class:`.CommandManifest` so that
+        neither extensions nor their ``commands`` packages are imported.
+        '''
+        extensions = self.config['EXTENSIONS']
+        filename = self.config['COMMAND_MANIFEST']
+        if filename is None:
+            filename = CommandManifest.default_filename(self.config_module,
+                                                        extensions)
+        return CommandManifest(extensions, filename).commands()
 
     @lazyproperty
     def email_backend(self):
@@ -438,8 +560,38 @@ class Application(ConsoleParser, Extension, EventMixin):
         return parser
 
     def on_start(self, server):
+        if self.metrics:
+            self.metrics.clear_snapshots()
         self.fire('on_start', server)
 
+    def on_worker_start(self, worker):
+        '''Re-initialise per-process resources of a preloaded application.
+
+        Invoked in each ``worker`` forked from the arbiter which built
+        this application. Resources which cannot be shared across
+        processes are discarded, so that they are created again when
+        accessed, and the ``on_worker_start`` event is fired for
+        extensions to do the same.
+        '''
+        self._worker = worker
+        self.__dict__.pop('_lazy_cache_server', None)
+        self.__dict__.pop('_lazy_green_pool', None)
+        if self.green_pool:
+            for wsgi in self.handler.middleware:
+                if isinstance(wsgi, WsgiGreen):
+                    wsgi.pool = self.green_pool
+        if self.metrics:
+            self.metrics.reset()
+        self.fire('on_worker_start', worker)
+
+    def on_worker_stopping(self, worker):
+        '''Invoked when a ``worker`` which loaded this application stops.
+
+        Fire the ``on_worker_stopping`` event for extensions to release,
+        or write out, their per-process resources.
+        '''
+        self.fire('on_worker_stopping', worker)
+
     def load_extension(self, dotted_path):
         '''Load an :class:`.Extension` class into this :class:`App`.
 
@@ -449,6 +601,7 @@ class Application(ConsoleParser, Extension, EventMixin):
         If the module contains an :class:`.Extension` class named
         ``Extension``, it will be added to the :attr:`extension` dictionary.
         '''
+        start = clock()
         try:
             module = import_module(dotted_path)
         except ImportError:
@@ -458,10 +611,23 @@ class Application(ConsoleParser, Extension, EventMixin):
             self.logger.exception('%s cannot load extension %s.',
                                   self, dotted_path)
             return
+        finally:
+            self.startup_times[dotted_path] = (
+                self.startup_times.get(dotted_path, 0) + clock() - start)
         Ext = getattr(module, 'Extension', None)
         if Ext and isclass(Ext) and issubclass(Ext, Extension):
             return Ext
 
+    def load_extensions(self):
+        '''Load extensions if they were not loaded already.
+
+        Applications created for running commands load extensions the
+        first time the :attr:`config` misses a parameter, an attribute set
+        by extensions is accessed or a command requiring extensions runs.
+        '''
+        if isinstance(self.config, LazyConfig):
+            self.config.load()
+
     def format_date(self, dte):
         return dte.strftime(self.config['DATE_FORMAT'])
 
@@ -469,26 +635,32 @@ class Application(ConsoleParser, Extension, EventMixin):
         return dte.strftime(self.config['DATETIME_FORMAT'])
 
     # Template redering
+    @lazyproperty
+    def templates(self):
+        '''The :class:`.TemplateRegistry` for this application.
+
+        It indexes the ``templates`` directories of all :attr:`extensions`
+        and keeps compiled templates in memory.
+        '''
+        directories = [os.path.join(LUX_CORE, 'templates')]
+        for ext in self.extensions.values():
+            directories.append(os.path.join(ext.meta.path, 'templates'))
+        return TemplateRegistry((d for d in directories if os.path.isdir(d)),
+                                debug=self.debug)
+
     def template_full_path(self, names):
         '''Return the template full path or None.
 
-        Loops through all :attr:`extensions` in reversed order and
-        check for ``name`` within the ``templates`` directory
+        The full path is obtained from the :attr:`templates` index, where
+        templates in the last :attr:`extensions` take precedence.
         '''
-        if not isinstance(names, (list, tuple)):
-            names = (names,)
-        for name in names:
-            for ext in reversed(tuple(self.extensions.values())):
-                filename = os.path.join(ext.meta.path, 'templates', name)
-                if os.path.exists(filename):
-                    return filename
-            filename = os.path.join(LUX_CORE, 'templates', name)
-            if os.path.exists(filename):
-                return filename
-        self.logger.error('Template %s not found' % name)
+        filename = self.templates.full_path(names)
+        if not filename:
+            self.logger.error('Template %s not found' % (names,))
+        return filename
 
     def template(self, name):
-        '''Load a template from the file system.
+        '''Load a template from the :attr:`templates` registry.
 
         The template is must be located in a ``templates`` directory
         of at least one of the extensions included in the :setting:EXTENSIONS`
@@ -497,37 +669,51 @@ class Application(ConsoleParser, Extension, EventMixin):
 
         If the file is not found an empty string is returned.
         '''
-        filename = self.template_full_path(name)
-        if filename:
-            with open(filename, 'r') as file:
-                return file.read()
-        return ''
+        text = self.templates.text(name)
+        if text is None:
+            self.logger.error('Template %s not found' % (name,))
+            return ''
+        return text
 
     def context(self, request, context=None):
-        '''Load the ``context`` dictionary for a ``request``.
+        '''Load the ``context`` for a ``request``.
 
         This function is called every time a template is rendered via the
         :meth:`render_template` method is used and a the wsgi ``request``
         is passed as key-valued parameter.
 
-        The initial ``context`` is updated with contribution from
-        all :setting:`EXTENSIONS` which expose the ``context`` method.
+        The returned :class:`.TemplateContext` layers the contribution
+        from all :setting:`EXTENSIONS` which expose the ``context`` method,
+        the :attr:`config` dictionary (without copying it), which overrides
+        keys of the initial ``context``, and the initial ``context``.
+        Each extension receives a view of the layers below its own, where
+        its contribution is written, or returns a different mapping which
+        replaces the whole context.
         '''
         context = context if context is not None else {}
-        context.update(request.app.config)
+        layers = [MappingProxyType(request.app.config), context]
         for ext in self.extensions.values():
             if hasattr(ext, 'context'):
-                context = ext.context(request, context) or context
-        return context
+                data = {}
+                view = ChainMap(data, *layers)
+                result = ext.context(request, view)
+                if result is None or result is view:
+                    layers.insert(0, data)
+                else:
+                    layers = [result]
+        return TemplateContext({}, *layers)
 
     def render_template(self, name, context=None, request=None, engine=None):
         '''Render a template file ``name`` with ``context``
         '''
         if request:
             context = self.context(request, context)
-        template = self.template(name)
-        rnd = self.template_engine(engine)
-        return rnd(template, context)
+        engine = engine or self.config['DEFAULT_TEMPLATE_ENGINE']
+        template = self.templates.compiled(name, engine)
+        if template is None:
+            self.logger.error('Template %s not found' % (name,))
+            return self.template_engine(engine)('', context)
+        return template(context)
 
     def template_engine(self, engine=None):
         engine = engine or self.config['DEFAULT_TEMPLATE_ENGINE']
@@ -598,7 +784,14 @@ class Application(ConsoleParser, Extension, EventMixin):
             return GreenPool(self.config['GREEN_POOL'])
 
     # INTERNALS
-    def _build_config(self, module_name):
+    def _serve(self, environ, start_response):
+        request = self.wsgi_request(environ)
+        if self.debug:
+            self.logger.debug('Serving request %s' % request.path)
+        self.fire('on_request', request)
+        return self.handler(environ, start_response)
+
+    def _build_config(self, module_name, lazy=False):
         # Check if an extension module is available
         module = import_module(module_name)
         self.meta = self.meta.copy(module)
@@ -613,7 +806,7 @@ class Application(ConsoleParser, Extension, EventMixin):
         config_module = import_module(opts.config)
         if opts.config != self.config_module:
             # Different config file, configure again
-            return self._build_config(config_module.__file__)
+            return self._build_config(config_module.__file__, lazy)
         #
         # setup application
         config = {}
@@ -628,6 +821,14 @@ class Application(ConsoleParser, Extension, EventMixin):
         if media_url:
             config['MEDIA_URL'] = remove_double_slash('/%s/' % media_url)
         config['EXTENSIONS'] = tuple(apps)
+        self._startup_profile = opts.startup_profile
+        if lazy:
+            return LazyConfig(config, partial(self._load_extensions,
+                                              config_module, True))
+        self._load_extensions(config_module, False, config)
+        return config
+
+    def _load_extensions(self, config_module, fire, config):
         config['EXTENSION_HANDLERS'] = extensions = OrderedDict()
         for name in config['EXTENSIONS'][1:]:
             Ext = self.load_extension(name)
@@ -635,8 +836,13 @@ class Application(ConsoleParser, Extension, EventMixin):
                 extension = Ext()
                 extensions[extension.meta.name] = extension
                 self.bind_events(extension)
+                start = clock()
                 extension.setup(config, config_module, self.params)
-        return config
+                self.startup_times[name] += clock() - start
+        if self._startup_profile:
+            self.write_err(startup_profile(self.startup_times))
+        if fire:
+            self.fire('on_config')
 
     def _build_handler(self):
         '''The WSGI application handler for this :class:`App`.
@@ -655,6 +861,10 @@ class Application(ConsoleParser, Extension, EventMixin):
             _middleware = extension.response_middleware(self)
             if _middleware:
                 rmiddleware.extend(_middleware)
+        if self.config['INDEX_ROUTERS']:
+            middleware = index_middleware(middleware)
+        if self.config['METRICS_URL']:
+            middleware.insert(0, MetricsRouter(self.config['METRICS_URL']))
         # Response middleware executed in reversed order
         rmiddleware = list(reversed(rmiddleware))
         return self._WsgiHandler(middleware, response_middleware=rmiddleware)
@@ -669,6 +879,56 @@ class Application(ConsoleParser, Extension, EventMixin):
         self.logger = cfg.configured_logger('lux')
 
 
+class LazyConfig(dict):
+    '''Configuration dictionary which calls ``loader`` the first time
+    a parameter is not available or the whole dictionary is accessed.
+    '''
+    def __init__(self, data, loader):
+        super().__init__(data)
+        self.loader = loader
+
+    def load(self):
+        loader, self.loader = self.loader, None
+        if loader:
+            loader(self)
+
+    def __missing__(self, key):
+        if self.loader:
+            self.load()
+            return self[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        if self.loader and not super().__contains__(key):
+            self.load()
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        if self.loader and not super().__contains__(key):
+            self.load()
+        return super().get(key, default)
+
+    def __iter__(self):
+        self.load()
+        return super().__iter__()
+
+    def __len__(self):
+        self.load()
+        return super().__len__()
+
+    def keys(self):
+        self.load()
+        return super().keys()
+
+    def values(self):
+        self.load()
+        return super().values()
+
+    def items(self):
+        self.load()
+        return super().items()
+
+
 class WsgiGreen:
     '''Wraps a Wsgi application to be executed on a pool of greenlet
     '''
@@ -695,3 +955,11 @@ def add_app(apps, name, pos=None):
         apps.insert(pos, name)
     else:
         apps.append(name)
+
+
+def startup_profile(times):
+    lines = ['', 'Extensions import and setup times', '']
+    for name, seconds in times.items():
+        lines.append('%10.1f ms  %s' % (1000*seconds, name))
+    lines.append('%10.1f ms  total' % (1000*sum(times.values())))
+    return '\n'.join(lines)
@@ -1,6 +1,18 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
 from pulsar.apps.data import Store, register_store, create_store
 
 
+__all__ = ['DummyStore', 'MemoryStore', 'LRUCache']
+
+
+MAX_ENTRIES = 100000
+'''Default maximum number of entries of a :class:`MemoryStore`'''
+
+
 class DummyStore(Store):
 
     def ping(self):
@@ -19,7 +31,368 @@ class DummyStore(Store):
         pass
 
     def hmget(self, key, *fields):
-        pass
+        return [None]*len(fields)
+
+    def hgetall(self, key):
+        return {}
+
+    def hdel(self, key, *fields):
+        return 0
+
+    def delete(self, *keys):
+        return 0
+
+    def expire(self, key, timeout):
+        return False
+
+
+class LRUCache:
+    '''A thread-safe in-memory cache with per-key timeout and a bounded
+    size.
+
+    When either ``max_entries`` or ``max_bytes`` is exceeded, the least
+    recently used entries are evicted. The size of an entry is
+    estimated via :func:`sys.getsizeof` of its key and value (and of the
+    items of a dictionary value).
+
+    Expired entries are removed when accessed and, so that entries which
+    are never accessed again do not stay in memory, by a :meth:`purge`
+    of the whole cache at the first write after ``purge_interval``
+    seconds.
+
+    :param max_entries: optional maximum number of entries
+    :param max_bytes: optional maximum size of entries
+    :param timeout: optional default timeout in seconds
+    :param purge_interval: seconds between purges of expired entries,
+        ``0`` to purge only via :meth:`purge`
+    '''
+    def __init__(self, max_entries=None, max_bytes=None, timeout=None,
+                 purge_interval=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + (purge_interval or 0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%d entries)' % (self.__class__.__name__, len(self))
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._entry(key) is not None
+
+    @property
+    def stats(self):
+        '''Dictionary of cache statistics'''
+        return {'entries': len(self._data),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, timeout=None):
+        '''Set ``value`` at ``key`` with an optional ``timeout`` in
+        seconds.
+        '''
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        '''Set ``value`` at ``key`` only if the key is not available.
+
+        :return: ``True`` if the value was added
+        '''
+        with self._lock:
+            if self._entry(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def update(self, key, mapping, timeout=None):
+        '''Update the dictionary at ``key`` with ``mapping``.
+
+        The timeout of an existing key is preserved unless ``timeout`` is
+        given.
+        '''
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                value = dict(mapping)
+            else:
+                value = entry[0]
+                if not isinstance(value, dict):
+                    raise TypeError('%s is not a hash' % key)
+                value = dict(value)
+                value.update(mapping)
+                if timeout is None:
+                    timeout = self._ttl(entry)
+            self._set(key, value, timeout)
+
+    def delete_fields(self, key, fields):
+        '''Remove ``fields`` from the dictionary at ``key``.
+
+        :return: the number of removed fields
+        '''
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return 0
+            value = entry[0]
+            if not isinstance(value, dict):
+                raise TypeError('%s is not a hash' % key)
+            value = dict(value)
+            missing = object()
+            removed = sum((value.pop(field, missing) is not missing
+                           for field in fields))
+            if removed:
+                self._set(key, value, self._ttl(entry))
+            return removed
+
+    def incr(self, key, amount=1, timeout=None):
+        '''Increment the integer at ``key`` by ``amount``.
+
+        :return: the new value
+        '''
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                value = amount
+            else:
+                value = entry[0] + amount
+                if timeout is None:
+                    timeout = self._ttl(entry)
+            self._set(key, value, timeout)
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def expire(self, key, timeout):
+        '''Set the ``timeout`` in seconds of an existing ``key``
+        '''
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return False
+            entry[1] = time.monotonic() + timeout if timeout else None
+            return True
+
+    def ttl(self, key):
+        '''Remaining time to live in seconds of ``key``.
+
+        Return ``None`` if the key does not expire and ``-1`` if the key
+        does not exist.
+        '''
+        with self._lock:
+            entry = self._entry(key)
+            return -1 if entry is None else self._ttl(entry)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def purge(self):
+        '''Remove expired entries.
+        '''
+        with self._lock:
+            self._purge(time.monotonic())
+
+    # INTERNALS
+    def _purge(self, now):
+        for key, entry in tuple(self._data.items()):
+            if entry[1] is not None and entry[1] <= now:
+                self._remove(key)
+                self.expirations += 1
+        if self.purge_interval:
+            self._next_purge = now + self.purge_interval
+
+    def _entry(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None:
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+        return entry
+
+    def _ttl(self, entry):
+        if entry[1] is not None:
+            return max(entry[1] - time.monotonic(), 0)
+
+    def _set(self, key, value, timeout):
+        if key in self._data:
+            self._remove(key)
+        now = time.monotonic()
+        if self.purge_interval and now >= self._next_purge:
+            self._purge(now)
+        timeout = timeout if timeout is not None else self.timeout
+        expiry = now + timeout if timeout else None
+        size = getsize(key, value)
+        self._data[key] = [value, expiry, size]
+        self.bytes += size
+        self._evict()
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self.bytes -= entry[2]
+
+    def _evict(self):
+        data = self._data
+        max_entries = self.max_entries
+        max_bytes = self.max_bytes
+        while data and ((max_entries and len(data) > max_entries) or
+                        (max_bytes and self.bytes > max_bytes)):
+            key = next(iter(data))
+            self._remove(key)
+            self.evictions += 1
+
+
+class MemoryStore(Store):
+    '''A cache store in the memory of the process.
+
+    It is registered as the ``memory`` store so that it can be used via
+    the :setting:`CACHE_SERVER` parameter::
+
+        CACHE_SERVER = 'memory://?max_entries=10000&max_bytes=67108864'
+
+    The store holds at most :data:`MAX_ENTRIES` entries unless
+    ``max_entries`` is given, expired entries are purged every
+    ``purge_interval`` seconds (60 by default).
+
+    Each process has its own store, therefore it is suited to single
+    process servers and tests.
+    '''
+    def _init(self, max_entries=None, max_bytes=None, timeout=None,
+              purge_interval=60, **kw):
+        self.cache = LRUCache(
+            max_entries=to_number(max_entries or MAX_ENTRIES),
+            max_bytes=to_number(max_bytes),
+            timeout=to_number(timeout),
+            purge_interval=to_number(purge_interval))
+
+    def ping(self):
+        return True
+
+    def client(self):
+        return self
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None, ex=None, px=None, nx=False,
+            xx=False, **params):
+        '''Set ``value`` at ``key``.
+
+        The expiry in seconds can be given either via ``timeout`` or
+        ``ex``, or in milliseconds via ``px``.
+        '''
+        timeout = expiry(timeout or ex, px)
+        if nx:
+            return self.cache.add(key, value, timeout)
+        if xx and key not in self.cache:
+            return False
+        self.cache.set(key, value, timeout)
+        return True
+
+    def add(self, key, value, time=None):
+        '''Set ``value`` at ``key`` only if the key does not exist.
+        '''
+        return self.cache.add(key, value, time)
+
+    def delete(self, *keys):
+        '''Delete ``keys`` and return the number of keys removed
+        '''
+        missing = object()
+        return sum((self.cache.pop(key, missing) is not missing
+                    for key in keys))
+
+    def expire(self, key, timeout):
+        return self.cache.expire(key, timeout)
+
+    def ttl(self, key):
+        return self.cache.ttl(key)
+
+    def incr(self, key, amount=1):
+        return self.cache.incr(key, amount)
+
+    def hmset(self, key, iterable, timeout=None):
+        self.cache.update(key, iterable, timeout)
+
+    def hmget(self, key, *fields):
+        '''List of the values of ``fields`` of the hash at ``key``,
+        ``None`` for missing fields
+        '''
+        if not fields:
+            raise TypeError('hmget requires at least one field')
+        value = self.cache.get(key) or {}
+        return [value.get(field) for field in fields]
+
+    def hgetall(self, key):
+        '''A copy of the hash at ``key``, empty if not available
+        '''
+        return dict(self.cache.get(key) or ())
+
+    def hdel(self, key, *fields):
+        '''Delete ``fields`` of the hash at ``key`` and return the number
+        of fields removed
+        '''
+        return self.cache.delete_fields(key, fields)
+
+    def flush(self):
+        self.cache.clear()
+
+
+def getsize(key, value):
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        for name, item in value.items():
+            size += sys.getsizeof(name) + sys.getsizeof(item)
+    return size
+
+
+def expiry(timeout, px=None):
+    if px:
+        return int(px)/1000
+    return to_number(timeout)
+
+
+def to_number(value):
+    if isinstance(value, str):
+        value = float(value) if '.' in value else int(value)
+    return value
 
 
 register_store('dummy', 'lux.core.cache.DummyStore')
+register_store('memory', 'lux.core.cache.MemoryStore')
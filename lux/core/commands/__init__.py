@@ -24,6 +24,13 @@ class CommandError(ImproperlyConfigured):
     pass
 
 
+startup_profile = Setting('startup_profile', ('--startup-profile',),
+                          action='store_true',
+                          default=False,
+                          desc=('Print the time taken to import and setup '
+                                'each extension'))
+
+
 class ConsoleParser(object):
     '''A class for parsing the console inputs.
 
@@ -33,7 +40,8 @@ class ConsoleParser(object):
     option_list = ()
     default_option_list = (Loglevel(),
                            LogHandlers(default=['console']),
-                           Debug())
+                           Debug(),
+                           startup_profile)
 
     @property
     def config_module(self):
@@ -103,7 +111,16 @@ class Command(ConsoleParser):
         The file object corresponding to the error streams of this command.
 
         Default: ``sys.stderr``
+
+    .. attribute:: requires_extensions
+
+        When ``False`` the command runs without loading the extensions of
+        the :attr:`app`, unless they are accessed.
+
+        Default: ``True``
     '''
+    requires_extensions = True
+
     def __init__(self, name, app):
         self.name = name
         self.app = app
@@ -111,6 +128,8 @@ class Command(ConsoleParser):
         self.stderr = app.stderr
 
     def __call__(self, argv, **params):
+        if self.requires_extensions:
+            self.app.load_extensions()
         app = self.pulsar_app(argv)
         app()
         return self.run_until_complete(app.cfg, **params)
@@ -172,6 +191,7 @@ class Command(ConsoleParser):
         if application is None:
             application = LuxApp
         cfg = application.cfg.copy()
+        cfg.settings[startup_profile.name] = startup_profile.copy()
         for setting in self.option_list:
             cfg.settings[setting.name] = setting.copy()
         return application(callable=app.callable,
@@ -0,0 +1,246 @@
+import json
+import math
+import time
+import tracemalloc
+from itertools import cycle
+from collections import OrderedDict, Counter
+
+from pulsar import Setting, get_event_loop, asyncio, is_async
+
+import lux
+from lux.utils.test import testClient
+
+
+class Command(lux.Command):
+    help = ('Benchmark the application by replaying requests on the '
+            'WSGI handler in process. Results are written as JSON.')
+    option_list = (
+        Setting('paths',
+                nargs='*',
+                default=['/'],
+                desc=('Paths to request, optionally prefixed by the HTTP '
+                      'method, for example GET:/api/users')),
+        Setting('scenario', ('--scenario',),
+                default=None,
+                desc=('JSON file with a list of requests. Each request is '
+                      'an object with "path" and optional "method", '
+                      '"headers", "body" and "weight" keys')),
+        Setting('requests', ('--requests',),
+                type=int,
+                default=1000,
+                desc='Number of requests'),
+        Setting('bench_concurrency', ('--bench-concurrency',),
+                type=int,
+                default=1,
+                desc='Number of concurrent requests on the event loop'),
+        Setting('warmup', ('--warmup',),
+                type=int,
+                default=10,
+                desc='Number of requests before measuring'),
+        Setting('memory', ('--memory',),
+                type=int,
+                default=100,
+                desc=('Number of requests traced for allocated memory, '
+                      '0 to skip')),
+        Setting('bench_headers', ('--header',),
+                action='append',
+                default=[],
+                desc='Header added to all requests, for example "Accept: '
+                     'application/json"'),
+        Setting('output', ('--output',),
+                default=None,
+                desc='File where to write the JSON report')
+    )
+
+    def run(self, options, **params):
+        app = self.app
+        app.get_handler()
+        client = testClient(app)
+        scenario = self.scenario(options)
+        requests = cycle(scenario)
+        for _ in range(options.warmup):
+            self.execute(client, next(requests))
+        routes = OrderedDict()
+        status = Counter()
+        remaining = [options.requests]
+        concurrency = max(options.bench_concurrency, 1)
+        start = time.perf_counter()
+        workers = [self.worker(client, requests, routes, status, remaining)
+                   for _ in range(concurrency)]
+        self.wait(asyncio.gather(*workers, loop=get_event_loop()))
+        duration = time.perf_counter() - start
+        allocated = self.trace(client, scenario, options.memory, routes)
+        latencies = [t for r in routes.values() for t in r['latencies']]
+        report = OrderedDict((
+            ('app', app.meta.name),
+            ('version', app.get_version()),
+            ('lux', lux.__version__),
+            ('requests', len(latencies)),
+            ('concurrency', concurrency),
+            ('duration', duration),
+            ('requests_per_second', len(latencies)/duration),
+            ('latency', stats(latencies)),
+            ('allocated_bytes_per_request', allocated),
+            ('status', OrderedDict(sorted(status.items()))),
+            ('routes', OrderedDict(((name, route_report(route))
+                                    for name, route in routes.items())))))
+        text = json.dumps(report, indent=4)
+        if options.output:
+            with open(options.output, 'w') as fp:
+                fp.write(text)
+        else:
+            self.write(text)
+        return report
+
+    def scenario(self, options):
+        '''List of requests to replay
+        '''
+        if options.scenario:
+            with open(options.scenario, 'r') as fp:
+                entries = json.load(fp)
+        else:
+            entries = []
+            for path in options.paths:
+                method, _, url = path.rpartition(':')
+                if url.startswith('/') and method.isalpha():
+                    entries.append({'method': method, 'path': url})
+                else:
+                    entries.append({'path': path})
+        headers = []
+        for header in options.bench_headers:
+            name, _, value = header.partition(':')
+            headers.append((name.strip(), value.strip()))
+        scenario = []
+        for entry in entries:
+            entry_headers = list(headers)
+            entry_headers.extend((entry.get('headers') or {}).items())
+            body = entry.get('body')
+            if body is not None and not isinstance(body, bytes):
+                if not isinstance(body, str):
+                    body = json.dumps(body)
+                body = body.encode('utf-8')
+            spec = {'path': entry['path'],
+                    'method': entry.get('method', 'GET').upper(),
+                    'headers': entry_headers,
+                    'body': body}
+            scenario.extend([spec]*max(int(entry.get('weight', 1)), 1))
+        return scenario
+
+    def worker(self, client, requests, routes, status, remaining):
+        '''Coroutine executing requests until none is ``remaining``
+        '''
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            spec = next(requests)
+            request = self.request(client, spec)
+            start = time.perf_counter()
+            response = yield from self.respond(request)
+            elapsed = time.perf_counter() - start
+            route = route_name(request, spec)
+            if route not in routes:
+                routes[route] = {'count': 0, 'latencies': [], 'bytes': []}
+            routes[route]['count'] += 1
+            routes[route]['latencies'].append(elapsed)
+            status[str(response.status_code)] += 1
+
+    def trace(self, client, scenario, number, routes):
+        '''Trace the memory allocated by ``number`` requests.
+
+        Requests are executed one at a time, the memory allocated by a
+        request is the peak of traced memory until its body is consumed.
+        '''
+        if not number or tracemalloc.is_tracing():
+            return None
+        requests = cycle(scenario)
+        allocated = []
+        for _ in range(number):
+            spec = next(requests)
+            request = self.request(client, spec)
+            tracemalloc.start()
+            try:
+                self.wait(self.respond(request))
+                size = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            allocated.append(size)
+            route = routes.get(route_name(request, spec))
+            if route is not None:
+                route['bytes'].append(size)
+        return sum(allocated)/len(allocated)
+
+    def request(self, client, spec):
+        headers = list(spec['headers'])
+        accept = None
+        for name, value in spec['headers']:
+            if name.lower() == 'accept':
+                accept = value
+        request, _ = client.request_start_response(
+            path=spec['path'], HTTP_ACCEPT=accept, headers=headers,
+            body=spec['body'], REQUEST_METHOD=spec['method'])
+        return request
+
+    def execute(self, client, spec):
+        request = self.request(client, spec)
+        return self.wait(self.respond(request))
+
+    def respond(self, request):
+        '''Coroutine executing ``request`` on the application, the
+        response is returned once its body has been consumed
+        '''
+        response = self.app(request.environ, start_response)
+        if is_async(response):
+            response = yield from response
+        for chunk in response:
+            if is_async(chunk):
+                yield from chunk
+        return response
+
+    def wait(self, coroutine):
+        '''Run ``coroutine`` on the event loop and return its result
+        '''
+        loop = get_event_loop()
+        if loop.is_running():
+            # running on the green pool
+            from pulsar.apps.greenio import wait
+            return wait(coroutine)
+        return loop.run_until_complete(coroutine)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def route_name(request, spec):
+    router = request.cache.app_handler
+    if router is not None:
+        path = '/%s' % router.full_route.rule
+    else:
+        path = spec['path']
+    return '%s %s' % (spec['method'], path)
+
+
+def percentile(values, p):
+    index = int(math.ceil(p*len(values)/100)) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def stats(latencies):
+    '''Latency statistics in milliseconds'''
+    if not latencies:
+        return {}
+    values = sorted(latencies)
+    return OrderedDict((
+        ('mean', 1000*sum(values)/len(values)),
+        ('p50', 1000*percentile(values, 50)),
+        ('p95', 1000*percentile(values, 95)),
+        ('p99', 1000*percentile(values, 99)),
+        ('max', 1000*values[-1])))
+
+
+def route_report(route):
+    sizes = route['bytes']
+    return OrderedDict((
+        ('requests', route['count']),
+        ('latency', stats(route['latencies'])),
+        ('allocated_bytes_per_request',
+         sum(sizes)/len(sizes) if sizes else None)))
@@ -17,6 +17,7 @@ def generate_secret(length=50, hexadecimal=False):
 
 class Command(lux.Command):
     help = "Generate a secret key."
+    requires_extensions = False
     option_list = (
         Setting('length', ('--length',),
                 default=50, type=int,
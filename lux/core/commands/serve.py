@@ -1,18 +1,48 @@
 import logging
 
 import pulsar
+from pulsar import Setting
 from pulsar.apps import wsgi
 from pulsar.utils.log import clear_logger
 
 import lux
 
 
+class WSGIServer(wsgi.WSGIServer):
+    '''WSGI server notifying a preloaded application when a worker starts
+    and the loaded application when a worker stops
+    '''
+    def worker_start(self, worker, exc=None):
+        app = self.cfg.callable._preloaded
+        if app is not None:
+            app.on_worker_start(worker)
+        return super().worker_start(worker, exc)
+
+    def worker_stopping(self, worker, exc=None):
+        callable = self.cfg.callable
+        app = callable._preloaded or callable.local.get('handler')
+        if app is not None:
+            app.on_worker_stopping(worker)
+        return super().worker_stopping(worker, exc)
+
+
 class Command(lux.Command):
     help = "Starts a fully-functional Web server using pulsar"
+    option_list = (
+        Setting('preload', ('--preload',),
+                action='store_true',
+                default=False,
+                desc=('Build the application in the arbiter before forking '
+                      'workers, which share its configuration and handler. '
+                      'Per-process resources are created again via the '
+                      'on_worker_start event')),
+    )
 
     def __call__(self, argv, start=True):
         app = self.app
-        server = self.pulsar_app(argv, wsgi.WSGIServer)
+        server = self.pulsar_app(argv, WSGIServer)
+        if server.cfg.preload:
+            app.callable.preload(app)
         if start and not server.logger:   # pragma    nocover
             if not pulsar.get_actor():
                 clear_logger()
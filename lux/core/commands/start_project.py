@@ -38,6 +38,7 @@ class Command(lux.Command):
     help = ('Creates a Lux project directory structure for the given '
             'project name in the current directory or optionally in the '
             'given directory.')
+    requires_extensions = False
 
     def run(self, options):
         self.template_dir = path.join(path.dirname(__file__), 'templates')
@@ -0,0 +1,115 @@
+'''Conditional GET for routers.
+
+A router method decorated with :func:`conditional` evaluates a cheap
+:class:`Validator` before running. When the validator matches the
+``If-None-Match`` or ``If-Modified-Since`` headers of the request, a
+``304 Not Modified`` response is returned without calling the method::
+
+    class Blog(lux.Router):
+
+        def validator(self, request):
+            return lux.Validator(last_modified=os.path.getmtime(BLOG_FILE))
+
+        @lux.conditional()
+        def get(self, request):
+            ...
+'''
+import calendar
+from datetime import datetime
+from functools import wraps
+from email.utils import parsedate_tz, mktime_tz
+
+from pulsar.utils.httpurl import http_date
+
+
+__all__ = ['Validator', 'conditional']
+
+
+class Validator:
+    '''Validators of a resource.
+
+    :param etag: optional version token of the resource, it is used as
+        entity tag
+    :param last_modified: optional last modified time of the resource,
+        either a timestamp or a :class:`~datetime.datetime` (UTC when
+        naive)
+    '''
+    __slots__ = ('etag', 'last_modified')
+
+    def __init__(self, etag=None, last_modified=None):
+        if etag is not None:
+            etag = str(etag)
+            if not etag.startswith(('"', 'W/"')):
+                etag = '"%s"' % etag
+        if isinstance(last_modified, datetime):
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+        self.etag = etag
+        self.last_modified = (int(last_modified)
+                              if last_modified is not None else None)
+
+    def __repr__(self):
+        return '%s(etag=%s, last_modified=%s)' % (
+            self.__class__.__name__, self.etag, self.last_modified)
+    __str__ = __repr__
+
+    def not_modified(self, environ):
+        '''Check if the client representation is still valid.
+
+        ``If-None-Match`` takes precedence over ``If-Modified-Since``.
+        '''
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            if not self.etag:
+                return False
+            tags = set((weak(tag) for tag in if_none_match.split(',')))
+            return '*' in tags or weak(self.etag) in tags
+        since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if since and self.last_modified is not None:
+            since = parsedate_tz(since)
+            return bool(since) and self.last_modified <= mktime_tz(since)
+        return False
+
+    def set_headers(self, response):
+        '''Add ``ETag`` and ``Last-Modified`` headers to ``response``
+        '''
+        if self.etag and not response.has_header('ETag'):
+            response['ETag'] = self.etag
+        if (self.last_modified is not None and
+                not response.has_header('Last-Modified')):
+            response['Last-Modified'] = http_date(self.last_modified)
+
+
+def conditional(validator='validator'):
+    '''Decorator for ``GET`` methods of a router.
+
+    :param validator: name of the router method returning a
+        :class:`Validator`, or ``None`` when validation is not possible,
+        for a ``request``.
+    '''
+    def _(method):
+
+        @wraps(method)
+        def _method(router, request, *args, **kwargs):
+            state = None
+            if request.method in ('GET', 'HEAD'):
+                state = getattr(router, validator)(request)
+            if state:
+                if state.not_modified(request.environ):
+                    response = request.response
+                    response.status_code = 304
+                    state.set_headers(response)
+                    return response
+                response = method(router, request, *args, **kwargs)
+                if 200 <= response.status_code < 300:
+                    state.set_headers(response)
+                return response
+            return method(router, request, *args, **kwargs)
+
+        return _method
+
+    return _
+
+
+def weak(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
@@ -0,0 +1,122 @@
+'''Indexed dispatch of WSGI routers.
+
+When the :setting:`INDEX_ROUTERS` parameter is ``True``, consecutive
+:class:`~pulsar.apps.wsgi.routers.Router` in the WSGI middleware are
+compiled into a :class:`RouterIndex`. The index is a prefix trie over the
+static path segments of each router rule, so that a request is only
+offered to the routers which can possibly match its path.
+
+Routers with a dynamic first segment, or which override the ``__call__``
+method, are kept in the trie root and tried for every request. Candidates
+are always tried in their original order, therefore the first-match
+semantics of the middleware list is preserved.
+'''
+from heapq import merge
+
+from pulsar.apps.wsgi import Router
+
+
+__all__ = ['RouterIndex', 'index_middleware']
+
+
+_DYNAMIC = frozenset('<>()[]{}*+?^$|\\')
+
+
+class _Node:
+    __slots__ = ('children', 'routers')
+
+    def __init__(self):
+        self.children = {}
+        self.routers = []
+
+
+def static_prefix(router):
+    '''Tuple of static path segments at the start of ``router`` rule.
+    '''
+    if type(router).__call__ is not Router.__call__:
+        return ()
+    bits = []
+    rule = router.route.rule
+    for bit in rule.strip('/').split('/'):
+        if not bit or _DYNAMIC.intersection(bit):
+            break
+        bits.append(bit)
+    return tuple(bits)
+
+
+class RouterIndex:
+    '''WSGI middleware dispatching a request to a group of ``routers``.
+
+    .. attribute:: routers
+
+        Tuple of routers in the order they were given
+    '''
+    def __init__(self, routers):
+        self.routers = tuple(routers)
+        self._root = _Node()
+        for index, router in enumerate(self.routers):
+            node = self._root
+            for bit in static_prefix(router):
+                child = node.children.get(bit)
+                if child is None:
+                    child = node.children[bit] = _Node()
+                node = child
+            node.routers.append(index)
+
+    def __repr__(self):
+        return '%s(%d routers)' % (self.__class__.__name__,
+                                   len(self.routers))
+    __str__ = __repr__
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        routers = self.routers
+        for index in self.candidates(path[1:]):
+            response = routers[index](environ, start_response)
+            if response is not None:
+                return response
+
+    def candidates(self, path):
+        '''Indices of routers which may match ``path``, in order.
+
+        ``path`` is without the leading slash.
+        '''
+        node = self._root
+        groups = []
+        if node.routers:
+            groups.append(node.routers)
+        for bit in path.split('/'):
+            node = node.children.get(bit)
+            if node is None:
+                break
+            if node.routers:
+                groups.append(node.routers)
+        if len(groups) == 1:
+            return groups[0]
+        return merge(*groups)
+
+
+def index_middleware(middleware):
+    '''Replace consecutive routers in ``middleware`` with a
+    :class:`RouterIndex`.
+
+    Other middleware are left in place so that they run in the same order.
+    '''
+    compiled = []
+    routers = []
+    for handler in middleware:
+        if isinstance(handler, Router):
+            routers.append(handler)
+            continue
+        _add_routers(compiled, routers)
+        routers = []
+        compiled.append(handler)
+    _add_routers(compiled, routers)
+    return compiled
+
+
+def _add_routers(compiled, routers):
+    if len(routers) > 1:
+        compiled.append(RouterIndex(routers))
+    else:
+        compiled.extend(routers)
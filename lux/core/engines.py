@@ -1,11 +1,16 @@
+import os
+import time
 from string import Template
+from collections import ChainMap
 
 from pulsar import ImproperlyConfigured
 
-__all__ = ['register_template_engine', 'template_engine']
+__all__ = ['register_template_engine', 'template_engine', 'TemplateRegistry',
+           'TemplateContext']
 
 default_engine = 'python'
 template_engines = {}
+template_compilers = {}
 
 
 def template_engine(name=None):
@@ -17,12 +22,192 @@ def template_engine(name=None):
     return engine
 
 
-def register_template_engine(name, engine):
+def register_template_engine(name, engine, compiler=None):
+    '''Register a template ``engine`` with ``name``.
+
+    :param engine: a callable accepting a template text and a context
+        dictionary and returning the rendered text.
+    :param compiler: optional callable accepting a template text and
+        returning a callable which renders a context. When not given
+        the :class:`.TemplateRegistry` compiles templates by binding the
+        text to the ``engine``.
+    '''
     template_engines[name] = engine
+    if compiler:
+        template_compilers[name] = compiler
+    else:
+        template_compilers.pop(name, None)
+
+
+def template_compiler(name=None):
+    name = name or default_engine
+    compiler = template_compilers.get(name)
+    if compiler is None:
+        engine = template_engine(name)
+
+        def compiler(text):
+            return lambda context: engine(text, context)
+
+    return compiler
 
 
 def render(text, context):
     return Template(text).safe_substitute(context) if context else text
 
 
-register_template_engine(default_engine, render)
+def compile_template(text):
+    template = Template(text)
+
+    def _render(context):
+        return template.safe_substitute(context) if context else text
+
+    return _render
+
+
+register_template_engine(default_engine, render, compile_template)
+
+
+class TemplateContext(ChainMap):
+    '''The context for rendering a template.
+
+    A :class:`~collections.ChainMap` where writes go to the first mapping
+    and keys are looked up through the layers which follow. It is
+    returned by :meth:`.Application.context` so that the application
+    configuration is a layer of the context rather than being copied
+    into it for every rendered template.
+    '''
+    def __bool__(self):
+        return True
+
+
+class TemplateRegistry:
+    '''Index of template files and cache of their compiled form.
+
+    The index maps template names to the full path of the file and it is
+    built once from the ``templates`` directories of the application.
+    Directories are given in order of increasing priority, a template in
+    a later directory overrides a template with the same name in an
+    earlier one.
+
+    Templates are read from disk the first time they are requested.
+    When :attr:`debug` is ``True``, the modification time of files is
+    checked at every access so that changes are picked up without a
+    restart, otherwise the disk is never touched again.
+
+    .. attribute:: hits
+
+        Number of templates served from the cache
+
+    .. attribute:: misses
+
+        Number of templates which had to be loaded (or were not found)
+
+    .. attribute:: load_time
+
+        Total time in seconds spent loading and compiling templates
+    '''
+    def __init__(self, directories, debug=False):
+        self.directories = tuple(directories)
+        self.debug = debug
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+        self._texts = {}
+        self._compiled = {}
+        self.index = self._build_index()
+
+    def __repr__(self):
+        return '%s(%d templates)' % (self.__class__.__name__,
+                                     len(self.index))
+    __str__ = __repr__
+
+    @property
+    def stats(self):
+        '''Dictionary of cache statistics'''
+        return {'templates': len(self.index),
+                'hits': self.hits,
+                'misses': self.misses,
+                'load_time': self.load_time}
+
+    def full_path(self, names):
+        '''Return the full path of the first template found in ``names``
+        or ``None``.
+        '''
+        if not isinstance(names, (list, tuple)):
+            names = (names,)
+        for name in names:
+            filename = self.index.get(name)
+            if filename is None and self.debug:
+                filename = self._find(name)
+            if filename:
+                return filename
+
+    def text(self, names):
+        '''Return the text of a template or ``None`` if not found
+        '''
+        filename = self.full_path(names)
+        if filename:
+            return self._load(self._texts, filename, self._read)
+        self.misses += 1
+
+    def compiled(self, names, engine=None):
+        '''Return a callable rendering a template with a ``context``.
+
+        :param names: the template name or a list of names to try in order
+        :param engine: the template engine name, if not provided the
+            default engine is used.
+        :return: a callable or ``None`` if the template is not found
+        '''
+        filename = self.full_path(names)
+        if filename:
+            compiler = template_compiler(engine)
+            return self._load(self._compiled, (filename, engine),
+                              lambda key: compiler(self._read(filename)))
+        self.misses += 1
+
+    def clear(self):
+        '''Clear the cache of loaded templates'''
+        self._texts.clear()
+        self._compiled.clear()
+
+    # INTERNALS
+    def _build_index(self):
+        index = {}
+        for directory in self.directories:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, directory)
+                    index[name.replace(os.sep, '/')] = path
+        return index
+
+    def _find(self, name):
+        for directory in reversed(self.directories):
+            filename = os.path.join(directory, name)
+            if os.path.isfile(filename):
+                self.index[name] = filename
+                return filename
+
+    def _load(self, cache, key, loader):
+        filename = key[0] if isinstance(key, tuple) else key
+        entry = cache.get(key)
+        mtime = None
+        if self.debug:
+            try:
+                mtime = os.stat(filename).st_mtime
+            except OSError:
+                cache.pop(key, None)
+                return
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        start = time.time()
+        value = loader(key)
+        self.load_time += time.time() - start
+        cache[key] = (mtime, value)
+        return value
+
+    def _read(self, filename):
+        with open(filename, 'r') as file:
+            return file.read()
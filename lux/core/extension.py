@@ -8,19 +8,41 @@ from pulsar import HttpException
 
 from lux import __version__
 
+from .metrics import clock
 
-__all__ = ['Extension', 'Parameter']
+
+__all__ = ['Extension', 'Parameter', 'static_html']
 
 # All events are fired with app as first positional argument
 ALL_EVENTS = ('on_config',  # Config ready.
               'on_loaded',  # Wsgi handler ready.
               'on_start',  # Wsgi server starts. Extra args: server
+              'on_worker_start',  # Preloaded app in worker. Extra args: worker
+              'on_worker_stopping',  # Worker stopping. Extra args: worker
               'on_request',  # Fired when a new request arrives
+              'on_html_skeleton',  # Static html doc built. Extra args: html
               'on_html_document',  # Html doc built. Extra args: request, html
               'on_form',  # Form constructed. Extra args: form
               )
 
 
+def static_html(method):
+    '''Decorator for ``on_html_document`` event handlers which do not
+    depend on the request.
+
+    Decorated handlers are invoked once only, with ``request`` set to
+    ``None``, when the :attr:`.Application.html_skeleton` is built::
+
+        class Extension(lux.Extension):
+
+            @lux.static_html
+            def on_html_document(self, app, request, doc):
+                doc.head.links.append('mystyles')
+    '''
+    method.static_html = True
+    return method
+
+
 class Parameter(object):
     '''Class for defining a lux :ref:`parameter <parameters>` within
     a lux :class:`.Extension`.
@@ -235,8 +257,19 @@ class EventHandler:
         return getattr(self.extension, self.name)(*args)
 
 
+class StaticHtmlHandler(EventHandler):
+    '''Invoke an ``on_html_document`` handler decorated with
+    :func:`static_html` from the ``on_html_skeleton`` event
+    '''
+    __slots__ = ()
+
+    def __call__(self, app, doc):
+        return getattr(self.extension, self.name)(app, None, doc)
+
+
 class EventMixin:
     events = None
+    metrics = None
 
     def bind_events(self, extension, all_events=None, exclude=None):
         '''Bind ``all_events`` to an ``extension``.
@@ -258,15 +291,32 @@ class EventMixin:
                 events[name] = []
             handlers = events[name]
             if hasattr(extension, name):
-                handlers.append(EventHandler(extension, name))
+                handler = getattr(extension, name)
+                if (name == 'on_html_document' and
+                        getattr(handler, 'static_html', False)):
+                    events.setdefault('on_html_skeleton', []).append(
+                        StaticHtmlHandler(extension, name))
+                else:
+                    handlers.append(EventHandler(extension, name))
 
     def fire(self, event, *args):
         '''Fire an ``event``.'''
         handlers = self.events.get(event) if self.events else None
         if handlers:
+            metrics = self.metrics
+            if metrics and not metrics.enabled:
+                metrics = None
             for handler in handlers:
                 try:
-                    handler(self, *args)
+                    if metrics:
+                        start = clock()
+                        try:
+                            handler(self, *args)
+                        finally:
+                            metrics.event_histogram(event, handler).observe(
+                                clock() - start)
+                    else:
+                        handler(self, *args)
                 except HttpException:
                     raise
                 except Exception:
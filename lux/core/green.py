@@ -0,0 +1,200 @@
+'''Selective dispatch to the green pool.
+
+When :setting:`GREEN_POOL` is set, the whole WSGI handler runs on a pool
+of greenlets. With :setting:`GREEN_POOL_SELECTIVE` the handler runs on
+the event loop and only work declared as blocking is submitted to the
+pool:
+
+* WSGI middleware with a ``blocking`` attribute set to ``True``
+* WSGI middleware with a ``blocks(environ)`` method, only for the
+  requests for which it returns ``True``. For example the response
+  cache blocks only on requests served by a router with a cache policy
+* routers with a ``blocking`` attribute set to ``True``, children
+  routers included
+* router methods decorated with :func:`blocking`::
+
+    class Articles(lux.Router):
+
+        @lux.blocking
+        def get(self, request):
+            with request.app.odm().begin() as session:
+                ...
+
+When metrics are enabled, the time a request waits for a greenlet and
+the number of requests waiting and running are recorded.
+'''
+from pulsar import get_actor
+from pulsar.apps.wsgi import Router
+
+from .dispatch import RouterIndex
+from .metrics import (Timed, clock, GREEN_WAIT, GREEN_QUEUED,
+                      GREEN_ACTIVE)
+
+
+try:
+    from greenlet import getcurrent
+except ImportError:     # pragma    nocover
+    getcurrent = None
+
+
+__all__ = ['blocking', 'GreenDispatch']
+
+
+METHODS = ('get', 'head', 'post', 'put', 'patch', 'delete', 'options')
+
+
+def blocking(method):
+    '''Decorator for router methods which block on I/O
+    '''
+    method.blocking = True
+    return method
+
+
+def is_blocking(obj):
+    return getattr(obj, 'blocking', False) is True
+
+
+def on_event_loop():
+    '''``True`` when running on the thread of the event loop rather than
+    on a greenlet of the green pool or an executor thread
+    '''
+    if getcurrent and getcurrent().parent:
+        return False
+    return get_actor() is not None
+
+
+class GreenDispatch:
+    '''Submit blocking middleware and router methods of an ``app`` to its
+    :attr:`~.Application.green_pool`.
+
+    .. attribute:: queued
+
+        Number of submitted calls waiting for a greenlet
+
+    .. attribute:: active
+
+        Number of submitted calls running on a greenlet
+    '''
+    def __init__(self, app):
+        from pulsar.apps.greenio import wait
+        self.app = app
+        self.queued = 0
+        self.active = 0
+        self.wait = wait
+        self.histogram = None
+        metrics = app.metrics
+        if metrics:
+            self.histogram = metrics.histogram(GREEN_WAIT)
+            metrics.gauge(GREEN_QUEUED, lambda: self.queued)
+            metrics.gauge(GREEN_ACTIVE, lambda: self.active)
+
+    def __repr__(self):
+        return '%s(queued=%d, active=%d)' % (self.__class__.__name__,
+                                             self.queued, self.active)
+    __str__ = __repr__
+
+    def instrument(self, handler):
+        '''Wrap blocking middleware and routers of a WSGI ``handler``.
+
+        Return the number of wrapped callables.
+        '''
+        count = 0
+        middleware = []
+        for wsgi in handler.middleware:
+            inner = wsgi.wsgi if isinstance(wsgi, Timed) else wsgi
+            if isinstance(inner, Router):
+                count += self.instrument_router(inner)
+            elif isinstance(inner, RouterIndex):
+                for router in inner.routers:
+                    count += self.instrument_router(router)
+            elif is_blocking(inner):
+                wsgi = GreenMiddleware(self, wsgi)
+                count += 1
+            elif callable(getattr(inner, 'blocks', None)):
+                wsgi = GreenMiddleware(self, wsgi, inner.blocks)
+                count += 1
+            middleware.append(wsgi)
+        handler.middleware = middleware
+        return count
+
+    def instrument_router(self, router, parent=False):
+        '''Wrap the ``response`` method of ``router`` and of its children
+        when they are blocking
+        '''
+        count = 0
+        block = parent or is_blocking(router)
+        if block:
+            methods = None
+        else:
+            methods = frozenset((method.upper() for method in METHODS
+                                 if is_blocking(getattr(router, method,
+                                                        None))))
+        if block or methods:
+            router.response = GreenResponse(self, router.response, methods)
+            count += 1
+        for child in router.routes:
+            count += self.instrument_router(child, block)
+        return count
+
+    def submit(self, callable, environ, arg):
+        '''Submit ``callable`` to the green pool
+        '''
+        self.queued += 1
+        return self.app.green_pool.submit(self._run, clock(), callable,
+                                          environ, arg)
+
+    def _run(self, submitted, callable, environ, arg):
+        # Running on a greenlet
+        self.queued -= 1
+        histogram = self.histogram
+        if histogram and self.app.metrics.enabled:
+            histogram.observe(clock() - submitted)
+        self.active += 1
+        try:
+            return self.wait(callable(environ, arg))
+        finally:
+            self.active -= 1
+
+
+class GreenMiddleware:
+    '''Wrap a blocking WSGI middleware.
+
+    When ``blocks`` is given, only requests for which it returns ``True``
+    are submitted to the pool.
+    '''
+    __slots__ = ('dispatch', 'wsgi', 'blocks')
+
+    def __init__(self, dispatch, wsgi, blocks=None):
+        self.dispatch = dispatch
+        self.wsgi = wsgi
+        self.blocks = blocks
+
+    def __repr__(self):
+        return repr(self.wsgi)
+    __str__ = __repr__
+
+    def __call__(self, environ, start_response):
+        blocks = self.blocks
+        if blocks and not blocks(environ):
+            return self.wsgi(environ, start_response)
+        return self.dispatch.submit(self.wsgi, environ, start_response)
+
+
+class GreenResponse:
+    '''Wrap the ``response`` method of a router.
+
+    When ``methods`` is given, only requests with these HTTP methods are
+    submitted to the pool.
+    '''
+    __slots__ = ('dispatch', 'response', 'methods')
+
+    def __init__(self, dispatch, response, methods=None):
+        self.dispatch = dispatch
+        self.response = response
+        self.methods = methods
+
+    def __call__(self, environ, args):
+        methods = self.methods
+        if methods and environ.get('REQUEST_METHOD', 'GET') not in methods:
+            return self.response(environ, args)
+        return self.dispatch.submit(self.response, environ, args)
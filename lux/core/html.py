@@ -0,0 +1,184 @@
+'''Per-request HTML documents built from a pre-rendered skeleton.
+
+The :attr:`.Application.html_skeleton` is built once and converted into
+a :class:`StaticDocument` which holds the rendered markup of its meta
+tags, links, scripts and embedded css and javascript. Every request gets
+a :class:`Document` whose head containers start as shallow copies of
+the static markup and whose ``jscontext`` is a shallow copy of the
+skeleton context. Static meta tags are copied only when modified via
+:meth:`DocumentHead.replace_meta`.
+
+Nested values of the ``jscontext`` are shared by all documents and
+must be replaced rather than modified in place.
+
+Copies share the children and attributes of pulsar :class:`.Html`
+elements without the public API, which would rebuild them. The
+internals used are those of the pulsar versions in
+:data:`PULSAR_VERSIONS` and are verified by :func:`check_pulsar` when
+the first :class:`StaticDocument` is built.
+'''
+import pulsar
+from pulsar import ImproperlyConfigured
+from pulsar.apps.wsgi import Html, HtmlDocument
+from pulsar.apps.wsgi.content import Head, Links
+
+from .wrappers import HeadMeta
+
+
+__all__ = ['StaticDocument', 'Document', 'check_pulsar']
+
+
+# pulsar versions whose Html internals are shared by documents
+PULSAR_VERSIONS = ((1, 0),)
+
+_checked = False
+
+
+class StaticHtml(Html):
+    '''An :class:`.Html` element rendered once and shared by documents.
+
+    It can be streamed any number of times and it is replaced by a
+    :meth:`copy` before being modified.
+    '''
+    def __init__(self, html):
+        super().__init__(html.tag)
+        self._extra = html._extra
+        self._children = html._children
+        self._rendered = ''.join(Html.do_stream(self, None))
+
+    def stream(self, request):
+        return (self._rendered,)
+
+    def copy(self):
+        html = Html(self._tag)
+        html._extra = dict(((name, value.copy())
+                            for name, value in self._extra.items()))
+        if self._children:
+            html._children = list(self._children)
+        return html
+
+
+class DocumentHead(Head):
+    '''The :class:`.Head` of a :class:`Document`
+    '''
+    def replace_meta(self, name, content=None, meta_key=None):
+        children = self.meta._children
+        key = meta_key or 'name'
+        for index, child in enumerate(children):
+            if isinstance(child, StaticHtml) and child.attr(key) == name:
+                child = child.copy()
+                child._parent = self.meta
+                children[index] = child
+                break
+        super().replace_meta(name, content, meta_key)
+
+
+class Document(HtmlDocument):
+    '''An :class:`.HtmlDocument` of a request built from a
+    :class:`StaticDocument`
+    '''
+    def __init__(self, static):
+        Html.__init__(self, None, charset=static.head_params['charset'])
+        self._extra = dict(((name, value.copy())
+                            for name, value in static.extra.items()))
+        self.head = head = DocumentHead(**static.head_params)
+        head.title = static.title
+        head.meta._children = list(static.meta)
+        head.links._children = list(static.links)
+        head.embedded_css._children = list(static.embedded_css)
+        head.embedded_js._children = list(static.embedded_js)
+        scripts = head.scripts
+        scripts._children = list(static.scripts)
+        scripts.require = list(static.require)
+        scripts.paths = dict(static.paths)
+        self.body = Html('body')
+        self.meta = HeadMeta(head)
+        self.jscontext = dict(static.jscontext)
+
+
+class StaticDocument:
+    '''The pre-rendered markup of an HTML ``skeleton`` document.
+
+    :param skeleton: the :class:`.HtmlDocument` with the request
+        independent content
+    :param links: optional links added by :meth:`add_links` after the
+        contributions of a request
+    '''
+    def __init__(self, skeleton, links=None):
+        check_pulsar()
+        head = skeleton.head
+        media = head.links
+        self.head_params = {'media_path': media.media_path,
+                            'minified': media.minified,
+                            'asset_protocol': media.asset_protocol,
+                            'charset': head.charset}
+        self.title = head.title
+        self.extra = skeleton._extra
+        self.jscontext = getattr(skeleton, 'jscontext', None) or {}
+        self.meta = static_children(head.meta)
+        self.links = tuple(media.children)
+        self.embedded_css = static_children(head.embedded_css)
+        self.embedded_js = static_children(head.embedded_js)
+        self.scripts = tuple(head.scripts.children)
+        self.require = tuple(head.scripts.require)
+        self.paths = dict(head.scripts.paths)
+        container = Links(media.media_path, minified=media.minified,
+                          asset_protocol=media.asset_protocol)
+        for link in links or ():
+            if isinstance(link, dict):
+                container.append(**link)
+            else:
+                container.append(link)
+        self.last_links = tuple(container.children)
+
+    def document(self):
+        '''A new :class:`Document`
+        '''
+        return Document(self)
+
+    def add_links(self, doc):
+        '''Add the rendered :setting:`HTML_LINKS` to ``doc``
+        '''
+        children = doc.head.links.children
+        for link in self.last_links:
+            if link not in children:
+                children.append(link)
+
+
+def check_pulsar():
+    '''Check the internals of pulsar :class:`.Html` elements shared by
+    documents are available.
+
+    :raise: :class:`.ImproperlyConfigured` when they are not
+    '''
+    global _checked
+    if _checked:
+        return
+    try:
+        html = Html('div', 'text', cn='a')
+        head = Head(media_path='/media/', minified=False,
+                    asset_protocol=None, charset='utf-8')
+        scripts = head.scripts
+        valid = (tuple(pulsar.VERSION[:2]) in PULSAR_VERSIONS and
+                 html._extra.get('classes') == set(('a',)) and
+                 html._children is html.children and
+                 isinstance(scripts.require, list) and
+                 isinstance(scripts.paths, dict) and
+                 all((isinstance(container._children, (list, type(None)))
+                      for container in (head.meta, head.links,
+                                        head.embedded_css,
+                                        head.embedded_js, scripts))))
+    except (AttributeError, TypeError):
+        valid = False
+    if not valid:
+        raise ImproperlyConfigured(
+            'Html documents require the internals of pulsar %s, pulsar '
+            '%s is installed' % (' or '.join(('%d.%d' % v for v in
+                                              PULSAR_VERSIONS)),
+                                 pulsar.__version__))
+    _checked = True
+
+
+def static_children(container):
+    return tuple((StaticHtml(child) if isinstance(child, Html) else child
+                  for child in container.children))
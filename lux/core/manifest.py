@@ -0,0 +1,157 @@
+'''Manifest of the commands available to an application.
+
+Commands are python modules in the ``commands`` package of extensions.
+The manifest locates these packages via the import machinery without
+importing them (nor the extensions they belong to) and caches the result
+in a JSON file. The file is invalidated when the list of extensions or
+the modification time of any of the ``commands`` directories changes.
+'''
+import os
+import sys
+import json
+import hashlib
+from collections import OrderedDict
+from importlib.machinery import PathFinder
+
+
+__all__ = ['CommandManifest']
+
+
+class CommandManifest:
+    '''Commands of ``extensions``.
+
+    :param extensions: list of extension names
+    :param filename: optional path of the JSON file where the manifest is
+        cached
+    '''
+    def __init__(self, extensions, filename=None):
+        self.extensions = tuple(extensions)
+        self.filename = filename
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.filename)
+    __str__ = __repr__
+
+    @classmethod
+    def default_filename(cls, config_module, extensions):
+        '''A file, unique for an application, in the ``lux`` directory of
+        the cache directory of the user (``$XDG_CACHE_HOME`` or
+        ``~/.cache``), or ``None`` when the directory is not available.
+
+        The directory is created readable only by the user, the manifest
+        is not shared with other users.
+        '''
+        key = '\n'.join((sys.prefix, config_module) + tuple(extensions))
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        base = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+        if not os.path.isabs(base):
+            return
+        directory = os.path.join(base, 'lux')
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        except OSError:
+            return
+        return os.path.join(directory, 'commands-%s.json' % key)
+
+    def commands(self):
+        '''Ordered dictionary of extension names and their commands
+        '''
+        entries = self.read()
+        if entries is None:
+            entries = self.build()
+            self.write(entries)
+        return OrderedDict(((name, tuple(commands))
+                            for name, _, _, commands in entries if commands))
+
+    def build(self):
+        '''Build the manifest entries.
+
+        An entry is a list containing the extension name, the directory
+        which invalidates the entry, its modification time and the list of
+        commands. When an extension has no ``commands`` package, its own
+        directory is watched so that adding the package invalidates the
+        manifest.
+        '''
+        entries = []
+        for name in self.extensions:
+            path = package_path(commands_module(name))
+            commands = []
+            if path:
+                try:
+                    commands = sorted((f[:-3] for f in os.listdir(path)
+                                       if not f.startswith('_') and
+                                       f.endswith('.py')))
+                except OSError:
+                    pass
+            else:
+                path = package_path(name)
+            entries.append([name, path, mtime(path), commands])
+        return entries
+
+    def read(self):
+        '''Read entries from the :attr:`filename`.
+
+        Return ``None`` if the manifest is not available or no longer
+        valid.
+        '''
+        if not self.filename:
+            return
+        try:
+            with open(self.filename, 'r') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if data.get('extensions') != list(self.extensions):
+            return
+        entries = data.get('commands') or []
+        for _, path, modified, _ in entries:
+            if mtime(path) != modified:
+                return
+        return entries
+
+    def write(self, entries):
+        if not self.filename:
+            return
+        data = {'extensions': list(self.extensions), 'commands': entries}
+        tmp = '%s.%d' % (self.filename, os.getpid())
+        try:
+            with open(tmp, 'w') as fp:
+                json.dump(data, fp)
+            os.replace(tmp, self.filename)
+        except OSError:
+            pass
+
+
+def commands_module(extension):
+    return extension + ('.core' if extension == 'lux' else '') + '.commands'
+
+
+def package_path(dotted_path):
+    '''Directory of the package at ``dotted_path`` or ``None``.
+
+    Packages already imported are looked up in :data:`sys.modules`, the
+    others are found via the path finder without executing them.
+    '''
+    path = None
+    name = ''
+    for bit in dotted_path.split('.'):
+        name = '%s.%s' % (name, bit) if name else bit
+        module = sys.modules.get(name)
+        if module is not None:
+            locations = getattr(module, '__path__', None)
+        else:
+            spec = PathFinder.find_spec(name, path)
+            locations = spec.submodule_search_locations if spec else None
+        if not locations:
+            return
+        path = list(locations)
+    return path[0]
+
+
+def mtime(path):
+    if path:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            pass
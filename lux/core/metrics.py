@@ -0,0 +1,399 @@
+'''Latency instrumentation of the WSGI handler.
+
+When the :setting:`METRICS_URL` parameter is set, the application
+records timing histograms for
+
+* the whole request, in :meth:`.Application.__call__`
+* each WSGI middleware and response middleware
+* each router method, labelled with the route and the HTTP method
+* each event handler fired via :meth:`.EventMixin.fire`
+
+Gauges, values sampled when metrics are served, can be registered via
+:meth:`Metrics.gauge`.
+
+Histograms have fixed buckets and timings use a monotonic clock, so that
+recording a value is a couple of additions. The numbers are served at
+:setting:`METRICS_URL` in the Prometheus text format.
+
+Collection can be switched on and off at runtime via the
+:attr:`Metrics.enabled` flag, the instrumentation stays in place and
+costs a single attribute lookup per call when switched off.
+
+Each pulsar worker has its own :class:`Metrics`. When
+:setting:`METRICS_DIR` is set, workers write a snapshot of their
+histograms into that directory every :setting:`METRICS_INTERVAL` seconds
+and the metrics endpoint aggregates the snapshots of all workers.
+'''
+import os
+import json
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from pulsar.apps.wsgi import Router
+
+from .dispatch import RouterIndex
+
+
+__all__ = ['Metrics', 'Histogram', 'MetricsRouter']
+
+
+clock = time.perf_counter
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST = 'lux_request_duration_seconds'
+MIDDLEWARE = 'lux_middleware_duration_seconds'
+RESPONSE_MIDDLEWARE = 'lux_response_middleware_duration_seconds'
+ROUTER = 'lux_router_duration_seconds'
+EVENT = 'lux_event_duration_seconds'
+GREEN_WAIT = 'lux_green_pool_wait_seconds'
+GREEN_QUEUED = 'lux_green_pool_queued'
+GREEN_ACTIVE = 'lux_green_pool_active'
+WRITE_BEHIND_FLUSH = 'lux_write_behind_flush_seconds'
+WRITE_BEHIND_PENDING = 'lux_write_behind_pending'
+WRITE_BEHIND_LAG = 'lux_write_behind_lag_seconds'
+
+HELP = {REQUEST: 'Time spent serving a request',
+        MIDDLEWARE: 'Time spent in WSGI middleware',
+        RESPONSE_MIDDLEWARE: 'Time spent in response middleware',
+        ROUTER: 'Time spent in router methods',
+        EVENT: 'Time spent in event handlers',
+        GREEN_WAIT: 'Time requests wait for a greenlet of the green pool',
+        GREEN_QUEUED: 'Requests waiting for a greenlet of the green pool',
+        GREEN_ACTIVE: 'Requests running on the green pool',
+        WRITE_BEHIND_FLUSH: 'Time spent writing buffered updates',
+        WRITE_BEHIND_PENDING: 'Updates waiting in the write-behind buffer',
+        WRITE_BEHIND_LAG: 'Age of the oldest buffered update'}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    '''A histogram with fixed :data:`BUCKETS`.
+
+    .. attribute:: counts
+
+        List of observations in each bucket, the last element counts
+        the observations larger than the last bucket
+
+    .. attribute:: sum
+
+        Sum of all observed values
+    '''
+    __slots__ = ('name', 'labels', 'counts', 'sum')
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+        self.counts = [0]*(len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def __repr__(self):
+        return '%s%s' % (self.name, format_labels(self.labels))
+    __str__ = __repr__
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    '''Collection of the :class:`Histogram` of an application.
+
+    .. attribute:: enabled
+
+        Runtime switch for recording timings
+
+    .. attribute:: directory
+
+        Optional directory where snapshots are written and aggregated
+    '''
+    def __init__(self, enabled=True, directory=None, interval=5):
+        self.enabled = enabled
+        self.directory = directory
+        self.interval = interval
+        self.histograms = OrderedDict()
+        self.gauges = OrderedDict()
+        self.request = self.histogram(REQUEST)
+        self._events = {}
+        self._dumped = clock()
+
+    def __repr__(self):
+        return '%s(%d histograms)' % (self.__class__.__name__,
+                                      len(self.histograms))
+    __str__ = __repr__
+
+    def histogram(self, name, **labels):
+        '''Get or create the :class:`Histogram` ``name`` with ``labels``
+        '''
+        labels = tuple(sorted(labels.items()))
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = Histogram(name, labels)
+            self.histograms[key] = histogram
+        return histogram
+
+    def gauge(self, name, value, **labels):
+        '''Register the gauge ``name`` with ``labels``.
+
+        :param value: a callable returning the current value of the gauge
+        '''
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def event_histogram(self, event, handler):
+        '''The :class:`Histogram` of an event ``handler``
+        '''
+        histogram = self._events.get(handler)
+        if histogram is None:
+            histogram = self.histogram(EVENT, event=event,
+                                       handler=str(handler))
+            self._events[handler] = histogram
+        return histogram
+
+    def instrument(self, handler):
+        '''Instrument the middleware of a WSGI ``handler``
+        '''
+        routers = []
+        middleware = []
+        for wsgi in handler.middleware:
+            if isinstance(wsgi, Router):
+                routers.append(wsgi)
+            else:
+                if isinstance(wsgi, RouterIndex):
+                    routers.extend(wsgi.routers)
+                wsgi = Timed(self, wsgi, MIDDLEWARE)
+            middleware.append(wsgi)
+        handler.middleware = middleware
+        handler.response_middleware = [
+            Timed(self, wsgi, RESPONSE_MIDDLEWARE)
+            for wsgi in handler.response_middleware]
+        for router in routers:
+            self.instrument_router(router)
+
+    def instrument_router(self, router, route=''):
+        '''Instrument the ``response`` method of ``router`` and of all its
+        children.
+
+        Routers are not wrapped so that the middleware list can still
+        be inspected for them.
+        '''
+        rule = router.route.rule.strip('/')
+        route = '/'.join((r for r in (route, rule) if r))
+        if not isinstance(router, MetricsRouter):
+            router.response = TimedResponse(self, router.response,
+                                            '/%s' % route)
+        for child in router.routes:
+            self.instrument_router(child, route)
+
+    def snapshot(self):
+        '''List of ``(name, labels, counts, sum)`` for all histograms.
+
+        Gauges are included with ``counts`` set to ``None`` and their
+        value as ``sum``.
+        '''
+        snapshot = [(h.name, h.labels, list(h.counts), h.sum)
+                    for h in tuple(self.histograms.values())]
+        for (name, labels), value in tuple(self.gauges.items()):
+            snapshot.append((name, labels, None, value()))
+        return snapshot
+
+    def reset(self):
+        '''Reset all histograms
+        '''
+        for histogram in self.histograms.values():
+            histogram.counts = [0]*len(histogram.counts)
+            histogram.sum = 0.0
+        self._dumped = clock()
+
+    def dump(self, force=False):
+        '''Write a :meth:`snapshot` into :attr:`directory`.
+
+        Unless ``force`` is ``True``, the snapshot is written at most every
+        :attr:`interval` seconds. The file is replaced atomically so that
+        readers never see a partial snapshot.
+        '''
+        if not self.directory:
+            return
+        now = clock()
+        if not force and now - self._dumped < self.interval:
+            return
+        self._dumped = now
+        filename = os.path.join(self.directory, '%d.json' % os.getpid())
+        tmp = '%s.tmp' % filename
+        with open(tmp, 'w') as fp:
+            json.dump(self.snapshot(), fp)
+        os.replace(tmp, filename)
+
+    def clear_snapshots(self):
+        '''Remove snapshots from :attr:`directory`
+        '''
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+        elif self.directory:
+            os.makedirs(self.directory)
+
+    def aggregate(self):
+        '''Aggregate the histograms of this process with the snapshots of
+        the other workers.
+
+        :return: a two elements tuple with the number of processes
+            and an ordered dictionary of ``(name, labels)``,
+            ``[counts, sum]`` pairs.
+        '''
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            this = '%d.json' % os.getpid()
+            for name in os.listdir(self.directory):
+                if name == this or not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as fp:
+                        snapshots.append(json.load(fp))
+                except (OSError, ValueError):
+                    continue
+        data = OrderedDict()
+        for snapshot in snapshots:
+            for name, labels, counts, total in snapshot:
+                key = (name, tuple(tuple(label) for label in labels))
+                entry = data.get(key)
+                if entry is None:
+                    data[key] = [counts and list(counts), total]
+                elif counts is None:
+                    entry[1] += total
+                else:
+                    entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                    entry[1] += total
+        return len(snapshots), data
+
+    def prometheus(self):
+        '''The aggregated histograms in the Prometheus text format
+        '''
+        workers, data = self.aggregate()
+        lines = ['# HELP lux_metrics_workers Processes aggregated',
+                 '# TYPE lux_metrics_workers gauge',
+                 'lux_metrics_workers %d' % workers]
+        current = None
+        for (name, labels), (counts, total) in data.items():
+            if name != current:
+                current = name
+                lines.append('# HELP %s %s' % (name, HELP.get(name, name)))
+                lines.append('# TYPE %s %s' % (
+                    name, 'gauge' if counts is None else 'histogram'))
+            if counts is None:
+                lines.append('%s%s %r' % (name, format_labels(labels),
+                                          total))
+                continue
+            cumulative = 0
+            for bucket, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, format_labels(labels + (('le', bucket),)),
+                    cumulative))
+            lines.append('%s_sum%s %r' % (name, format_labels(labels),
+                                          total))
+            lines.append('%s_count%s %d' % (name, format_labels(labels),
+                                            cumulative))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class Timed:
+    '''Wrap a WSGI middleware or response middleware and record its
+    timing into a :class:`Histogram`.
+
+    For asynchronous middleware only the time taken to return the
+    future is recorded.
+    '''
+    __slots__ = ('metrics', 'wsgi', 'histogram')
+
+    def __init__(self, metrics, wsgi, name):
+        self.metrics = metrics
+        self.wsgi = wsgi
+        self.histogram = metrics.histogram(name,
+                                           middleware=callable_name(wsgi))
+
+    def __repr__(self):
+        return repr(self.wsgi)
+    __str__ = __repr__
+
+    def __call__(self, environ, arg):
+        if not self.metrics.enabled:
+            return self.wsgi(environ, arg)
+        start = clock()
+        try:
+            return self.wsgi(environ, arg)
+        finally:
+            self.histogram.observe(clock() - start)
+
+
+class TimedResponse:
+    '''Record the timing of the ``response`` method of a router.
+
+    A :class:`Histogram` is created the first time a given HTTP method
+    is served.
+    '''
+    __slots__ = ('metrics', 'response', 'route', 'histograms')
+
+    def __init__(self, metrics, response, route):
+        self.metrics = metrics
+        self.response = response
+        self.route = route
+        self.histograms = {}
+
+    def __call__(self, environ, args):
+        if not self.metrics.enabled:
+            return self.response(environ, args)
+        start = clock()
+        try:
+            return self.response(environ, args)
+        finally:
+            elapsed = clock() - start
+            method = environ.get('REQUEST_METHOD', 'GET')
+            histogram = self.histograms.get(method)
+            if histogram is None:
+                histogram = self.metrics.histogram(ROUTER, route=self.route,
+                                                   method=method)
+                self.histograms[method] = histogram
+            histogram.observe(elapsed)
+
+
+class MetricsRouter(Router):
+    '''Serve the application :class:`Metrics` in the Prometheus text
+    format
+    '''
+    def get(self, request):
+        metrics = request.app.metrics
+        response = request.response
+        response.content_type = CONTENT_TYPE
+        response.content = metrics.prometheus().encode('utf-8')
+        return response
+
+
+def callable_name(wsgi):
+    if hasattr(wsgi, '__qualname__'):
+        return '%s.%s' % (wsgi.__module__, wsgi.__qualname__)
+    cls = type(wsgi)
+    return '%s.%s' % (cls.__module__, cls.__qualname__)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(('%s="%s"' % (name, escape(value))
+                              for name, value in labels))
+
+
+def escape(value):
+    if not isinstance(value, str):
+        value = repr(value)
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+                                                                   '\\n')
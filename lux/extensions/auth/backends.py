@@ -1,15 +1,53 @@
+import json
+
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
+from pulsar.utils.pep import to_string
+
+from lux.core.cache import LRUCache
 from lux.extensions.rest import (PasswordMixin, backends, normalise_email,
-                                 AuthenticationError, READ)
+                                 AuthenticationError, READ, CREATE, UPDATE,
+                                 DELETE)
 
+from .models import PermissionType
 from .views import Authorization
 
 
+# PermissionType required by a permission level
+LEVELS = {READ: PermissionType.can_view.value,
+          CREATE: PermissionType.can_add.value,
+          UPDATE: PermissionType.can_change.value,
+          DELETE: PermissionType.can_remove.value}
+
+# Changes of these tables invalidate the permissions of all users
+PERMISSION_TABLES = frozenset(('permission', 'group', 'users_permissions',
+                               'users_groups', 'groups_permissions'))
+
+
 class AuthMixin(PasswordMixin):
     '''Mixin to implement authentication backend based on
     SQLAlchemy models
     '''
+    def on_config(self, app):
+        super().on_config(app)
+        cfg = app.config
+        self.permissions_cache = LRUCache(
+            max_entries=cfg['PERMISSIONS_CACHE_ENTRIES'],
+            timeout=cfg['PERMISSIONS_CACHE_TIMEOUT'])
+
+    def on_model_changes(self, app, changes, remote):
+        '''Invalidate cached permissions of changed users, or of all users
+        when permissions or groups change
+        '''
+        cache = self.permissions_cache
+        for change in changes:
+            if change.table in PERMISSION_TABLES:
+                cache.clear()
+                break
+            elif change.table == 'user':
+                cache.pop(change.pk)
 
     def get_user(self, request, user_id=None, username=None, email=None,
                  **kw):
@@ -35,6 +73,18 @@ class AuthMixin(PasswordMixin):
 
         return user
 
+    def user_copy(self, request, user):
+        '''A new detached instance with the loaded columns of ``user``,
+        relationships are not copied
+        '''
+        state = inspect(user)
+        mapper = state.mapper
+        copy = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            if attr.key in state.dict:
+                set_committed_value(copy, attr.key, state.dict[attr.key])
+        return copy
+
     def authenticate(self, request, user_id=None, username=None, email=None,
                      password=None, **kw):
         odm = request.app.odm()
@@ -67,11 +117,61 @@ class AuthMixin(PasswordMixin):
         # Superuser, always true
         if user.is_superuser():
             return True
+        elif level <= READ:
+            return True
         else:
-            if level <= READ:
-                return True
-            else:
-                return False
+            granted = self.permissions(request).get(name, ())
+            return LEVELS.get(level, level) in granted
+
+    def permissions(self, request):
+        '''Permissions of the request user.
+
+        A dictionary mapping table names to the frozenset of
+        :class:`.PermissionType` values granted to the user, directly or
+        via its groups. Each type is granted on its own, ``can_remove``
+        does not imply ``can_change``.
+
+        Permissions are cached in the request cache and, for
+        :setting:`PERMISSIONS_CACHE_TIMEOUT` seconds, in the memory of the
+        process. Model changes invalidate the cache of the process making
+        them and, only when :setting:`MODEL_CHANGES_CHANNEL` is set, of
+        the other workers, otherwise revoked permissions are granted by
+        other workers until they expire.
+        '''
+        cache = request.cache
+        permissions = cache.permissions
+        if permissions is None:
+            user = cache.user
+            permissions = {}
+            if user.is_authenticated():
+                permissions = self.permissions_cache.get(user.id)
+                if permissions is None:
+                    permissions = self.load_permissions(request, user.id)
+                    self.permissions_cache.set(user.id, permissions)
+            cache.permissions = permissions
+        return permissions
+
+    def load_permissions(self, request, user_id):
+        '''Load the permissions of ``user_id`` in one query
+        '''
+        odm = request.app.odm()
+        user, group, permission = odm.user, odm.group, odm.permission
+        columns = (permission.content_table_name, permission.type)
+        with odm.begin() as session:
+            direct = (session.query(*columns).select_from(user)
+                      .join(user.permissions)
+                      .filter(user.id == user_id))
+            grouped = (session.query(*columns).select_from(user)
+                       .join(user.groups).join(group.permissions)
+                       .filter(user.id == user_id))
+            rows = direct.union_all(grouped).all()
+        permissions = {}
+        for name, type in rows:
+            value = getattr(type, 'value', type)
+            if value is not None:
+                permissions.setdefault(name, set()).add(int(value))
+        return dict(((name, frozenset(values))
+                     for name, values in permissions.items()))
 
     def create_user(self, request, username=None, password=None, email=None,
                     first_name=None, last_name=None, active=False,
@@ -110,6 +210,24 @@ class TokenBackend(AuthMixin, backends.TokenBackend):
         super().on_config(app)
         backends.TokenBackend.on_config(self, app)
 
+    def on_model_changes(self, app, changes, remote):
+        '''Revoke cached tokens which have been deleted and tokens of
+        changed users, deactivated users included
+        '''
+        super().on_model_changes(app, changes, remote)
+        for change in changes:
+            if change.table == 'user':
+                self.revoke(user_id=change.pk)
+            elif change.table == 'token' and change.operation == 'delete':
+                self.revoke(token_id=change.pk)
+
+    def accessed(self, request, claims):
+        '''Record the last access of the token in the write-behind buffer
+        '''
+        token_id = claims.get('token_id')
+        if token_id:
+            request.app.write_behind.touch('token', token_id, 'last_access')
+
     def api_sections(self, app):
         yield Authorization()
 
@@ -134,20 +252,28 @@ class TokenBackend(AuthMixin, backends.TokenBackend):
 class SessionBackend(AuthMixin, backends.SessionBackend):
     '''An authentication backend based on sessions stored in the
     cache server and user in SqlAlchemy
-    '''
-    def get_session(self, key):
-        return self.app.cache_server.hmget('session:%s' % key)
 
-    def session_key(self, session):
-        '''Session key from session object
-        '''
-        return session['id']
+    Sessions are stored as hashes of JSON encoded fields, only the fields
+    changed during a request are written.
+    '''
+    def session_data(self, key):
+        data = self.app.cache_server.hgetall('session:%s' % key)
+        if data:
+            return dict(((to_string(name), json.loads(to_string(value)))
+                         for name, value in data.items()))
 
     def session_save(self, session):
-        key = 'session:%s' % session['id']
-        self.app.cache_server.hmset(key, session)
+        key = 'session:%s' % session.id
+        new = session.new
+        changed, deleted = session.changes()
+        cache = self.app.cache_server
+        if changed:
+            cache.hmset(key, dict(((name, json.dumps(value))
+                                   for name, value in changed.items())))
+        if deleted:
+            cache.hdel(key, *deleted)
+        if new:
+            cache.expire(key, self.session_timeout(session))
 
-    def session_create(self, request, user=None, expiry=None):
-        '''Create a new session
-        '''
-        raise NotImplementedError
+    def session_delete(self, session):
+        self.app.cache_server.delete('session:%s' % session.id)
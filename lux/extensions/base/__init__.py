@@ -10,17 +10,41 @@ When the :setting:`SERVE_STATIC_FILES` parameter is set to ``True``,
 this extension adds middleware for serving static files from
 :setting:`MEDIA_URL`.
 In addition, a :setting:`FAVICON` location can also be specified.
+
+Response Cache
+======================
+When :setting:`RESPONSE_CACHE` is ``True`` (default), responses of routers
+with a :class:`.CachePolicy` in their ``response_cache`` attribute are
+stored in the :attr:`.Application.cache_server`.
+
+Rate Limits
+======================
+Requests are counted against the :setting:`RATE_LIMIT` and the
+:class:`~lux.utils.http.RateLimit` of routers in their ``rate_limit``
+attribute by the :attr:`.Application.rate_limiter` middleware, which
+responds with a ``429`` status code when a client is over the limit.
+With :setting:`RATE_LIMIT_BACKEND` set to ``cache``, requests are counted
+in the :attr:`.Application.cache_server` and limits are shared by all
+workers.
+
+.. automodule:: lux.extensions.base.cache
+   :members:
 '''
 import os
 import hashlib
+from itertools import chain
 
 from pulsar.apps import wsgi
 from pulsar.utils.httpurl import remove_double_slash, urlparse
 
 import lux
 from lux import Parameter
+from lux.core.cache import DummyStore
+from lux.utils.http import (RateLimit, RateLimiter, TokenBucket,
+                            SlidingWindow)
 
 from .media import FileRouter, MediaRouter
+from .cache import CachePolicy, ResponseCache
 
 
 class Extension(lux.Extension):
@@ -29,6 +53,11 @@ class Extension(lux.Extension):
                   'If a positive integer, a response middleware is added so '
                   'that it encodes the response via the gzip algorithm.'),
         Parameter('USE_ETAGS', False, ''),
+        Parameter('ETAG_MAX_SIZE', 1048576,
+                  'Maximum size in bytes of a streaming response which is '
+                  'buffered to compute its entity tag when '
+                  ':setting:`USE_ETAGS` is ``True``. Longer streams are '
+                  'sent without an entity tag'),
         Parameter('CLEAN_URL', False,
                   'When ``True``, requests on urls with consecutive slashes '
                   'are converted to valid url and redirected.'),
@@ -36,13 +65,47 @@ class Extension(lux.Extension):
                   'if ``True`` add middleware to serve static files.'),
         Parameter('FAVICON', None,
                   'Adds tag of type ``image/x-icon`` in the head section of'
-                  ' the Html document')]
+                  ' the Html document'),
+        Parameter('RESPONSE_CACHE', True,
+                  'Serve and store responses of routers with a '
+                  '``response_cache`` policy via the cache server'),
+        Parameter('RATE_LIMIT', None,
+                  'Rate limit of all requests as "<requests>/<seconds>", '
+                  'for example "1000/3600"'),
+        Parameter('RATE_LIMIT_SCOPE', 'ip',
+                  'Clients of the RATE_LIMIT, one of "ip", "token" and '
+                  '"user"'),
+        Parameter('RATE_LIMIT_BACKEND', 'memory',
+                  'Count requests in the memory of each process '
+                  '("memory") or in the cache server shared by all '
+                  'workers ("cache")'),
+        Parameter('RATE_LIMIT_BATCH', 10,
+                  'Number of requests counted by a worker before adding '
+                  'them to the cache server')]
+    response_cache = None
 
     def middleware(self, app):
         '''Add two middleware handlers if configured to do so.'''
-        middleware = []
+        cfg = app.config
+        limit = cfg['RATE_LIMIT']
+        if limit:
+            limit = RateLimit.parse(limit, cfg['RATE_LIMIT_SCOPE'])
+        backend = TokenBucket()
+        if cfg['RATE_LIMIT_BACKEND'] == 'cache':
+            if isinstance(app.cache_server, DummyStore):
+                app.logger.warning('Rate limits are counted in memory, '
+                                   'no cache server available')
+            else:
+                backend = SlidingWindow(app.cache_server,
+                                        cfg['RATE_LIMIT_BATCH'])
+        app.rate_limiter = RateLimiter(backend, limit)
+        # shed clients over the limit before any other middleware
+        middleware = [app.rate_limiter]
         if app.config['CLEAN_URL']:
             middleware.append(wsgi.clean_path_middleware)
+        if app.config['RESPONSE_CACHE']:
+            self.response_cache = ResponseCache()
+            middleware.append(self.response_cache)
         if app.config['SERVE_STATIC_FILES']:
             path = app.config['MEDIA_URL']
             middleware.append(MediaRouter(path, app.meta.media_dir,
@@ -51,14 +114,35 @@ class Extension(lux.Extension):
 
     def response_middleware(self, app):
         gzip = app.config['GZIP_MIN_LENGTH']
-        middleware = []
+        middleware = [app.rate_limiter.headers]
+        if self.response_cache:
+            # Response middleware are executed in reversed order,
+            # store responses after they have been encoded
+            middleware.append(self.response_cache.store)
         if gzip:
             middleware.append(wsgi.GZipMiddleware(gzip))
         if app.config['USE_ETAGS']:
             middleware.append(self.etag)
         return middleware
 
-    def on_html_document(self, app, request, doc):
+    def on_loaded(self, app):
+        app.rate_limiter.setup(app.handler.middleware)
+        if self.response_cache:
+            self.response_cache.setup(app, app.handler.middleware)
+
+    def on_worker_start(self, app, worker):
+        '''Count requests with the cache server of the worker'''
+        backend = app.rate_limiter.backend
+        if isinstance(backend, SlidingWindow):
+            backend.cache = app.cache_server
+
+    def on_model_changes(self, app, changes, remote):
+        '''Invalidate cached responses depending on changed tables'''
+        if self.response_cache:
+            tables = set((change.table for change in changes))
+            self.response_cache.invalidate(app.cache_server, tables)
+
+    def on_html_skeleton(self, app, doc):
         favicon = app.config['FAVICON']
         if favicon:
             parsed = urlparse(favicon)
@@ -75,10 +159,9 @@ class Extension(lux.Extension):
     def etag(self, environ, response):
         if response.has_header('ETag'):
             etag = response['ETag']
-        elif response.streaming:
-            etag = None
         else:
-            etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+            config = wsgi.wsgi_request(environ).config
+            etag = content_etag(response, config['ETAG_MAX_SIZE'])
         if etag is not None:
             if (200 <= response.status_code < 300 and
                     environ.get('HTTP_IF_NONE_MATCH') == etag):
@@ -86,3 +169,44 @@ class Extension(lux.Extension):
             else:
                 response['ETag'] = etag
         return response
+
+
+def content_etag(response, max_size=None):
+    '''Entity tag from the md5 of the response content.
+
+    The content is hashed chunk by chunk. A streaming response is hashed
+    while its chunks are read and it is given back the read chunks, so
+    that its body is never joined. The headers are sent before the body,
+    therefore the chunks are buffered up to ``max_size`` bytes: when the
+    stream is longer, or when it yields a chunk which is neither ``bytes``
+    nor ``str`` (asynchronous content), the response is left untouched,
+    streaming from where it was, and no entity tag is returned.
+
+    ``str`` chunks are encoded with the response ``encoding`` (``utf-8``
+    by default), as the wsgi server does when writing them, so that
+    streams of text, such as NDJSON collections, get an entity tag when
+    they are within ``max_size``.
+    '''
+    md5 = hashlib.md5()
+    if response.streaming:
+        encoding = response.encoding or 'utf-8'
+        chunks = []
+        size = 0
+        content = iter(response.content)
+        for chunk in content:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(encoding)
+            elif not isinstance(chunk, bytes):
+                response.content = chain(chunks, (chunk,), content)
+                return
+            size += len(chunk)
+            chunks.append(chunk)
+            if max_size is not None and size > max_size:
+                response.content = chain(chunks, content)
+                return
+            md5.update(chunk)
+        response.content = chunks
+    else:
+        for chunk in response.content:
+            md5.update(chunk)
+    return '"%s"' % md5.hexdigest()
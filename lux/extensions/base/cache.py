@@ -0,0 +1,327 @@
+'''Full-page response cache.
+
+A router opts in by setting the ``response_cache`` attribute to a
+:class:`CachePolicy`::
+
+    from lux.extensions.base import CachePolicy
+
+    class Blog(lux.HtmlRouter):
+        response_cache = CachePolicy(timeout=300, stale=60)
+
+Responses to ``GET`` requests are stored in the
+:attr:`.Application.cache_server` under a key built from the path, the
+normalised query string, the content type negotiated from the ``Accept``
+header, whether the client accepts gzip encoding, the other headers in
+:attr:`CachePolicy.vary` and the authentication state of the request.
+
+Requests carrying credentials (an ``Authorization`` header or the
+session cookie) bypass the cache unless the policy is ``private``, in
+which case the credential is part of the key.
+
+Entries of a policy with ``tables`` are invalidated when rows of these
+tables change, via the ``on_model_changes`` event of the
+:mod:`~lux.extensions.odm` extension.
+
+When an entry is older than the policy ``timeout`` but younger than
+``timeout + stale`` it is served stale while a single request renders
+a fresh copy. Renders are guarded by a lock in the cache server, so
+that a cache miss under load triggers only one render; other requests
+wait for the entry when running on a greenlet or a thread. With
+:setting:`GREEN_POOL_SELECTIVE`, requests served by a router with a
+policy are submitted to the green pool, other requests stay on the
+event loop.
+'''
+import time
+import pickle
+import hashlib
+import threading
+from itertools import chain
+from collections import Counter
+from urllib.parse import parse_qsl, urlencode
+
+from pulsar.apps.wsgi import Router, wsgi_request
+
+from lux.core.cache import DummyStore
+from lux.core.dispatch import RouterIndex
+
+try:
+    from greenlet import getcurrent
+except ImportError:     # pragma    nocover
+    getcurrent = None
+
+
+__all__ = ['CachePolicy', 'ResponseCache']
+
+
+FLIGHT = 'lux.response_cache'
+ROUTER = 'lux.response_cache.router'
+
+
+class CachePolicy:
+    '''Response cache policy of a router.
+
+    :param timeout: seconds a response is fresh
+    :param stale: seconds a response can be served stale while a fresh
+        copy is rendered
+    :param vary: additional request headers which are part of the key
+    :param private: cache responses of authenticated requests, per
+        credential
+    :param status_codes: response status codes which can be stored
+    :param lock_timeout: seconds after which the render lock expires
+    :param wait: maximum seconds to wait for a concurrent render
+    :param tables: names of database tables the responses depend on
+    '''
+    def __init__(self, timeout=60, stale=0, vary=None, private=False,
+                 status_codes=(200,), lock_timeout=10, wait=5, tables=None):
+        self.timeout = timeout
+        self.stale = stale
+        self.vary = tuple(vary or ())
+        self.private = private
+        self.status_codes = frozenset(status_codes)
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.tables = tuple(tables or ())
+
+    def __repr__(self):
+        return '%s(timeout=%s, stale=%s)' % (self.__class__.__name__,
+                                             self.timeout, self.stale)
+    __str__ = __repr__
+
+    def key(self, request, router, credential):
+        '''The cache key of ``request`` served by ``router``
+        '''
+        environ = request.environ
+        query = parse_qsl(environ.get('QUERY_STRING', ''),
+                          keep_blank_values=True)
+        encoding = environ.get('HTTP_ACCEPT_ENCODING', '')
+        bits = [environ.get('PATH_INFO') or '/',
+                urlencode(sorted(query)),
+                str(router.content_type(request)),
+                'gzip' if 'gzip' in encoding else '',
+                credential or '']
+        for header in self.vary:
+            name = 'HTTP_%s' % header.upper().replace('-', '_')
+            bits.append(environ.get(name, ''))
+        if self.tables:
+            # a change of a table generation is a new key
+            cache = request.app.cache_server
+            for table in self.tables:
+                bits.append(str(cache.get(table_key(table)) or 0))
+        value = '\n'.join(bits).encode('utf-8')
+        return 'lux:response:%s' % hashlib.sha1(value).hexdigest()
+
+
+class ResponseCache:
+    '''Request and response middleware serving and storing responses of
+    routers with a :class:`CachePolicy`.
+
+    .. attribute:: counters
+
+        :class:`~collections.Counter` of ``hit``, ``stale``, ``miss``,
+        ``revalidate``, ``store``, ``invalidate`` and ``bypass:<reason>``
+        events
+
+    .. attribute:: tables
+
+        Names of the tables of all policies
+    '''
+    def __init__(self):
+        self.counters = Counter()
+        self.routers = ()
+        self.tables = frozenset()
+
+    def __repr__(self):
+        return self.__class__.__name__
+    __str__ = __repr__
+
+    def setup(self, app, middleware):
+        '''Collect routers from the ``middleware`` of the application.
+
+        Routers after the last router with a :class:`CachePolicy` are
+        discarded, since they cannot shadow a cached route.
+        '''
+        routers = []
+        for wsgi in middleware:
+            if isinstance(wsgi, RouterIndex):
+                routers.extend(wsgi.routers)
+            elif isinstance(wsgi, Router):
+                routers.append(wsgi)
+        while routers and not has_policy(routers[-1]):
+            routers.pop()
+        if routers and isinstance(app.cache_server, DummyStore):
+            app.logger.warning('Response cache requires a cache server')
+            routers = []
+        self.routers = tuple(routers)
+        self.tables = frozenset(chain.from_iterable(
+            (policy_tables(router) for router in routers)))
+
+    def router(self, environ):
+        '''The router with a :class:`CachePolicy` serving the ``GET``
+        request of ``environ``, or ``None``
+        '''
+        if ROUTER in environ:
+            return environ[ROUTER]
+        cached = None
+        if self.routers and environ.get('REQUEST_METHOD') == 'GET':
+            path = (environ.get('PATH_INFO') or '/')[1:]
+            for router in self.routers:
+                resolved = router.resolve(path)
+                if resolved:
+                    if getattr(resolved[0], 'response_cache', None):
+                        cached = resolved[0]
+                    break
+        environ[ROUTER] = cached
+        return cached
+
+    def blocks(self, environ):
+        '''Only requests served by a router with a :class:`CachePolicy`
+        access the cache server and wait for concurrent renders
+        '''
+        return self.router(environ) is not None
+
+    def __call__(self, environ, start_response):
+        router = self.router(environ)
+        if router is None:
+            return
+        policy = router.response_cache
+        request = wsgi_request(environ)
+        credential = self.credential(request)
+        if credential and not policy.private:
+            return self.bypass('auth')
+        key = policy.key(request, router, credential)
+        lock = '%s:lock' % key
+        cache = request.app.cache_server
+        if 'no-cache' in environ.get('HTTP_CACHE_CONTROL', ''):
+            self.bypass('no-cache')
+            environ[FLIGHT] = (key, policy, None)
+            return
+        entry = load(cache.get(key))
+        waited = 0
+        while True:
+            if entry:
+                age = time.time() - entry[0]
+                if age < policy.timeout:
+                    self.counters['hit'] += 1
+                    return self.cached(request, entry, 'HIT')
+                elif age < policy.timeout + policy.stale:
+                    if self.acquire(cache, lock, policy):
+                        self.counters['revalidate'] += 1
+                        environ[FLIGHT] = (key, policy, lock)
+                        return
+                    self.counters['stale'] += 1
+                    return self.cached(request, entry, 'STALE')
+            if self.acquire(cache, lock, policy):
+                self.counters['miss'] += 1
+                environ[FLIGHT] = (key, policy, lock)
+                return
+            if waited >= policy.wait or not sleep(0.05):
+                return self.bypass('locked')
+            waited += 0.05
+            entry = load(cache.get(key))
+
+    def store(self, environ, response):
+        '''Response middleware storing responses in the cache server
+        '''
+        flight = environ.pop(FLIGHT, None)
+        if not flight:
+            return response
+        key, policy, lock = flight
+        request = wsgi_request(environ)
+        cache = request.app.cache_server
+        try:
+            if response.status_code not in policy.status_codes:
+                self.bypass('status')
+            elif response.streaming:
+                self.bypass('streaming')
+            elif response.cookies:
+                self.bypass('cookie')
+            elif (response.has_header('Cache-Control') and
+                  'private' in response['Cache-Control']):
+                self.bypass('private')
+            else:
+                headers = [(name, value) for name, value
+                           in response.get_headers()
+                           if name.lower() != 'set-cookie']
+                entry = (time.time(), response.status_code, headers,
+                         b''.join(response.content))
+                cache.set(key, pickle.dumps(entry),
+                          ex=policy.timeout + policy.stale)
+                self.counters['store'] += 1
+                response['X-Cache'] = 'MISS'
+        finally:
+            if lock:
+                cache.delete(lock)
+        return response
+
+    def credential(self, request):
+        environ = request.environ
+        credential = environ.get('HTTP_AUTHORIZATION')
+        if not credential:
+            name = request.config.get('SESSION_COOKIE_NAME')
+            cookie = request.cookies.get(name) if name else None
+            credential = cookie.value if cookie else None
+        if credential:
+            return hashlib.sha1(credential.encode('utf-8')).hexdigest()
+
+    def cached(self, request, entry, status):
+        response = request.response
+        response.status_code = entry[1]
+        for name, value in entry[2]:
+            response[name] = value
+        response.content = entry[3]
+        response['X-Cache'] = status
+        return response
+
+    def acquire(self, cache, lock, policy):
+        return bool(cache.set(lock, 1, ex=policy.lock_timeout, nx=True))
+
+    def bypass(self, reason):
+        self.counters['bypass:%s' % reason] += 1
+
+    def invalidate(self, cache, tables):
+        '''Invalidate entries of policies depending on ``tables``
+        '''
+        tables = self.tables.intersection(tables)
+        for table in tables:
+            cache.incr(table_key(table))
+        self.counters['invalidate'] += len(tables)
+
+
+def table_key(table):
+    return 'lux:response:table:%s' % table
+
+
+def has_policy(router):
+    if getattr(router, 'response_cache', None):
+        return True
+    return any((has_policy(child) for child in router.routes))
+
+
+def policy_tables(router):
+    policy = getattr(router, 'response_cache', None)
+    if policy:
+        yield from policy.tables
+    for child in router.routes:
+        yield from policy_tables(child)
+
+
+def load(data):
+    if data:
+        return pickle.loads(data)
+
+
+def sleep(seconds):
+    '''Sleep without blocking other requests.
+
+    Return ``False`` when not possible, that is when not running on a
+    greenlet or a thread other than the main one.
+    '''
+    if getcurrent and getcurrent().parent:
+        import asyncio
+        from pulsar.apps.greenio import wait
+        wait(asyncio.sleep(seconds))
+    elif threading.current_thread() is not threading.main_thread():
+        time.sleep(seconds)
+    else:
+        return False
+    return True
@@ -37,7 +37,7 @@ class Extension(lux.Extension):
         Parameter('CODE_HIGHLIGHT_THEME', 'tomorrow',
                   'highlight.js theme')]
 
-    def on_html_document(self, app, request, doc):
+    def on_html_skeleton(self, app, doc):
         ngmodules = set(doc.jscontext.get('ngModules', ()))
         ngmodules.add('highlight')
         doc.jscontext['ngModules'] = list(ngmodules)
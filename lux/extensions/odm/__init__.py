@@ -18,12 +18,16 @@ import lux
 from lux import Parameter
 
 from pulsar.utils.log import LocalMixin
+from pulsar.utils.importer import module_attribute
 
 from .exc import *
 from .mapper import Mapper, Model
 from .views import CRUD, RestRouter
 from .models import RestModel
 from .forms import RelationshipField
+from .totals import *
+from .changes import *
+from .writebehind import *
 
 
 class Extension(lux.Extension):
@@ -33,12 +37,59 @@ class Extension(lux.Extension):
         Parameter('DATASTORE', None,
                   'Dictionary for mapping models to their back-ends database'),
         Parameter('DATABASE_SESSION_SIGNALS', True,
-                  'Register event handlers for database session')
+                  'Register event handlers for database session'),
+        Parameter('TOTAL_COUNT', 'lux.extensions.odm.Count',
+                  'Dotted path to the strategy counting the total number '
+                  'of items of collections. One of '
+                  'lux.extensions.odm.Count (exact), '
+                  'lux.extensions.odm.CachedCount (exact, cached) or '
+                  'lux.extensions.odm.EstimatedCount (approximate for '
+                  'large tables)'),
+        Parameter('TOTAL_COUNT_TIMEOUT', 60,
+                  'Timeout in seconds of totals cached by CachedCount'),
+        Parameter('TOTAL_COUNT_ENTRIES', 1000,
+                  'Maximum number of totals cached by CachedCount'),
+        Parameter('MODEL_CHANGES_CHANNEL', None,
+                  'Channel of the PUBSUB_STORE where model changes are '
+                  'published to, and received from, other processes'),
+        Parameter('WRITE_BEHIND_INTERVAL', 5,
+                  'Seconds between writes of the updates buffered by '
+                  'app.write_behind, 0 to write at every update'),
+        Parameter('WRITE_BEHIND_ENTRIES', 1000,
+                  'Number of rows buffered by app.write_behind which '
+                  'triggers a write')
     ]
 
     def on_config(self, app):
         '''Initialise Object Data Mapper'''
         app.odm = Odm(app, app.config['DATASTORE'])
+        app.total_count = module_attribute(app.config['TOTAL_COUNT'])(app)
+        app.model_changes = ModelChanges(app)
+        app.write_behind = WriteBehind(app,
+                                       app.config['WRITE_BEHIND_INTERVAL'],
+                                       app.config['WRITE_BEHIND_ENTRIES'])
+        app.add_events(('on_model_changes',))
+
+    def on_worker_start(self, app, worker):
+        '''Discard database connections inherited from the arbiter and
+        subscribe to model changes of other processes'''
+        mapper = app.odm.local.mapper
+        if mapper is not None:
+            mapper.dispose()
+        app.model_changes.connect()
+
+    def on_worker_stopping(self, app, worker):
+        '''Write updates buffered by the write-behind buffer'''
+        app.write_behind.cancel()
+        app.write_behind.flush()
+
+    def on_model_changes(self, app, changes, remote):
+        '''Invalidate total counts of tables with inserted or deleted
+        rows'''
+        tables = set((change.table for change in changes
+                      if change.operation != 'update'))
+        if tables:
+            app.total_count.invalidate(tables)
 
 
 class Odm(LocalMixin):
@@ -0,0 +1,140 @@
+'''Post-commit feed of model changes.
+
+When a :class:`.LuxSession` commits, the rows it inserted, updated and
+deleted are dispatched, in one batch per commit, to the
+``on_model_changes`` event::
+
+    class Extension(lux.Extension):
+
+        def on_model_changes(self, app, changes, remote):
+            for change in changes:
+                if change.table == 'task':
+                    ...
+
+``changes`` is a list of :class:`ModelChange` and ``remote`` is ``True``
+when the changes were committed by another process.
+
+Changes are published to other processes and nodes when both the
+:setting:`PUBSUB_STORE` and the :setting:`MODEL_CHANGES_CHANNEL`
+parameters are set.
+'''
+import json
+import logging
+from uuid import uuid4
+from itertools import chain
+from collections import namedtuple
+
+from sqlalchemy import inspect
+
+from pulsar import asyncio
+from pulsar.apps.data import create_store
+from pulsar.utils.pep import to_string
+
+
+__all__ = ['ModelChange', 'ModelChanges']
+
+
+logger = logging.getLogger('lux.odm')
+
+
+class ModelChange(namedtuple('ModelChange',
+                             'table pk operation columns')):
+    '''A row changed by a committed transaction.
+
+    .. attribute:: table
+
+        Name of the table
+
+    .. attribute:: pk
+
+        Primary key of the row, a tuple for composite primary keys and
+        ``None`` when not known (rows inserted in bulk)
+
+    .. attribute:: operation
+
+        One of ``insert``, ``update`` and ``delete``
+
+    .. attribute:: columns
+
+        Tuple of the names of the attributes, columns and relationships,
+        changed by an ``update``
+    '''
+    __slots__ = ()
+
+
+class ModelChanges:
+    '''Dispatch :class:`ModelChange` batches to the ``on_model_changes``
+    event of an ``app`` and, optionally, to other processes.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self.origin = uuid4().hex
+        self.channel = app.config['MODEL_CHANGES_CHANNEL']
+        self.pubsub = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.channel or '')
+    __str__ = __repr__
+
+    def connect(self):
+        '''Subscribe to changes published by other processes.
+
+        Invoked once by each serving process when its worker starts, so
+        that the arbiter does not subscribe when the application is
+        preloaded.
+        '''
+        if self.pubsub is not None:
+            return
+        url = self.app.config.get('PUBSUB_STORE')
+        if url and self.channel:
+            self.pubsub = create_store(url).pubsub()
+            self.pubsub.add_client(self)
+            asyncio.ensure_future(self.pubsub.subscribe(self.channel))
+
+    def publish(self, changes):
+        '''Fire the ``on_model_changes`` event with a list of ``changes``
+        and publish them to other processes
+        '''
+        if not changes:
+            return
+        self.app.fire('on_model_changes', changes, False)
+        if self.pubsub:
+            message = json.dumps({'origin': self.origin,
+                                  'changes': changes}, default=str)
+            asyncio.ensure_future(self.pubsub.publish(self.channel, message))
+
+    def __call__(self, channel, message):
+        # pub/sub client
+        try:
+            data = json.loads(to_string(message))
+            if data['origin'] == self.origin:
+                return
+            changes = [ModelChange(table, tuple(pk) if isinstance(pk, list)
+                                   else pk, operation, tuple(columns))
+                       for table, pk, operation, columns in data['changes']]
+        except (ValueError, TypeError, KeyError):
+            logger.exception('Invalid model changes message')
+            return
+        self.app.fire('on_model_changes', changes, True)
+
+
+def model_change(target, operation, columns=()):
+    '''The :class:`ModelChange` of a committed ``target`` instance
+    '''
+    state = inspect(target)
+    pk = state.identity
+    if pk and len(pk) == 1:
+        pk = pk[0]
+    return ModelChange(state.mapper.local_table.name, pk, operation,
+                       columns)
+
+
+def changed_columns(state):
+    '''Tuple of the names of the changed column and relationship
+    attributes of an instance ``state``
+    '''
+    attrs = state.attrs
+    mapper = state.mapper
+    return tuple((prop.key for prop in chain(mapper.column_attrs,
+                                             mapper.relationships)
+                  if attrs[prop.key].history.has_changes()))
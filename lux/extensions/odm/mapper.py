@@ -16,6 +16,8 @@ from sqlalchemy.orm.session import Session
 from pulsar import ImproperlyConfigured
 from pulsar.apps.data import Store, create_store
 
+from .changes import model_change, changed_columns
+
 
 _camelcase_re = re.compile(r'([A-Z]+)(?=[a-z0-9])')
 
@@ -142,6 +144,15 @@ class Mapper:
     def keys_engines(self):
         return chain(self._engines.items(), self._nosql_engines.items())
 
+    def dispose(self):
+        '''Discard connections of sql engines.
+
+        New connections are opened when needed, this is used by processes
+        forked after the engines were created.
+        '''
+        for engine in self._engines.values():
+            engine.dispose()
+
     def close(self):
         for engine in self.engines():
             engine.dispose()
@@ -252,7 +263,8 @@ class LuxSession(Session):
     """The sql alchemy session that lux uses.
 
     It extends the default session system with bind selection and
-    modification tracking.
+    modification tracking. Changes are published, once committed, via
+    the :class:`.ModelChanges` feed of the application.
     """
 
     def __init__(self, mapper, **options):
@@ -272,7 +284,6 @@ class LuxSession(Session):
 
         event.listen(self, 'before_flush', self.record_ops)
         event.listen(self, 'before_commit', self.record_ops)
-        event.listen(self, 'before_commit', self.before_commit)
         event.listen(self, 'after_commit', self.after_commit)
         event.listen(self, 'after_rollback', self.after_rollback)
 
@@ -287,20 +298,24 @@ class LuxSession(Session):
                                    (session.dirty, 'update'),
                                    (session.deleted, 'delete')):
             for target in targets:
-                state = inspect(target)
-                key = state.identity_key if state.has_identity else id(target)
-                d[key] = (target, operation)
-
-    @staticmethod
-    def before_commit(session):
-        try:
-            d = session._model_changes
-        except AttributeError:
-            return
-
-        # if d:
-        #     before_models_committed.send(session.app,
-        #                                  changes=list(d.values()))
+                columns = ()
+                if operation == 'update':
+                    columns = changed_columns(inspect(target))
+                    if not columns:
+                        continue
+                # the target is referenced by the dictionary, its id
+                # is a stable key before and after the flush
+                key = id(target)
+                if key in d:
+                    _, previous, before = d[key]
+                    if previous == 'insert':
+                        if operation == 'delete':
+                            d.pop(key)
+                            continue
+                        operation, columns = previous, ()
+                    elif operation == 'update':
+                        columns = tuple(sorted(set(before + columns)))
+                d[key] = (target, operation, columns)
 
     @staticmethod
     def after_commit(session):
@@ -309,9 +324,12 @@ class LuxSession(Session):
         except AttributeError:
             return
 
-        # if d:
-        #     models_committed.send(session.app, changes=list(d.values()))
-        #     d.clear()
+        if d:
+            changes = [model_change(*value) for value in d.values()]
+            d.clear()
+            feed = getattr(session.app, 'model_changes', None)
+            if feed is not None:
+                feed.publish(changes)
 
     @staticmethod
     def after_rollback(session):
@@ -320,7 +338,16 @@ class LuxSession(Session):
         except AttributeError:
             return
 
-        # d.clear()
+        transaction = session.transaction
+        while transaction is not None and not transaction.nested:
+            transaction = transaction.parent
+        if transaction is None:
+            d.clear()
+        else:
+            # rollback of a savepoint, rows inserted in it are expunged
+            for key, value in tuple(d.items()):
+                if inspect(value[0]).transient:
+                    d.pop(key)
 
 
 def module_iterator(application):
@@ -1,8 +1,13 @@
 import json
+import enum
+import ipaddress
+import threading
+from operator import attrgetter
 from datetime import date, datetime
 
 import pytz
 
+from sqlalchemy import inspect
 from sqlalchemy_utils.functions import get_columns
 
 from pulsar.utils.html import nicename
@@ -10,29 +15,20 @@ from pulsar.utils.html import nicename
 from lux.extensions import rest
 
 
+# Maximum number of projections cached by a serialiser
+MAX_PROJECTIONS = 256
+
+
 class RestModel(rest.RestModel):
     '''A rest model based on SqlAlchemy ORM
     '''
-    def tojson(self, obj, exclude=None):
-        exclude = set(exclude or ())
-        columns = get_columns(obj)
-
-        fields = {}
-        for field in columns:
-            try:
-                data = obj.__getattribute__(field.name)
-                if isinstance(data, date):
-                    if isinstance(data, datetime) and not data.tzinfo:
-                        data = pytz.utc.localize(data)
-                    data = data.isoformat()
-                else:   # Test Json
-                    json.dumps(data)
-            except TypeError:
-                continue
-            if data is not None:
-                fields[field.name] = data
-        # a json-encodable dict
-        return fields
+    def tojson(self, obj, exclude=None, fields=None):
+        return serialiser(type(obj))(obj, exclude, fields)
+
+    def tojson_many(self, objs, exclude=None, fields=None):
+        if not objs:
+            return []
+        return serialiser(type(objs[0])).many(objs, exclude, fields)
 
     def _load_columns(self, app):
         '''List of column definitions
@@ -76,6 +72,164 @@ def column_info(name, col):
     return info
 
 
+class Serialiser:
+    '''JSON serialiser of instances of a mapped class.
+
+    Columns, and a converter for each column based on its python type,
+    are evaluated once, when the serialiser is built by :func:`serialiser`.
+    Columns with ``None`` values or values which cannot be serialised are
+    not included.
+    '''
+    def __init__(self, model):
+        mapper = inspect(model)
+        self.model = model
+        self.columns = tuple(((key, column.name, column_converter(column))
+                              for key, column in mapper.columns.items()))
+        self.projections = {}
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.model.__name__)
+    __str__ = __repr__
+
+    def __call__(self, obj, exclude=None, fields=None):
+        values, names = self.projection(exclude, fields)
+        return self.tojson(values(obj), names)
+
+    def many(self, objs, exclude=None, fields=None):
+        '''Serialise a list of instances
+        '''
+        model = self.model
+        tojson = self.tojson
+        values, names = self.projection(exclude, fields)
+        return [tojson(values(obj), names) if type(obj) is model else
+                serialiser(type(obj))(obj, exclude, fields) for obj in objs]
+
+    def projection(self, exclude=None, fields=None):
+        '''A function returning the tuple of values of an instance and
+        the tuple of ``(name, converter)`` pairs of these values.
+
+        :param exclude: optional column names not included
+        :param fields: optional attribute names, only these columns are
+            included and accessed
+        '''
+        # columns are projected in their order, the order of the names
+        # does not matter and permutations share the same projection
+        key = (frozenset(exclude) if exclude else None,
+               frozenset(fields) if fields is not None else None)
+        projection = self.projections.get(key)
+        if projection is None:
+            exclude = set(exclude or ())
+            fields = set(fields) if fields is not None else None
+            keys = []
+            names = []
+            for attr, name, convert in self.columns:
+                if name in exclude or (fields is not None and
+                                       attr not in fields):
+                    continue
+                keys.append(attr)
+                names.append((name, convert))
+            if len(keys) > 1:
+                values = attrgetter(*keys)
+            elif keys:
+                getter = attrgetter(keys[0])
+
+                def values(obj):
+                    return (getter(obj),)
+            else:
+                values = no_values
+            projection = (values, tuple(names))
+            if len(self.projections) >= MAX_PROJECTIONS:
+                self.projections.clear()
+            self.projections[key] = projection
+        return projection
+
+    def tojson(self, values, names):
+        data = {}
+        for (name, convert), value in zip(names, values):
+            if value is None:
+                continue
+            if convert is not None:
+                value = convert(value)
+                if value is None:
+                    continue
+            data[name] = value
+        return data
+
+
+_serialisers = {}
+_lock = threading.Lock()
+
+
+def serialiser(model):
+    '''The :class:`.Serialiser` of a mapped class, built the first time
+    it is requested
+    '''
+    try:
+        return _serialisers[model]
+    except KeyError:
+        with _lock:
+            if model not in _serialisers:
+                _serialisers[model] = Serialiser(model)
+            return _serialisers[model]
+
+
+def column_converter(column):
+    '''Function converting the values of ``column`` into JSON values or
+    ``None`` when values are already JSON values
+    '''
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return to_json
+    if python_type in _json_types:
+        return None
+    elif python_type is datetime:
+        return datetime_to_json
+    elif python_type is date:
+        return date_to_json
+    return to_json
+
+
+def datetime_to_json(value):
+    if not value.tzinfo:
+        value = pytz.utc.localize(value)
+    return value.isoformat()
+
+
+def date_to_json(value):
+    return value.isoformat()
+
+
+def no_values(obj):
+    return ()
+
+
+def to_json(value):
+    '''Convert a value of a column without a known python type
+    '''
+    if isinstance(value, datetime):
+        return datetime_to_json(value)
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, enum.Enum):
+        return value.name
+    elif isinstance(value, _ip_types):
+        return str(value)
+    # sqlalchemy_utils Choice
+    code = getattr(value, 'code', None)
+    if code is not None:
+        value = code
+    try:
+        json.dumps(value)
+    except TypeError:
+        return
+    return value
+
+
+_json_types = frozenset((str, int, float, bool))
+_ip_types = (ipaddress.IPv4Address, ipaddress.IPv6Address)
+
+
 _types = {int: 'integer',
           bool: 'boolean',
           date: 'date',
@@ -0,0 +1,137 @@
+'''Strategies for counting the total number of items of a collection.
+
+The strategy is selected via the :setting:`TOTAL_COUNT` parameter and
+available as the ``total_count`` attribute of the application. A
+strategy is called with a query and returns a two elements tuple, the
+total and a flag indicating if the total is exact.
+'''
+import json
+import hashlib
+
+from sqlalchemy import exc, text
+
+from lux.core.cache import LRUCache
+
+from .mapper import logger
+
+
+__all__ = ['Count', 'CachedCount', 'EstimatedCount']
+
+
+class Count:
+    '''Exact count, a ``COUNT(*)`` query on every call
+    '''
+    def __init__(self, app):
+        self.app = app
+
+    def __repr__(self):
+        return self.__class__.__name__
+    __str__ = __repr__
+
+    def __call__(self, query):
+        return query.count(), True
+
+    def invalidate(self, tables):
+        '''Called when rows are inserted into or deleted from ``tables``
+        '''
+        pass
+
+
+class CachedCount(Count):
+    '''Exact count cached for :setting:`TOTAL_COUNT_TIMEOUT` seconds.
+
+    Counts are cached per table and query in the memory of the process
+    and invalidated when a session of the process inserts or deletes
+    rows of a table.
+    '''
+    def __init__(self, app):
+        super().__init__(app)
+        cfg = app.config
+        self.cache = LRUCache(max_entries=cfg['TOTAL_COUNT_ENTRIES'],
+                              timeout=cfg['TOTAL_COUNT_TIMEOUT'])
+        self.generations = {}
+
+    def __call__(self, query):
+        key = self.key(query)
+        total = self.cache.get(key)
+        if total is None:
+            total = query.count()
+            self.cache.set(key, total)
+        return total, True
+
+    def invalidate(self, tables):
+        for table in tables:
+            self.generations[table] = self.generations.get(table, 0) + 1
+
+    def key(self, query):
+        compiled = query.statement.compile()
+        tables = sorted((t.name for t in query.statement.froms))
+        bits = [str(compiled), repr(sorted(compiled.params.items()))]
+        for name in tables:
+            bits.append('%s:%d' % (name, self.generations.get(name, 0)))
+        return hashlib.sha1('\n'.join(bits).encode('utf-8')).hexdigest()
+
+
+class EstimatedCount(Count):
+    '''Approximate count from the database statistics.
+
+    * PostgreSQL: ``reltuples`` of ``pg_class`` for unfiltered queries,
+      the planner estimate from ``EXPLAIN`` otherwise
+    * SQLite: the row count in ``sqlite_stat1`` for unfiltered queries,
+      available once ``ANALYZE`` has run
+
+    An exact count is used when an estimate is not available or when it
+    is below :attr:`threshold`, since small tables are cheap to count and
+    their statistics are often out of date.
+    '''
+    threshold = 10000
+
+    def __call__(self, query):
+        try:
+            estimate = self.estimate(query)
+        except exc.SQLAlchemyError:
+            logger.exception('Could not estimate count')
+            estimate = None
+        if estimate is None or estimate < self.threshold:
+            return query.count(), True
+        return estimate, False
+
+    def estimate(self, query):
+        '''Estimated number of rows of ``query`` or ``None``
+        '''
+        statement = query.statement
+        connection = query.session.connection(clause=statement)
+        dialect = connection.dialect.name
+        tables = statement.froms
+        unfiltered = query.whereclause is None and len(tables) == 1
+        if dialect == 'postgresql':
+            # a savepoint so that an error does not abort the transaction
+            with connection.begin_nested():
+                if unfiltered:
+                    result = connection.execute(
+                        text('SELECT reltuples FROM pg_class '
+                             'WHERE relname = :name'),
+                        name=tables[0].name).scalar()
+                    # reltuples is negative for tables never analyzed
+                    if result is not None and result >= 0:
+                        return int(result)
+                else:
+                    sql = str(statement.compile(
+                        dialect=connection.dialect,
+                        compile_kwargs={'literal_binds': True}))
+                    result = connection.execute(text(
+                        'EXPLAIN (FORMAT JSON) %s' % sql.replace(':', '\\:')))
+                    plan = result.scalar()
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    return int(plan[0]['Plan']['Plan Rows'])
+        elif dialect == 'sqlite' and unfiltered:
+            try:
+                result = connection.execute(
+                    text('SELECT stat FROM sqlite_stat1 WHERE tbl = :name'),
+                    name=tables[0].name).scalar()
+            except exc.OperationalError:
+                # sqlite_stat1 is created by ANALYZE
+                return
+            if result:
+                return int(result.split()[0])
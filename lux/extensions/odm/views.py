@@ -1,42 +1,275 @@
-from sqlalchemy.exc import DataError
+import json
+from datetime import date
+from decimal import Decimal
+
+from dateutil.parser import parse as parse_date
+
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import load_only
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import desc
+from sqlalchemy import desc, and_, or_, tuple_, inspect, Date, DateTime
 
-from pulsar import PermissionDenied, Http404
+from pulsar import PermissionDenied, Http404, BadRequest
 from pulsar.apps.wsgi import Json
 
-from lux import route
+from lux import route, conditional, Validator
+from lux.core.green import on_event_loop
+from lux.forms import Form
 from lux.extensions import rest
+from lux.extensions.rest.views import REST_CONTENT_TYPES
 
 from .mapper import logger
+from .changes import ModelChange
 
 
 DIRECTIONS = ('asc', 'desc')
 
+NDJSON = 'application/x-ndjson'
+
+# Dialects supporting row value comparisons
+ROW_VALUES = frozenset(('postgresql', 'mysql'))
+
 
 class RestRouter(rest.RestRouter):
     '''A REST Router base on database models
     '''
+    # Database queries, submitted to the green pool when selective
+    blocking = True
+
     # RestView implementation
     def collection(self, request, limit, offset, text):
         app = request.app
+        if getattr(app.pagination, 'keyset', False):
+            return self.keyset_collection(request, limit, text)
         odm = app.odm()
         model = odm[self.model.name]
 
         with odm.begin() as session:
             query = session.query(model)
             query = self.filter(request, query, text)
-            total = query.count()
+            total, exact = app.total_count(query)
+            query = self.project(query, model, self.fields(request, True))
             query = self.sortby(request, query)
             data = query.limit(limit).offset(offset).all()
             data = self.serialise(request, data)
-            return app.pagination(request, data, total, limit, offset)
+            return app.pagination(request, data, total, limit, offset,
+                                  exact=exact)
+
+    def keyset_collection(self, request, limit, text):
+        '''Collection paginated by a cursor rather than an offset.
+
+        The cursor contains the values of the :meth:`sort_keys` of the last
+        item of the previous page. Used when the application pagination is
+        a :class:`~lux.extensions.rest.CursorPagination`. Sort key columns
+        should not be nullable.
+        '''
+        app = request.app
+        pagination = app.pagination
+        odm = app.odm()
+        model = odm[self.model.name]
+        keys = self.sort_keys(request, model)
+        cursor = pagination.cursor(request)
+
+        with odm.begin() as session:
+            query = session.query(model)
+            query = self.filter(request, query, text)
+            total, exact = None, True
+            if pagination.total:
+                total, exact = app.total_count(query)
+            query = self.project(query, model, self.fields(request, True),
+                                 keys)
+            query = self.keyset_query(odm, model, query, keys, cursor)
+            data = query.limit(limit + 1).all()
+            cursor = None
+            if len(data) > limit:
+                data = data[:limit]
+                cursor = keyset_cursor(pagination, keys, data[-1])
+            data = self.serialise(request, data)
+            return pagination(request, data, total, limit, 0, cursor=cursor,
+                              exact=exact)
+
+    def keyset_query(self, odm, model, query, keys, cursor):
+        '''Filter ``query`` by the ``cursor`` and order it by ``keys``
+        '''
+        if cursor is not None:
+            engine = odm.binds.get(model.__table__)
+            dialect = engine.dialect.name if engine else None
+            query = query.filter(keyset_predicate(keys, cursor, dialect))
+        for column, direction in keys:
+            query = query.order_by(desc(column) if direction == 'desc'
+                                   else column)
+        return query
+
+    def streaming(self, request):
+        '''Check if the collection should be streamed, either because the
+        client accepts :data:`NDJSON` or because the
+        :setting:`API_STREAM_KEY` is in the url
+        '''
+        if request.response.content_type == NDJSON:
+            return True
+        value = request.url_data.get(request.config['API_STREAM_KEY'])
+        return value not in (None, '', '0', 'false')
+
+    def stream_collection(self, request, limit, offset, text):
+        '''Stream a collection as the content of the response.
+
+        Rows are fetched and encoded in batches of
+        :setting:`API_STREAM_BATCH`, so that memory does not grow with the
+        number of rows. The response is either
+
+        * a JSON object with the ``result`` array followed by the
+          pagination metadata, or a JSON array when the pagination writes
+          metadata in headers
+        * :data:`NDJSON`, one item per line, when the client accepts it
+
+        Each batch is fetched in its own transaction, no connection is
+        held while the client downloads the body, and batches are
+        paginated by offset or, with keyset pagination, by the sort keys
+        of the last row. The body is written by the server on the event
+        loop, batches are therefore fetched on the green pool when
+        available, see :meth:`stream_chunk`.
+
+        The total number of items is in the ``X-Total-Count`` and
+        ``X-Total-Exact`` headers when counted.
+        '''
+        app = request.app
+        pagination = app.pagination
+        keyset = getattr(pagination, 'keyset', False)
+        odm = app.odm()
+        model = odm[self.model.name]
+        fields = self.fields(request, True)
+        keys = ()
+        cursor = None
+        total, exact = None, True
+        kwargs = {'exact': exact}
+        if keyset:
+            kwargs['cursor'] = None
+            keys = self.sort_keys(request, model)
+            cursor = pagination.cursor(request)
+            offset = 0
+        if not keyset or pagination.total:
+            with odm.begin() as session:
+                query = self.filter(request, session.query(model), text)
+                total, exact = app.total_count(query)
+            kwargs['exact'] = exact
+        response = request.response
+        if total is not None:
+            response['X-Total-Count'] = str(total)
+            response['X-Total-Exact'] = 'true' if exact else 'false'
+        # metadata, links in headers are written here
+        meta = pagination(request, [], total, limit, offset, **kwargs)
+        meta = meta if isinstance(meta, dict) else None
+        ndjson = response.content_type == NDJSON
+        batch = request.config['API_STREAM_BATCH']
 
-    def get_model(self, request):
+        def fetch(count, after):
+            # the rows after the first count rows, the last of them
+            # with sort key values after
+            size = min(batch, limit - count)
+            with odm.begin() as session:
+                query = self.filter(request, session.query(model), text)
+                query = self.project(query, model, fields, keys)
+                if keyset:
+                    query = self.keyset_query(odm, model, query, keys,
+                                              after)
+                else:
+                    query = self.sortby(request, query)
+                    query = query.offset(offset + count)
+                # one more row than the batch, there are more rows
+                rows = query.limit(size + 1).all()
+                more = len(rows) > size
+                rows = rows[:size]
+                if rows and keys:
+                    after = [getattr(rows[-1], c.key) for c, _ in keys]
+                return self.serialise(request, rows), after, more
+
+        response.encoding = 'utf-8'
+        response.content = self.stream(request, fetch, limit, meta, ndjson,
+                                       keyset, cursor)
+        return response
+
+    def stream(self, request, fetch, limit, meta, ndjson, keyset=False,
+               cursor=None):
+        '''Generator of the encoded chunks of a streamed collection.
+
+        :param fetch: function returning the serialised rows after a
+            number of rows, the sort key values of the last of them and
+            whether more rows are available
+        :param keyset: ``True`` for keyset pagination
+        :param cursor: the sort key values of the keyset ``cursor``
+        '''
+        separator = '\n' if ndjson else ','
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        if not ndjson:
+            yield '{"result":[' if meta is not None else '['
+        state = {'count': 0, 'after': cursor, 'more': True}
+        while state['more'] and state['count'] < limit:
+            # the state is updated once the chunk is available
+            yield self.stream_chunk(request, fetch, state, encode,
+                                    separator)
+        if ndjson:
+            if state['count']:
+                yield '\n'
+        elif meta is None:
+            yield ']'
+        else:
+            if keyset and state['more']:
+                pagination = request.app.pagination
+                cursor = pagination.encode([to_cursor(value)
+                                            for value in state['after']])
+                meta = pagination(request, [], meta.get('total'), limit, 0,
+                                  cursor=cursor,
+                                  exact=meta.get('total_exact', True))
+            yield ']'
+            for key, value in meta.items():
+                if key != 'result':
+                    yield ',%s:%s' % (encode(key), encode(value))
+            yield '}'
+
+    def stream_chunk(self, request, fetch, state, encode, separator):
+        '''The chunk of the next batch of rows of a streamed collection.
+
+        When the body is written on the event loop and a green pool is
+        available, the batch is fetched on the pool and the chunk is a
+        future which the server waits for before asking for the next
+        chunk. Otherwise the batch is fetched here.
+        '''
+        def chunk():
+            data, after, more = fetch(state['count'], state['after'])
+            text = separator.join((encode(item) for item in data))
+            if data and state['count']:
+                text = separator + text
+            state['count'] += len(data)
+            state['after'] = after
+            state['more'] = more and bool(data)
+            return text
+
+        pool = request.app.green_pool
+        if pool and on_event_loop():
+            return pool.submit(chunk)
+        return chunk()
+
+    def project(self, query, model, fields, keys=()):
+        '''Load only the columns of ``fields``, and of the sort ``keys``,
+        rather than whole entities
+        '''
+        if fields is None:
+            return query
+        attrs = inspect(model).column_attrs
+        names = [name for name in fields if name in attrs]
+        for column, _ in keys:
+            if column.key not in names:
+                names.append(column.key)
+        if not names:
+            names = [c.key for c in model.__table__.primary_key.columns]
+        return query.options(load_only(*names))
+
+    def get_model(self, request, fields=None):
         odm = request.app.odm()
         model = odm[self.model.name]
         with odm.begin() as session:
             query = session.query(model)
+            query = self.project(query, model, fields)
             try:
                 return query.filter_by(id=request.urlargs['id']).one()
             except NoResultFound:
@@ -59,19 +292,171 @@ class RestRouter(rest.RestRouter):
             session.add(instance)
         return instance
 
+    def create_models(self, request, items):
+        '''Validate ``items`` with the model form and insert them in bulk.
+
+        Return a list with the status of each item. Rows are inserted via
+        ``executemany`` by :meth:`bulk_write`, bypassing
+        :meth:`create_model` and the session events.
+        '''
+        form_class = self.model.form
+        model = request.app.odm()[self.model.name]
+        result = [None]*len(items)
+        rows = []
+        for index, item in enumerate(items):
+            form = self.bulk_form(request, form_class, item)
+            if form.is_valid():
+                rows.append((index, form.cleaned_data))
+            else:
+                result[index] = {'status': 422, 'errors': form.tojson()}
+
+        def insert(session, chunk):
+            session.bulk_insert_mappings(model, [data for _, data in chunk])
+            return [(index, {'status': 201}) for index, _ in chunk]
+
+        self.bulk_write(request, model, rows, insert, result, 'insert')
+        return result
+
+    def update_models(self, request, items):
+        '''Validate ``items``, which must contain the ``id`` of the
+        instance to update, and update them in bulk
+        '''
+        form_class = self.model.editform or self.model.form
+        model = request.app.odm()[self.model.name]
+        result = [None]*len(items)
+        rows = []
+        for index, item in enumerate(items):
+            id = item.get('id') if isinstance(item, dict) else None
+            if id is None:
+                result[index] = {'status': 400, 'errors': 'Missing id'}
+                continue
+            form = self.bulk_form(request, form_class, item)
+            if form.is_valid(exclude_missing=True):
+                data = dict(form.cleaned_data)
+                data['id'] = id
+                rows.append((index, data))
+            else:
+                result[index] = {'id': id, 'status': 422,
+                                 'errors': form.tojson()}
+
+        def update(session, chunk):
+            found = self.bulk_existing(session, model,
+                                       [data['id'] for _, data in chunk])
+            chunk = [(index, data) for index, data in chunk
+                     if str(data['id']) in found]
+            session.bulk_update_mappings(model, [data for _, data in chunk])
+            return [(index, {'id': data['id'], 'status': 200})
+                    for index, data in chunk]
+
+        self.bulk_write(request, model, rows, update, result, 'update')
+        return result
+
+    def delete_models(self, request, items):
+        '''Delete instances in bulk, ``items`` are ids or objects with
+        the ``id`` of the instance to delete
+        '''
+        model = request.app.odm()[self.model.name]
+        result = [None]*len(items)
+        rows = []
+        for index, item in enumerate(items):
+            id = item.get('id') if isinstance(item, dict) else item
+            if id is None or isinstance(id, (dict, list)):
+                result[index] = {'status': 400, 'errors': 'Missing id'}
+            else:
+                rows.append((index, id))
+
+        def delete(session, chunk):
+            found = self.bulk_existing(session, model,
+                                       [id for _, id in chunk])
+            chunk = [(index, id) for index, id in chunk if str(id) in found]
+            if chunk:
+                query = session.query(model)
+                query = query.filter(model.id.in_([id for _, id in chunk]))
+                query.delete(synchronize_session=False)
+            return [(index, {'id': id, 'status': 204})
+                    for index, id in chunk]
+
+        self.bulk_write(request, model, rows, delete, result, 'delete')
+        return result
+
+    def bulk_form(self, request, form_class, item):
+        if not isinstance(item, dict):
+            item = {}
+        return form_class(request, data=item)
+
+    def bulk_existing(self, session, model, ids):
+        '''Set of ``ids``, as strings, of existing instances
+        '''
+        query = session.query(model.id).filter(model.id.in_(ids))
+        return set((str(id) for id, in query))
+
+    def bulk_write(self, request, model, rows, write, result, operation):
+        '''Write ``rows`` in chunks of :setting:`API_BULK_CHUNK`, one
+        transaction per chunk.
+
+        ``write`` is called with the session and a chunk of
+        ``(index, data)`` pairs and returns the status of items written.
+        Items of a chunk failing with a database error are marked with
+        a 400 status, items not written with a 404 status.
+
+        Bulk operations bypass the session, the changes of a chunk are
+        published to the :class:`.ModelChanges` feed once committed.
+        '''
+        app = request.app
+        odm = app.odm()
+        table = model.__table__.name
+        size = request.config['API_BULK_CHUNK']
+        for start in range(0, len(rows), size):
+            chunk = rows[start:start+size]
+            try:
+                with odm.begin() as session:
+                    written = write(session, chunk)
+            except (DataError, IntegrityError) as exc:
+                logger.exception('Could not write chunk of %s', model)
+                for index, data in chunk:
+                    result[index] = {'status': 400, 'errors': str(exc.orig)}
+                continue
+            for index, status in written:
+                result[index] = status
+            changes = []
+            for index, data in chunk:
+                if isinstance(data, dict):
+                    id = data.get('id')
+                    columns = tuple((key for key in data if key != 'id'))
+                else:
+                    id, columns = data, ()
+                if result[index] is None:
+                    result[index] = {'id': id, 'status': 404}
+                elif operation == 'update':
+                    changes.append(ModelChange(table, id, operation,
+                                               columns))
+                else:
+                    changes.append(ModelChange(table, id, operation, ()))
+            app.model_changes.publish(changes)
+
     def meta(self, request):
         meta = super().meta(request)
         odm = request.app.odm()
         model = odm[self.model.name]
         with odm.begin() as session:
             query = session.query(model)
-            meta['total'] = query.count()
+            meta['total'], meta['total_exact'] = request.app.total_count(query)
         return meta
 
     def filter(self, request, query, text):
         return query
 
     def sortby(self, request, query):
+        for entry, direction in self.sortby_entries(request):
+            if direction == 'desc':
+                entry = desc(entry)
+            query = query.order_by(entry)
+        return query
+
+    def sortby_entries(self, request):
+        '''Generator of ``(column name, direction)`` pairs from the
+        ``sortby`` url parameter
+        '''
         sortby = request.url_data.get('sortby')
         if sortby:
             if not isinstance(sortby, list):
@@ -82,13 +467,28 @@ class RestRouter(rest.RestRouter):
                     entry, direction = entry.split(':')
                 if direction not in DIRECTIONS:
                     direction = DIRECTIONS[0]
-                if direction == 'desc':
-                    entry = desc(entry)
-                query = query.order_by(entry)
-        return query
+                yield entry, direction
+
+    def sort_keys(self, request, model):
+        '''List of ``(column, direction)`` pairs ordering a keyset
+        paginated collection.
+
+        Primary key columns are appended so that keys are unique.
+        '''
+        table = model.__table__
+        keys = []
+        for name, direction in self.sortby_entries(request):
+            column = table.columns.get(name)
+            if column is not None:
+                keys.append((column, direction))
+        for column in table.primary_key.columns:
+            if not any(column is key for key, _ in keys):
+                keys.append((column, DIRECTIONS[0]))
+        return keys
 
 
 class CRUD(RestRouter):
+    response_content_types = REST_CONTENT_TYPES + [NDJSON]
 
     def get(self, request):
         '''Get a list of models
@@ -96,9 +496,12 @@ class CRUD(RestRouter):
         backend = request.cache.auth_backend
         model = self.model
         if backend.has_permission(request, model.name, rest.READ):
-            limit = self.limit(request)
             offset = self.offset(request)
             text = self.query(request)
+            if self.streaming(request):
+                limit = self.limit(request, request.config['API_LIMIT_STREAM'])
+                return self.stream_collection(request, limit, offset, text)
+            limit = self.limit(request)
             data = self.collection(request, limit, offset, text)
             return Json(data).http_response(request)
         raise PermissionDenied
@@ -116,6 +519,79 @@ class CRUD(RestRouter):
             return Json(meta).http_response(request)
         raise PermissionDenied
 
+    @route(method=('post', 'options'))
+    def bulk(self, request):
+        '''Create models in bulk
+        '''
+        return self.bulk_response(request, rest.CREATE, self.create_models)
+
+    @route('bulk/update', method=('post', 'options'))
+    def bulk_update(self, request):
+        '''Update models in bulk
+        '''
+        return self.bulk_response(request, rest.UPDATE, self.update_models)
+
+    @route('bulk/delete', method=('post', 'options'))
+    def bulk_delete(self, request):
+        '''Delete models in bulk
+        '''
+        return self.bulk_response(request, rest.DELETE, self.delete_models)
+
+    def bulk_response(self, request, level, write):
+        '''Check the permission ``level`` once and ``write`` all items of
+        the request body.
+
+        The response contains the status of each item in the same order
+        as the request items, and the number of items which succeeded and
+        failed.
+        '''
+        if request.method == 'OPTIONS':
+            request.app.fire('on_preflight', request)
+            return request.response
+
+        backend = request.cache.auth_backend
+        if backend.has_permission(request, self.model.name, level):
+            result = write(request, self.bulk_items(request))
+            failed = sum((1 for status in result if status['status'] >= 400))
+            data = {'result': result,
+                    'success': len(result) - failed,
+                    'failed': failed}
+            return Json(data).http_response(request)
+        raise PermissionDenied
+
+    def bulk_items(self, request):
+        '''List of items from the body of a bulk request.
+
+        The body is either a JSON array, a JSON object with the array in
+        the ``items`` key (and the CSRF token when required) or
+        :data:`NDJSON`, one item per line.
+        '''
+        content_type, options = request.content_type_options
+        if content_type == NDJSON:
+            stream = request.environ.get('wsgi.input')
+            body = stream.read() if stream else b''
+            try:
+                items = [json.loads(line) for line in
+                         body.decode(options.get('charset', 'utf-8'))
+                         .splitlines() if line.strip()]
+            except ValueError:
+                raise BadRequest('Invalid NDJSON body')
+            data = {}
+        else:
+            data = request.body_data()
+            if isinstance(data, list):
+                items, data = data, {}
+            else:
+                items = data.get('items')
+        if not isinstance(items, list):
+            raise BadRequest('Bulk requests require a list of items')
+        limit = request.config['API_BULK_LIMIT']
+        if len(items) > limit:
+            raise BadRequest('Bulk requests are limited to %d items' % limit)
+        # CSRF is checked once for the whole batch
+        Form(request, data=data)
+        return items
+
     def post(self, request):
         '''Create a new model
         '''
@@ -140,12 +616,35 @@ class CRUD(RestRouter):
             return Json(data).http_response(request)
         raise PermissionDenied
 
+    def instance_validator(self, request):
+        '''A :class:`.Validator` for :meth:`read` from the
+        :attr:`~.RestModel.version` or :attr:`~.RestModel.last_modified`
+        column of the model.
+
+        Only the column is loaded from the database.
+        '''
+        model = self.model
+        column = model.version or model.last_modified
+        if not column:
+            return
+        odm = request.app.odm()
+        db_model = odm[model.name]
+        with odm.begin() as session:
+            query = session.query(getattr(db_model, column))
+            value = query.filter(db_model.id == request.urlargs['id']).scalar()
+        if value is None:
+            return
+        elif model.version:
+            return Validator(etag=value)
+        else:
+            return Validator(last_modified=value)
+
     @route('<id>')
+    @conditional('instance_validator')
     def read(self, request):
         '''Read an instance
         '''
-        instance = self.get_model(request)
-        url = request.absolute_uri()
+        instance = self.get_model(request, self.fields(request))
         data = self.serialise(request, instance)
         return Json(data).http_response(request)
 
@@ -180,3 +679,57 @@ class CRUD(RestRouter):
             request.response.status_code = 204
             return request.response
         raise PermissionDenied
+
+
+def keyset_predicate(keys, values, dialect=None):
+    '''The predicate selecting rows after ``values`` in the order given
+    by ``keys``.
+
+    When all keys have the same direction and the ``dialect`` supports it,
+    the row value comparison ``(a, b) > (x, y)`` is used, otherwise the
+    equivalent ``a > x OR (a = x AND b > y)``.
+    '''
+    if len(values) != len(keys):
+        raise BadRequest('Invalid cursor')
+    values = [from_cursor(column, value)
+              for (column, _), value in zip(keys, values)]
+    directions = set((direction for _, direction in keys))
+    if len(keys) > 1 and len(directions) == 1 and dialect in ROW_VALUES:
+        columns = tuple_(*[column for column, _ in keys])
+        if directions.pop() == 'desc':
+            return columns < tuple_(*values)
+        return columns > tuple_(*values)
+    clauses = []
+    for index, (column, direction) in enumerate(keys):
+        value = values[index]
+        clause = [c == v for (c, _), v in zip(keys[:index], values)]
+        clause.append(column < value if direction == 'desc'
+                      else column > value)
+        clauses.append(and_(*clause))
+    return or_(*clauses)
+
+
+def keyset_cursor(pagination, keys, last):
+    '''The cursor of the page after the ``last`` item
+    '''
+    return pagination.encode([to_cursor(getattr(last, c.key))
+                              for c, _ in keys])
+
+
+def to_cursor(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def from_cursor(column, value):
+    if isinstance(value, str) and isinstance(column.type, (Date, DateTime)):
+        try:
+            value = parse_date(value)
+        except (ValueError, OverflowError):
+            raise BadRequest('Invalid cursor')
+        if not isinstance(column.type, DateTime):
+            value = value.date()
+    return value
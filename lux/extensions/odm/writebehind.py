@@ -0,0 +1,194 @@
+'''Write-behind buffer for audit columns.
+
+Columns such as ``Token.last_access`` are updated at almost every request
+and nobody needs them to be exact to the second. Rather than committing
+a transaction per request, updates are "touched" into the
+:class:`WriteBehind` buffer of the application::
+
+    app.write_behind.touch('token', token_id, 'last_access')
+
+Repeated touches of the same row and column are coalesced into the
+latest value and the buffer is written with one bulk ``UPDATE`` per
+model and column every :setting:`WRITE_BEHIND_INTERVAL` seconds, or as
+soon as it holds :setting:`WRITE_BEHIND_ENTRIES` rows, in the executor
+of the event loop. The buffer is flushed when a worker stops.
+
+Updates of rows deleted in the meantime are dropped. Bulk updates bypass
+the session, therefore they are not published to the
+``on_model_changes`` event.
+'''
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import inspect, bindparam
+
+from lux.core.metrics import (clock, WRITE_BEHIND_PENDING, WRITE_BEHIND_LAG,
+                              WRITE_BEHIND_FLUSH)
+
+
+__all__ = ['WriteBehind']
+
+
+logger = logging.getLogger('lux.odm')
+
+
+class WriteBehind:
+    '''Coalesce updates of the ``app`` models and write them in bulk.
+
+    .. attribute:: interval
+
+        Seconds between flushes, ``0`` writes at every touch
+
+    .. attribute:: max_entries
+
+        Number of buffered rows which triggers a flush
+
+    .. attribute:: flushes
+
+        Number of flushes which wrote rows
+
+    .. attribute:: flushed
+
+        Number of rows written
+
+    .. attribute:: errors
+
+        Number of failed flushes
+    '''
+    def __init__(self, app, interval=5, max_entries=1000):
+        self.app = app
+        self.interval = interval
+        self.max_entries = max(int(max_entries), 1)
+        self.flushes = 0
+        self.flushed = 0
+        self.errors = 0
+        self.histogram = None
+        # (model, column) -> {pk: value}
+        self._pending = {}
+        self._count = 0
+        self._oldest = None
+        self._handle = None
+        self._lock = threading.Lock()
+        metrics = app.metrics
+        if metrics:
+            self.histogram = metrics.histogram(WRITE_BEHIND_FLUSH)
+            metrics.gauge(WRITE_BEHIND_PENDING, lambda: self.pending)
+            metrics.gauge(WRITE_BEHIND_LAG, lambda: self.lag)
+
+    def __repr__(self):
+        return '%s(pending=%d)' % (self.__class__.__name__, self.pending)
+    __str__ = __repr__
+
+    @property
+    def pending(self):
+        '''Number of buffered rows
+        '''
+        return self._count
+
+    @property
+    def lag(self):
+        '''Seconds since the oldest buffered update
+        '''
+        oldest = self._oldest
+        return 0 if oldest is None else clock() - oldest
+
+    def touch(self, model, pk, column='last_access', value=None):
+        '''Buffer the update of ``column`` of the row ``pk`` of ``model``.
+
+        :param model: name of the model
+        :param pk: primary key of the row
+        :param value: new value, the current UTC time by default
+        '''
+        if value is None:
+            value = datetime.utcnow()
+        with self._lock:
+            rows = self._pending.get((model, column))
+            if rows is None:
+                rows = self._pending[(model, column)] = {}
+            if pk not in rows:
+                self._count += 1
+                if self._oldest is None:
+                    self._oldest = clock()
+            rows[pk] = value
+            full = self._count >= self.max_entries or not self.interval
+        self.schedule(0 if full else self.interval)
+
+    def schedule(self, delay):
+        '''Schedule a flush in the executor of the event loop in ``delay``
+        seconds. Flush now when there is no event loop.
+        '''
+        loop = self.app._loop
+        if loop is None:
+            if not delay:
+                self.flush()
+        elif not delay:
+            self.cancel()
+            loop.run_in_executor(None, self.flush)
+        elif self._handle is None:
+            self._handle = loop.call_later(delay, self.schedule, 0)
+
+    def cancel(self):
+        '''Cancel the scheduled flush
+        '''
+        handle, self._handle = self._handle, None
+        if handle is not None:
+            handle.cancel()
+
+    def flush(self):
+        '''Write buffered updates with one bulk update for each model and
+        column.
+
+        :return: the number of flushed rows, deleted rows included
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            count, self._count = self._count, 0
+            oldest, self._oldest = self._oldest, None
+        if not count:
+            return 0
+        start = clock()
+        odm = self.app.odm()
+        try:
+            with odm.begin() as session:
+                for (name, column), rows in pending.items():
+                    session.execute(
+                        self.statement(odm[name], column),
+                        [{'_pk': pk, '_value': value}
+                         for pk, value in rows.items()])
+        except Exception:
+            self.errors += 1
+            logger.exception('Could not write %d buffered updates', count)
+            self.restore(pending, oldest)
+            return 0
+        self.flushes += 1
+        self.flushed += count
+        if self.histogram:
+            self.histogram.observe(clock() - start)
+        return count
+
+    def statement(self, model, column):
+        '''The ``UPDATE`` of ``column`` of a ``model`` row executed for
+        each buffered row.
+
+        Rows deleted since they were touched are not matched and skipped,
+        the number of updated rows is not checked.
+        '''
+        mapper = inspect(model)
+        pk = mapper.primary_key[0]
+        target = mapper.columns[column]
+        return target.table.update().where(
+            pk == bindparam('_pk')).values({target.name: bindparam('_value')})
+
+    def restore(self, pending, oldest):
+        '''Put back ``pending`` updates which were not touched again
+        '''
+        with self._lock:
+            for key, rows in pending.items():
+                current = self._pending.setdefault(key, {})
+                for pk, value in rows.items():
+                    if pk not in current:
+                        current[pk] = value
+                        self._count += 1
+            if oldest is not None:
+                self._oldest = min(oldest, self._oldest or oldest)
@@ -18,7 +18,8 @@ from lux.extensions.angular import add_ng_modules
 
 from .user import *
 from .models import RestModel
-from .pagination import Pagination, Github
+from .pagination import (Pagination, Github, CursorPagination,
+                         GithubCursor)
 from .views import (RestRoot, RestRouter, RestMixin, change_password,
                     RequirePermission)
 
@@ -57,10 +58,21 @@ class AuthBackend(lux.Extension):
         pass
 
     def request(self, request):
-        '''Request middleware. Most restful backends implement this method
+        '''Request middleware. Most restful backends implement this method.
+
+        Backends authenticating a user store the verified credential in
+        ``request.cache.credential``, it identifies the client of the
+        ``token`` rate limit scope.
         '''
         pass
 
+    def blocks(self, environ):
+        '''Check if the :meth:`request` middleware blocks on I/O for the
+        request of ``environ``, for example to load the user of a
+        credential. It does not block by default.
+        '''
+        return False
+
     def has_permission(self, request, target, level):
         '''Check if the given request has permission over ``target``
         element with permission ``level``
@@ -78,7 +90,6 @@ class AuthBackend(lux.Extension):
 
 
 class Extension(AuthBackend):
-
     _config = [
         Parameter('AUTHENTICATION_BACKENDS', [],
                   'List of python dotted path to classES used to provide '
@@ -104,6 +115,13 @@ class Extension(AuthBackend):
                                         'update': 30,
                                         'delete': 40},
                   'When a model'),
+        Parameter('PERMISSIONS_CACHE_TIMEOUT', 60,
+                  'Seconds the permissions of a user are cached in the '
+                  'memory of the process. Without a MODEL_CHANGES_CHANNEL '
+                  'revoked permissions are granted by other workers for '
+                  'up to this time'),
+        Parameter('PERMISSIONS_CACHE_ENTRIES', 10000,
+                  'Maximum number of users with cached permissions'),
         Parameter('DEFAULT_PERMISSION_LEVEL', 'read',
                   'When no roles has tested positive for permissions, this '
                   'parameter is used to check if a model has permission for '
@@ -115,6 +133,11 @@ class Extension(AuthBackend):
                   'The query key for full text search'),
         Parameter('API_OFFSET_KEY', 'offset', ''),
         Parameter('API_LIMIT_KEY', 'limit', ''),
+        Parameter('API_CURSOR_KEY', 'cursor',
+                  'The query key for the cursor of keyset pagination'),
+        Parameter('API_FIELDS_KEY', 'fields',
+                  'The query key for the comma separated list of fields '
+                  'to return'),
         Parameter('API_LIMIT_DEFAULT', 25,
                   'Default number of items returned when no limit '
                   'API_LIMIT_KEY available in the url'),
@@ -124,8 +147,27 @@ class Extension(AuthBackend):
         Parameter('API_LIMIT_NOAUTH', 30,
                   ('Maximum number of items returned when user is '
                    'not authenticated')),
+        Parameter('API_STREAM_KEY', 'stream',
+                  'The query key requesting a streamed JSON collection. '
+                  'Collections are always streamed when the client '
+                  'accepts application/x-ndjson'),
+        Parameter('API_STREAM_BATCH', 500,
+                  'Number of rows fetched and encoded at once by streamed '
+                  'collections'),
+        Parameter('API_LIMIT_STREAM', 10000,
+                  ('Maximum number of items of a streamed collection when '
+                   'user is authenticated')),
+        Parameter('API_BULK_LIMIT', 50000,
+                  'Maximum number of items of a bulk request'),
+        Parameter('API_BULK_CHUNK', 1000,
+                  'Number of items written to the database in one '
+                  'transaction by bulk requests'),
+        Parameter('API_BATCH_LIMIT', 50,
+                  'Maximum number of sub-requests of a batch request'),
         Parameter('PAGINATION', 'lux.extensions.rest.Pagination',
-                  'Pagination class')]
+                  'Pagination class. Use '
+                  'lux.extensions.rest.CursorPagination for keyset '
+                  'pagination of large collections')]
 
     ngModules = ['lux.users']
 
@@ -199,6 +241,16 @@ class Extension(AuthBackend):
     def __call__(self, environ, start_response):
         return self.request(wsgi_request(environ))
 
+    def blocks(self, environ):
+        '''The request middleware blocks when a backend loads the user
+        of a credential, it is submitted to the green pool when
+        selective
+        '''
+        for backend in self.backends:
+            if backend.blocks(environ):
+                return True
+        return False
+
     # AuthBackend Implementation
     def request(self, request):
         # Inject self as the authentication backend
@@ -234,9 +286,16 @@ class Extension(AuthBackend):
         has = self._apply_all('has_permission', request, target, level)
         return True if has is None else has
 
-    def on_html_document(self, app, request, doc):
+    def on_html_skeleton(self, app, doc):
         add_ng_modules(doc, self.ngModules)
 
+    def on_model_changes(self, app, changes, remote):
+        '''Forward model changes to backends'''
+        for backend in self.backends:
+            on_model_changes = getattr(backend, 'on_model_changes', None)
+            if on_model_changes:
+                on_model_changes(app, changes, remote)
+
     def _apply_all(self, method, request, *args, **kwargs):
         for backend in self.backends:
             result = getattr(backend, method)(request, *args, **kwargs)
@@ -1,3 +1,3 @@
 from .token import TokenBackend
 from .browser import BrowserBackend
-from .session import SessionBackend
+from .session import SessionBackend, Session
@@ -1,6 +1,7 @@
 import time
 import json
 
+from uuid import uuid4
 from datetime import datetime, timedelta
 
 from pulsar import PermissionDenied, Http404
@@ -10,8 +11,10 @@ from pulsar.utils.importer import module_attribute
 import lux
 from lux import Parameter, Router
 from lux.forms import Form
+from lux.core.wrappers import wsgi_request
 from lux.utils.crypt import get_random_string, digest
 
+from ..user import MessageMixin, Anonymous
 from .token import jwt
 from .browser import BrowserBackend
 
@@ -19,6 +22,122 @@ from .browser import BrowserBackend
 REASON_BAD_TOKEN = "CSRF token missing or incorrect"
 
 
+class Session(MessageMixin):
+    '''A session of a :class:`SessionBackend` which tracks its changes.
+
+    The data of a session with a ``loader`` is loaded on first access,
+    when the loader returns ``None`` the session is replaced by a new
+    one. A session without ``loader`` is new and it is not stored until
+    it is modified.
+
+    .. attribute:: id
+
+        The session key
+
+    .. attribute:: new
+
+        ``True`` when the session has not been stored yet
+    '''
+    def __init__(self, id=None, loader=None, expiry=None):
+        self.id = id or uuid4().hex
+        self.expiry = expiry
+        self.new = loader is None
+        self._loader = loader
+        self._data = None if loader else {}
+        self._changed = set()
+        self._deleted = set()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.id)
+    __str__ = __repr__
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def modified(self):
+        '''``True`` when fields were changed or removed
+        '''
+        return bool(self._changed or self._deleted)
+
+    @property
+    def data(self):
+        if self._data is None:
+            data, self._loader = self._loader(self.id), None
+            if data is None:
+                # expired or unknown key, never reuse it
+                self.id = uuid4().hex
+                self.new = True
+            self._data = data or {}
+        return self._data
+
+    @property
+    def user_id(self):
+        return self.get('user_id')
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __setitem__(self, name, value):
+        data = self.data
+        if name not in data or data[name] != value:
+            data[name] = value
+            self._changed.add(name)
+            self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        del self.data[name]
+        self._changed.discard(name)
+        if not self.new:
+            self._deleted.add(name)
+
+    def get(self, name, default=None):
+        return self.data.get(name, default)
+
+    def pop(self, name, default=None):
+        if name in self.data:
+            value = self.data[name]
+            del self[name]
+            return value
+        return default
+
+    def changes(self):
+        '''Changed fields and removed fields since the last call.
+
+        :return: a two-elements tuple with a dictionary of changed fields
+            and a tuple of removed fields
+        '''
+        data = self.data
+        changed = dict(((name, data[name]) for name in self._changed))
+        deleted = tuple(self._deleted)
+        self._changed.clear()
+        self._deleted.clear()
+        self.new = False
+        return changed, deleted
+
+    # MESSAGES
+    def message(self, level, message):
+        messages = list(self.get_messages())
+        messages.append({'level': level, 'message': message})
+        self['messages'] = messages
+
+    def remove_message(self, data):
+        messages = self.get_messages()
+        remaining = [m for m in messages
+                     if m != data and m['message'] != data]
+        if len(remaining) < len(messages):
+            self['messages'] = remaining
+            return True
+        return False
+
+    def get_messages(self):
+        return self.get('messages') or ()
+
+
 class SessionBackend(BrowserBackend):
     '''Mixin for :class:`.AuthBackend` via sessions.
     '''
@@ -36,14 +155,17 @@ class SessionBackend(BrowserBackend):
 
     def on_form(self, app, form):
         '''Handle CSRF on form
+
+        The token is validated once per request, by the first bound form.
         '''
         request = form.request
         backend = request.cache.auth_backend if request else None
         param = app.config['CSRF_PARAM']
         if (backend and form.request.method == 'POST' and
-                form.is_bound and param):
+                form.is_bound and param and not request.cache.csrf_valid):
             token = form.rawdata.get(param)
             backend.validate_csrf_token(form.request, token)
+            request.cache.csrf_valid = True
 
     def wsgi(self):
         wsgi = [self]
@@ -53,22 +175,58 @@ class SessionBackend(BrowserBackend):
                                post=self._dismiss_message))
         return wsgi
 
-    # ABSTRACT METHODS WHICH MUST BE IMPLEMENTED
-    def get_session(self, key):
-        '''Retrieve a session from its key
+    def response_middleware(self, app):
+        return [self.response]
+
+    def get_session(self, key, expiry=None):
+        '''The :class:`.Session` of ``key``, its data is loaded via
+        :meth:`session_data` on first access.
+
+        ``expiry`` is the expiry of the new session replacing ``key`` when
+        its data is not available.
         '''
-        raise NotImplementedError
+        return Session(key, self.session_data, expiry)
 
     def session_key(self, session):
         '''Session key from session object
         '''
+        return session.id
+
+    def session_create(self, request, user=None, expiry=None):
+        '''Create a new session for ``user``, stored at the end of the
+        request
+        '''
+        session = Session(expiry=expiry or self._expiry(request))
+        session['user_id'] = user.id if user else None
+        return session
+
+    def session_user(self, request, session):
+        '''The user of ``session``
+        '''
+        return self.get_user(request, user_id=session.user_id)
+
+    def session_timeout(self, session):
+        '''Seconds before a new ``session`` expires
+        '''
+        if session.expiry:
+            timeout = (session.expiry - datetime.now()).total_seconds()
+            return max(int(timeout), 1)
+        return self.config['ACCOUNT_ACTIVATION_DAYS']*86400
+
+    # ABSTRACT METHODS WHICH MUST BE IMPLEMENTED
+    def session_data(self, key):
+        '''Retrieve the data of the session ``key``, ``None`` if not
+        available
+        '''
         raise NotImplementedError
 
     def session_save(self, session):
+        '''Store the fields of ``session`` changed since it was loaded
+        '''
         raise NotImplementedError
 
-    def session_create(self, request, user, expiry):
-        '''Create a new session
+    def session_delete(self, session):
+        '''Remove a stored ``session``
         '''
         raise NotImplementedError
 
@@ -94,23 +252,40 @@ class SessionBackend(BrowserBackend):
         raise NotImplementedError
 
     # MIDDLEWARE
+    def blocks(self, environ):
+        '''A session cookie blocks, its data and user are loaded
+        '''
+        request = wsgi_request(environ)
+        return request.config['SESSION_COOKIE_NAME'] in request.cookies
+
     def request(self, request):
+        '''Set the session of ``request``.
+
+        Requests without a session cookie get a new session which is
+        stored only when modified. The session of a cookie is loaded
+        only when accessed, or when the user is not authenticated yet.
+        '''
         key = request.config['SESSION_COOKIE_NAME']
         session_key = request.cookies.get(key)
-        session = None
+        expiry = self._expiry(request)
         if session_key:
-            session = self.get_session(session_key.value)
-        if not session:
-            session = self.session_create(request, None, self._expiry(request))
+            session = self.get_session(session_key.value, expiry)
+        else:
+            session = Session(expiry=expiry)
         request.cache.session = session
-        if session.user:
-            request.cache.user = session.user
-        if not request.cache.user:
-            request.cache.user = self.anonymous()
-
-    def response(self, request, response):
+        user = request.cache.user
+        if (not user or user.is_anonymous()) and session.user_id:
+            user = self.session_user(request, session)
+            if user:
+                request.cache.user = user
+                request.cache.credential = self.session_key(session)
+
+    def response(self, environ, response):
+        '''Store modified sessions and set the session cookie
+        '''
+        request = wsgi_request(environ)
         session = request.cache.session
-        if session:
+        if session and session.modified:
             if response.can_set_cookies():
                 key = request.app.config['SESSION_COOKIE_NAME']
                 session_key = request.cookies.get(key)
@@ -127,6 +302,8 @@ class SessionBackend(BrowserBackend):
         session = request.cache.session
         if session:
             assert self.jwt, 'Requires jwt package'
+            # the token is valid only if the session is stored
+            session['csrf'] = True
             return self.jwt.encode({'session': self.session_key(session),
                                     'exp': time.time() + self.csrf_expiry},
                                    self.secret_key)
@@ -166,7 +343,7 @@ class SessionBackend(BrowserBackend):
                 raise AuthenticationError('Invalid username or password')
         if not user.is_active():
             return self.inactive_user_login(request, user)
-        request.cache.session = self.session_create(request, user)
+        self._replace_session(request, user)
         request.cache.user = user
         return user
 
@@ -184,11 +361,10 @@ class SessionBackend(BrowserBackend):
     def logout(self, request, user=None):
         '''Logout a ``user``
         '''
-        session = request.cache.session
         user = user or request.cache.user
         if user and user.is_authenticated():
-            request.cache.session = self.session_create(request)
-            request.cache.user = self.anonymous()
+            self._replace_session(request)
+            request.cache.user = Anonymous()
 
     def get_or_create_registration(self, request, user, **kw):
         '''Create a registration profile for ``user``.
@@ -230,6 +406,13 @@ class SessionBackend(BrowserBackend):
         request.cache.session.info(message)
 
     # INTERNALS
+    def _replace_session(self, request, user=None):
+        # a copied cookie of the previous session must not be valid
+        session = request.cache.session
+        if session and not session.new:
+            self.session_delete(session)
+        request.cache.session = self.session_create(request, user)
+
     def _expiry(self, request):
         days = request.config['ACCOUNT_ACTIVATION_DAYS']
         return datetime.now() + timedelta(days=days)
@@ -1,9 +1,12 @@
 import time
+import threading
+from copy import copy
 
 from pulsar import HttpException, MethodNotAllowed, ImproperlyConfigured
 from pulsar.apps.wsgi import Json
 
 from lux import Parameter
+from lux.core.cache import LRUCache
 from ..models import RestModel
 from ..views import RestRouter, AuthenticationError
 
@@ -28,12 +31,30 @@ class TokenBackend(AuthBackend):
 
     Requires pyjwt_ package.
 
+    Verified tokens are cached, together with the claims and the user,
+    until the token expires or for :setting:`JWT_CACHE_TIMEOUT` seconds
+    and can be revoked via :meth:`revoke`. Each request gets its own
+    :meth:`user_copy` of the cached user.
+
     .. _pyjwt: https://pypi.python.org/pypi/PyJWT
     .. _JWT: http://self-issued.info/docs/draft-ietf-oauth-json-web-token.html
     '''
+    _config = [
+        Parameter('JWT_CACHE_TIMEOUT', 300,
+                  'Maximum number of seconds a verified token and its user '
+                  'are cached in the memory of the process'),
+        Parameter('JWT_CACHE_ENTRIES', 10000,
+                  'Maximum number of cached tokens')]
+
     def on_config(self, app):
         if not jwt:
             raise ImproperlyConfigured('JWT library not available')
+        cfg = app.config
+        self.tokens = LRUCache(max_entries=cfg['JWT_CACHE_ENTRIES'],
+                               timeout=cfg['JWT_CACHE_TIMEOUT'])
+        # ('token', token_id) and ('user', user_id) -> cached tokens
+        self.token_index = {}
+        self._index_lock = threading.Lock()
 
     def api_sections(self, app):
         yield Authorization()
@@ -49,19 +70,95 @@ class TokenBackend(AuthBackend):
             auth_type, key = auth.split(None, 1)
             auth_type = auth_type.lower()
             if auth_type == 'bearer':
-                try:
-                    data = jwt.decode(key, self.secret_key)
-                except jwt.ExpiredSignature:
-                    request.app.logger.info('JWT token has expired')
-                    # In this case we want the client to perform
-                    # a new authentication. Raise 401
-                    raise Http401('Token')
-                except Exception:
-                    request.app.logger.exception('Could not load user')
-                else:
-                    user = self.get_user(request, **data)
-                    if user:
-                        request.cache.user = user
+                entry = self.tokens.get(key)
+                if entry is None:
+                    entry = self.verify(request, key)
+                if entry:
+                    request.cache.user = self.user_copy(request, entry[1])
+                    request.cache.credential = key
+                    self.accessed(request, entry[0])
+
+    def blocks(self, environ):
+        '''A bearer token blocks unless it is in the :attr:`tokens` cache
+        '''
+        bits = environ.get('HTTP_AUTHORIZATION', '').split(None, 1)
+        return (len(bits) == 2 and bits[0].lower() == 'bearer' and
+                bits[1] not in self.tokens)
+
+    def user_copy(self, request, user):
+        '''A copy of the cached ``user`` for ``request``, so that requests
+        do not share, and modify, the same instance
+        '''
+        return copy(user)
+
+    def accessed(self, request, claims):
+        '''Invoked when a request is authenticated with a token with
+        ``claims``. Does nothing by default.
+        '''
+        pass
+
+    def verify(self, request, key):
+        '''Decode the token ``key`` and load its user.
+
+        Return a two-elements tuple with the claims and the user, cached
+        until the token expires, or ``None``.
+        '''
+        try:
+            data = jwt.decode(key, self.secret_key)
+        except jwt.ExpiredSignature:
+            request.app.logger.info('JWT token has expired')
+            # In this case we want the client to perform
+            # a new authentication. Raise 401
+            raise Http401('Token')
+        except Exception:
+            request.app.logger.exception('Could not load user')
+        else:
+            user = self.get_user(request, **data)
+            if user:
+                entry = (data, user)
+                timeout = self.tokens.timeout
+                if 'exp' in data:
+                    remaining = data['exp'] - time.time()
+                    timeout = min(timeout, remaining) if timeout else remaining
+                if timeout is None or timeout > 0:
+                    self.tokens.set(key, entry, timeout)
+                    self.index(key, data)
+                return entry
+
+    def index(self, key, claims):
+        '''Index the cached token ``key`` by the ``token_id`` and
+        ``user_id`` of its ``claims``.
+
+        Keys of tokens evicted from the cache are dropped when the index
+        grows over twice the maximum number of cached tokens.
+        '''
+        tokens = self.tokens
+        with self._index_lock:
+            index = self.token_index
+            if len(index) >= 2*(tokens.max_entries or 0):
+                for name, keys in tuple(index.items()):
+                    keys = set((k for k in keys if k in tokens))
+                    if keys:
+                        index[name] = keys
+                    else:
+                        index.pop(name)
+            for name in ('token', 'user'):
+                value = claims.get('%s_id' % name)
+                if value is not None:
+                    index.setdefault((name, value), set()).add(key)
+
+    def revoke(self, token_id=None, user_id=None):
+        '''Remove cached tokens with ``token_id`` or of ``user_id``.
+
+        :return: the number of removed tokens
+        '''
+        keys = set()
+        with self._index_lock:
+            if token_id is not None:
+                keys.update(self.token_index.pop(('token', token_id), ()))
+            if user_id is not None:
+                keys.update(self.token_index.pop(('user', user_id), ()))
+        return sum((self.tokens.pop(key) is not None for key in keys))
 
     def response(self, environ, response):
         name = 'Access-Control-Allow-Origin'
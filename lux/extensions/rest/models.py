@@ -19,22 +19,58 @@ class RestModel:
     .. attribute:: editform
 
         Form class for this REST model in editing mode
+
+    .. attribute:: last_modified
+
+        Optional name of the field storing the last modified time of
+        a model instance. Used for conditional GET.
+
+    .. attribute:: version
+
+        Optional name of the field storing a version token of a model
+        instance, updated every time the instance changes. Used for
+        conditional GET, it takes precedence over :attr:`last_modified`.
+
+    .. attribute:: list_fields
+
+        Optional list of field names returned by collections when the
+        url does not specify fields. By default all fields are returned.
+
+    .. attribute:: detail_fields
+
+        Optional list of field names returned when reading an instance
+        and the url does not specify fields.
     '''
     _columns = None
     _loaded = False
 
     def __init__(self, name, form=None, editform=None, columns=None,
-                 url=None, api_name=None):
+                 url=None, api_name=None, last_modified=None, version=None,
+                 list_fields=None, detail_fields=None):
         self.name = name
         self.form = form
         self.editform = editform or form
+        self.last_modified = last_modified
+        self.version = version
+        self.list_fields = list_fields
+        self.detail_fields = detail_fields
         self.url = url or '%ss' % name
         self.api_name = '%s_url' % self.url
         self._columns = columns
 
-    def tojson(self, obj, exclude=None, decoder=None):
+    def tojson(self, obj, exclude=None, fields=None):
+        '''Serialise a model instance.
+
+        :param exclude: optional field names not serialised
+        :param fields: optional field names, only these are serialised
+        '''
         raise NotImplementedError
 
+    def tojson_many(self, objs, exclude=None, fields=None):
+        '''Serialise a list of model instances
+        '''
+        return [self.tojson(obj, exclude, fields) for obj in objs]
+
     def columns(self, app):
         '''Return a list fields describing the entries for a given model
         instance'''
@@ -1,7 +1,17 @@
+import json
+import base64
+import binascii
+
+from pulsar import BadRequest
 from pulsar.utils.httpurl import iri_to_uri
 
 
 class Pagination:
+    '''Offset pagination.
+
+    The ``total_exact`` flag of the response is ``False`` when ``total``
+    is an estimate, in which case the ``last`` link is approximate too.
+    '''
 
     def first_link(self, request, total, limit, offset):
         if offset:
@@ -30,9 +40,10 @@ class Pagination:
         location = iri_to_uri(request.path, params)
         return request.absolute_uri(location)
 
-    def __call__(self, request, result, total, limit, offset):
+    def __call__(self, request, result, total, limit, offset, exact=True):
         data = {
             'total': total,
+            'total_exact': exact,
             'result': result
         }
         first = self.first_link(request, total, limit, offset)
@@ -54,7 +65,7 @@ class Pagination:
 class Github(Pagination):
     '''Github style pagination
     '''
-    def __call__(self, request, result, total, limit, offset):
+    def __call__(self, request, result, total, limit, offset, exact=True):
         links = []
         first = self.first_link(request, total, limit, offset)
         if first:
@@ -68,5 +79,96 @@ class Github(Pagination):
             if last != next:
                 links.append(next)
             links.append(last)
-        request.response['links'] = links
+        response = request.response
+        response['links'] = links
+        response['X-Total-Count'] = str(total)
+        response['X-Total-Exact'] = 'true' if exact else 'false'
+        return result
+
+
+class CursorPagination(Pagination):
+    '''Keyset pagination.
+
+    Rather than an offset, the url contains an opaque cursor encoding the
+    sort key values of the last item of the previous page, so that the
+    next page is fetched with a predicate on indexed columns rather than
+    by scanning and discarding all previous rows. The total number of
+    items is counted only when :attr:`total` is ``True``.
+
+    Cursors can only move forward, only the ``first`` and ``next`` links
+    are provided.
+    '''
+    keyset = True
+    total = False
+
+    def cursor(self, request):
+        '''Decode the cursor from the ``request`` url.
+
+        Return a list of sort key values or ``None`` when no cursor is
+        given.
+        '''
+        cursor = request.url_data.get(request.config['API_CURSOR_KEY'])
+        if not cursor:
+            return
+        try:
+            value = base64.urlsafe_b64decode(cursor.encode('ascii'))
+            value = json.loads(value.decode('utf-8'))
+        except (ValueError, TypeError, binascii.Error):
+            value = None
+        if not isinstance(value, list):
+            raise BadRequest('Invalid cursor')
+        return value
+
+    def encode(self, values):
+        '''Encode a list of sort key ``values`` into a cursor
+        '''
+        value = json.dumps(values, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(value).decode('ascii')
+
+    def start_link(self, request):
+        if self.cursor(request) is not None:
+            return self.cursor_link(request, None)
+
+    def cursor_link(self, request, cursor):
+        params = request.url_data.copy()
+        cfg = request.config
+        params.pop(cfg['API_OFFSET_KEY'], None)
+        key = cfg['API_CURSOR_KEY']
+        if cursor:
+            params[key] = cursor
+        else:
+            params.pop(key, None)
+        location = iri_to_uri(request.path, params)
+        return request.absolute_uri(location)
+
+    def __call__(self, request, result, total, limit, offset, cursor=None,
+                 exact=True):
+        data = {'result': result}
+        if total is not None:
+            data['total'] = total
+            data['total_exact'] = exact
+        first = self.start_link(request)
+        if first:
+            data['first'] = first
+        if cursor:
+            data['next'] = self.cursor_link(request, cursor)
+        return data
+
+
+class GithubCursor(CursorPagination):
+    '''Github style keyset pagination
+    '''
+    def __call__(self, request, result, total, limit, offset, cursor=None,
+                 exact=True):
+        links = []
+        first = self.start_link(request)
+        if first:
+            links.append(first)
+        if cursor:
+            links.append(self.cursor_link(request, cursor))
+        response = request.response
+        response['links'] = links
+        if total is not None:
+            response['X-Total-Count'] = str(total)
+            response['X-Total-Exact'] = 'true' if exact else 'false'
         return result
@@ -1,9 +1,20 @@
+import json
+import logging
+from io import BytesIO
+from functools import partial
+from itertools import chain
+
 import lux
 from lux import route, HtmlRouter
 from lux.forms import Form, WebFormRouter, FormMixin, Layout, Fieldset, Submit
 
-from pulsar import Http404, PermissionDenied, HttpRedirect, MethodNotAllowed
-from pulsar.apps.wsgi import Json, Router
+from pulsar import (Http404, PermissionDenied, HttpRedirect, MethodNotAllowed,
+                    BadRequest, HttpException, asyncio, is_async,
+                    chain_future)
+from pulsar.apps.wsgi import Json, Router, wsgi_request
+from pulsar.apps.wsgi.utils import error_messages
+from pulsar.utils.httpurl import JSON_CONTENT_TYPES
+from pulsar.utils.pep import to_bytes, to_string
 
 from .forms import (LoginForm, CreateUserForm, ChangePasswordForm,
                     EmailForm, PasswordForm)
@@ -12,6 +23,12 @@ from .models import RestModel
 
 
 REST_CONTENT_TYPES = ['application/json']
+# Entries of the request cache shared by the sub-requests of a batch
+BATCH_CACHE = ('app', 'user', 'auth_backend', 'session', 'csrf_valid')
+# Methods of sub-requests which can run concurrently
+READ_METHODS = frozenset(('GET', 'HEAD'))
+
+logger = logging.getLogger('lux.rest')
 
 
 def csrf(method):
@@ -33,19 +50,235 @@ class RestRoot(lux.Router):
     '''Api Root
 
     Provide a get method for displaying a dictionary of api names - api urls
-    key - value pairs
+    key - value pairs and the :meth:`batch` route for executing several api
+    requests in one
     '''
     response_content_types = REST_CONTENT_TYPES
 
     def apis(self, request):
         routes = {}
-        for route in self.routes:
-            routes[route.model.api_name] = request.absolute_uri(route.path())
+        for router in self.routes:
+            model = getattr(router, 'model', None)
+            if model:
+                routes[model.api_name] = request.absolute_uri(router.path())
         return routes
 
     def get(self, request):
         return Json(self.apis(request)).http_response(request)
 
+    @route(method=('post', 'options'))
+    def batch(self, request):
+        '''Execute a batch of api sub-requests.
+
+        The body is a JSON array, or a JSON object with the array in the
+        ``requests`` key (and the CSRF token when required), of objects
+        with the ``path`` relative to the api url, the ``method``
+        (``GET`` by default) and optional ``body`` and ``headers``.
+
+        Sub-requests share the user and session of the batch request, which
+        is authenticated once. Consecutive read-only sub-requests run
+        concurrently when their routers are submitted to the green pool,
+        other sub-requests wait for the previous ones to finish.
+
+        The response is a JSON array with the ``status``, ``headers`` and
+        ``body`` of each sub-request, in the same order.
+        '''
+        if request.method == 'OPTIONS':
+            request.app.fire('on_preflight', request)
+            return request.response
+
+        groups = []
+        for sub in self.batch_requests(request):
+            if (sub.method in READ_METHODS and groups and
+                    groups[-1][0].method in READ_METHODS):
+                groups[-1].append(sub)
+            else:
+                groups.append([sub])
+        results = self.batch_results(groups, [])
+        if is_async(results):
+            return chain_future(asyncio.ensure_future(results),
+                                callback=partial(self.batch_response,
+                                                 request))
+        return self.batch_response(request, results)
+
+    def batch_requests(self, request):
+        '''List of sub-requests from the body of a batch ``request``
+        '''
+        data = request.body_data()
+        if isinstance(data, list):
+            items, data = data, {}
+        else:
+            items = data.get('requests')
+        if not isinstance(items, list):
+            raise BadRequest('Batch requests require a list of requests')
+        limit = request.config['API_BATCH_LIMIT']
+        if len(items) > limit:
+            raise BadRequest('Batch requests are limited to %d requests' %
+                             limit)
+        # CSRF is checked once for the whole batch
+        Form(request, data=data)
+        return [self.sub_request(request, item) for item in items]
+
+    def sub_request(self, request, item):
+        '''Build a sub-request of a batch ``request`` from an ``item``
+        '''
+        if not isinstance(item, dict) or not isinstance(item.get('path'),
+                                                        str):
+            raise BadRequest('Batch sub-requests require a path')
+        path, _, query = item['path'].partition('?')
+        path = '%s/%s' % (self.path().rstrip('/'), path.lstrip('/'))
+        body = item.get('body')
+        body = b'' if body is None else to_bytes(json.dumps(body))
+        environ = dict(((key, value) for key, value in request.environ.items()
+                        if not key.startswith(('HTTP_IF_', 'CONTENT_',
+                                               'pulsar.cache'))))
+        environ.update({'REQUEST_METHOD': str(item.get('method',
+                                                       'GET')).upper(),
+                        'PATH_INFO': path,
+                        'QUERY_STRING': query,
+                        'HTTP_ACCEPT': REST_CONTENT_TYPES[0],
+                        'wsgi.input': BytesIO(body)})
+        if body:
+            environ['CONTENT_TYPE'] = REST_CONTENT_TYPES[0]
+            environ['CONTENT_LENGTH'] = str(len(body))
+        headers = item.get('headers')
+        if isinstance(headers, dict):
+            for name, value in headers.items():
+                name = name.upper().replace('-', '_')
+                if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                    name = 'HTTP_%s' % name
+                environ[name] = str(value)
+        sub = wsgi_request(environ)
+        cache = request.cache
+        for key in BATCH_CACHE:
+            if key in cache:
+                sub.cache[key] = cache[key]
+        return sub
+
+    def batch_results(self, groups, results):
+        '''Execute ``groups`` of sub-requests and append their results
+        to ``results``.
+
+        Return ``results`` or a coroutine when a group is asynchronous.
+        '''
+        for index, group in enumerate(groups):
+            group = [self.batch_execute(sub) for sub in group]
+            if any((is_async(result) for result in group)):
+                return self._batch_wait(groups[index+1:], results, group)
+            results.extend(group)
+        return results
+
+    def batch_execute(self, sub):
+        '''Execute a ``sub`` request.
+
+        Sub-requests bypass the wsgi middleware, they are counted against
+        the rate limits of the application, as a request to their path,
+        before being dispatched.
+
+        Return its result or a coroutine resulting in it.
+        '''
+        try:
+            router_args = self.resolve(sub.path[1:])
+            if not router_args:
+                raise Http404
+            router, args = router_args
+            if getattr(router, 'post', None) == self.batch:
+                raise BadRequest('Batch requests cannot be nested')
+            limiter = getattr(sub.app, 'rate_limiter', None)
+            if limiter:
+                limiter.check_request(sub)
+            response = router.response(sub.environ, args)
+        except Exception as exc:
+            return self.batch_error(sub, exc)
+        if is_async(response):
+            return self._batch_async(sub, response)
+        return self.batch_result(sub, response)
+
+    def batch_result(self, sub, response):
+        '''The result of a ``sub`` request from its ``response``.
+
+        Return a coroutine resulting in it when the content of the
+        response has asynchronous chunks.
+        '''
+        content = response.content
+        if not isinstance(content, bytes):
+            chunks = []
+            content = iter(content)
+            for chunk in content:
+                if is_async(chunk):
+                    return self._batch_content(sub, response, chunks,
+                                               chain((chunk,), content))
+                chunks.append(to_bytes(chunk))
+            content = b''.join(chunks)
+        return self.batch_body(sub, response, content)
+
+    def batch_body(self, sub, response, content):
+        '''The result of a ``sub`` request from its ``response`` and its
+        ``content`` in bytes
+        '''
+        content_type = (response.content_type or '').split(';')[0]
+        body = to_string(content, response.encoding or 'utf-8')
+        if body and content_type in JSON_CONTENT_TYPES:
+            body = json.loads(body)
+        headers = dict(((name, value) for name, value in response.headers
+                        if name.lower() != 'content-length'))
+        return {'status': response.status_code,
+                'headers': headers,
+                'body': body}
+
+    def batch_error(self, sub, exc):
+        '''The result of a ``sub`` request failed with ``exc``
+        '''
+        headers = {}
+        if isinstance(exc, HttpException):
+            status = exc.status
+            message = str(exc) or error_messages.get(status)
+            headers.update(exc.headers or ())
+        else:
+            logger.exception('Unhandled exception in batch sub-request %s',
+                             sub.path)
+            status = 500
+            message = error_messages.get(status)
+        return {'status': status,
+                'headers': headers,
+                'body': {'status': status, 'message': message}}
+
+    def batch_response(self, request, results):
+        return Json(results).http_response(request)
+
+    def _batch_async(self, sub, response):
+        try:
+            response = yield from response
+        except Exception as exc:
+            return self.batch_error(sub, exc)
+        result = self.batch_result(sub, response)
+        if is_async(result):
+            result = yield from result
+        return result
+
+    def _batch_content(self, sub, response, chunks, content):
+        try:
+            for chunk in content:
+                if is_async(chunk):
+                    chunk = yield from chunk
+                chunks.append(to_bytes(chunk))
+        except Exception as exc:
+            return self.batch_error(sub, exc)
+        return self.batch_body(sub, response, b''.join(chunks))
+
+    def _batch_wait(self, groups, results, group):
+        pending = [index for index, result in enumerate(group)
+                   if is_async(result)]
+        done = yield from asyncio.gather(*[group[index]
+                                           for index in pending])
+        for index, result in zip(pending, done):
+            group[index] = result
+        results.extend(group)
+        results = self.batch_results(groups, results)
+        if is_async(results):
+            results = yield from results
+        return results
+
 
 class RestMixin:
     model = None
@@ -66,13 +299,18 @@ class RestRouter(RestMixin, lux.Router):
         request.app.fire('on_preflight', request)
         return request.response
 
-    def limit(self, request):
+    def limit(self, request, maxlimit=None):
         '''The maximum number of items to return when fetching list
-        of data'''
+        of data.
+
+        ``maxlimit`` overrides the maximum for authenticated users.
+        '''
         cfg = request.config
         user = request.cache.user
-        MAXLIMIT = (cfg['API_LIMIT_AUTH'] if user.is_authenticated() else
-                    cfg['API_LIMIT_NOAUTH'])
+        if user.is_authenticated():
+            MAXLIMIT = maxlimit or cfg['API_LIMIT_AUTH']
+        else:
+            MAXLIMIT = cfg['API_LIMIT_NOAUTH']
         try:
             limit = int(request.url_data.get(cfg['API_LIMIT_KEY'],
                                              cfg['API_LIMIT_DEFAULT']))
@@ -93,12 +331,57 @@ class RestRouter(RestMixin, lux.Router):
         cfg = request.config
         return request.url_data.get(cfg['API_SEARCH_KEY'], '')
 
+    def fields(self, request, in_list=False):
+        '''List of field names to return, from the comma separated
+        :setting:`API_FIELDS_KEY` url parameter or from the
+        :attr:`~.RestModel.list_fields` or :attr:`~.RestModel.detail_fields`
+        of the model.
+
+        Return ``None`` for all fields. Fields are parsed and validated
+        once per request and stored in the request cache.
+        '''
+        cache = request.cache.rest_fields
+        if cache is None:
+            cache = request.cache.rest_fields = {}
+        key = (self.model, in_list)
+        if key not in cache:
+            cache[key] = self._fields(request, in_list)
+        return cache[key]
+
+    def _fields(self, request, in_list):
+        model = self.model
+        value = request.url_data.get(request.config['API_FIELDS_KEY'])
+        if not value:
+            return model.list_fields if in_list else model.detail_fields
+        if not isinstance(value, list):
+            value = (value,)
+        fields = []
+        for entry in value:
+            for name in entry.split(','):
+                name = name.strip()
+                if name and name not in fields:
+                    fields.append(name)
+        names = set((c['name'] for c in model.columns(request.app)))
+        invalid = [name for name in fields if name not in names]
+        if invalid:
+            raise BadRequest('Unknown fields %s' % ', '.join(invalid))
+        return fields
+
     def serialise(self, request, data):
         if isinstance(data, list):
-            return [self.serialise_model(request, o, True) for o in data]
+            return self.serialise_models(request, data)
         else:
             return self.serialise_model(request, data)
 
+    def serialise_models(self, request, data):
+        '''Serialise a list of models
+        '''
+        if type(self).serialise_model is RestRouter.serialise_model:
+            # serialise in one batch unless serialise_model is overridden
+            return self.model.tojson_many(data,
+                                          fields=self.fields(request, True))
+        return [self.serialise_model(request, o, True) for o in data]
+
     def meta(self, request):
         app = request.app
         return {'columns': self.model.columns(app),
@@ -107,7 +390,7 @@ class RestRouter(RestMixin, lux.Router):
     def serialise_model(self, request, data, in_list=False):
         '''Serialise on model
         '''
-        return self.model.tojson(data)
+        return self.model.tojson(data, fields=self.fields(request, in_list))
 
     def json(self, request, data):
         '''Return a response as application/json
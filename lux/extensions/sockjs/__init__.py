@@ -39,6 +39,15 @@ class Extension(lux.Extension):
         handler used to publish messages to channels as
         well as subscribe to channels
         '''
+        self.create_pubsub(app)
+
+    def on_worker_start(self, app, worker):
+        '''The pub/sub handler is bound to the event loop, create a new one
+        in workers of a preloaded application
+        '''
+        self.create_pubsub(app)
+
+    def create_pubsub(self, app):
         pubsub_store = app.config['PUBSUB_STORE']
         if pubsub_store:
             self.pubsub_store = create_store(pubsub_store)
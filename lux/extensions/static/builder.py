@@ -7,7 +7,7 @@ import pulsar
 from pulsar.apps.wsgi import WsgiResponse
 from pulsar.utils.httpurl import remove_double_slash, urljoin
 
-from lux import route
+from lux import route, Validator
 
 from .contents import SkipBuild, BuildError, Unsupported, CONTENT_EXTENSIONS
 from .contents import Content, get_reader
@@ -303,6 +303,16 @@ class Builder(BaseBuilder):
 class FileBuilder(Builder):
     '''Build a static file within a :class:`.DirBuilder`
     '''
+    def validator(self, request):
+        '''A :class:`.Validator` from the modification time of the
+        source file of the content
+        '''
+        content = self.get_content(request)
+        try:
+            return Validator(last_modified=os.path.getmtime(content.src))
+        except (OSError, TypeError):
+            pass
+
     def get_content(self, request):
         if not request.cache.content:
             if not self.src:
@@ -3,7 +3,7 @@ import json
 from copy import copy
 
 import lux
-from lux import route, JSON_CONTENT_TYPES
+from lux import route, conditional, JSON_CONTENT_TYPES
 from lux.extensions import base, sitemap
 
 from pulsar import ImproperlyConfigured
@@ -92,6 +92,7 @@ class JsonFile(Router, FileBuilder):
     '''
     html_router = None
 
+    @conditional()
     def get(self, request):
         app = request.app
         response = request.response
@@ -199,6 +200,10 @@ class HtmlFile(HtmlRouter, FileBuilder):
     def html_router(self):
         return self.parent
 
+    @conditional()
+    def get(self, request, html=None):
+        return super().get(request, html)
+
     def get_html(self, request):
         content = self.get_content(request)
         if content._meta.slug in request.config['STATIC_SPECIALS']:
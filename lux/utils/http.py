@@ -1,7 +1,65 @@
+'''HTTP utilities.
+
+Rate Limits
+===============
+A :class:`RateLimit` allows ``limit`` requests every ``per`` seconds for
+each client, identified by the ``scope`` of the limit:
+
+* ``ip`` the remote address of the client
+* ``token`` the token or session key verified by an authentication
+  backend, in ``request.cache.credential``, the remote address when not
+  available
+* ``user`` the id of the authenticated user, the ``token`` when the user
+  is not authenticated
+* a callable returning the key from a request
+
+Limits are enforced by the :class:`RateLimiter` middleware before
+requests reach routers. A limit can be applied to all requests, via the
+:setting:`RATE_LIMIT` parameter of the :mod:`~lux.extensions.base`
+extension, to routers with a ``rate_limit`` attribute::
+
+    class Search(lux.Router):
+        rate_limit = RateLimit(30, per=60, scope='token')
+
+or to router methods decorated with :func:`ratelimit`, which are checked
+once the user has been authenticated::
+
+    class Articles(lux.Router):
+
+        @ratelimit(100, per=3600, scope='user')
+        def post(self, request):
+            ...
+
+The middleware runs before authentication, therefore the ``token`` and
+``user`` scopes of :setting:`RATE_LIMIT` and of router limits identify
+clients by their remote address: unverified credentials are never used
+as keys, since clients could send a new one at every request.
+
+Requests over the limit fail with a ``429`` status code and responses
+carry the ``X-RateLimit-Limit``, ``X-RateLimit-Remaining`` and
+``X-RateLimit-Reset`` headers of the most restrictive limit.
+'''
 import time
+import hashlib
+import threading
+from functools import wraps
+from collections import namedtuple
 
+from pulsar import HttpException
+from pulsar.apps.wsgi import Router, wsgi_request
 from pulsar.utils.httpurl import urlparse
 
+from lux.core.cache import LRUCache
+from lux.core.dispatch import RouterIndex
+
+
+__all__ = ['same_origin', 'RateLimit', 'RateLimiter', 'TokenBucket',
+           'SlidingWindow', 'TooManyRequests', 'ratelimit']
+
+
+# environ key of the most restrictive Hit of a request
+HIT = 'lux.ratelimit'
+
 
 def same_origin(url1, url2):
     """
@@ -15,45 +73,337 @@ def same_origin(url1, url2):
         return False
 
 
-class RateLimit(object):
-    '''A Rate Limit decorator
+class TooManyRequests(HttpException):
+    status = 429
+
+
+class Hit(namedtuple('Hit', 'allowed limit remaining reset retry')):
+    '''Outcome of a request against a rate limit.
+
+    ``reset`` is the time when the limit is fully available again and
+    ``retry`` the seconds to wait before a request is allowed.
     '''
-    expiration_window = 10
+    __slots__ = ()
 
-    def __init__(self, key_prefix, limit, per, send_x_headers):
-        self.reset = (int(time.time()) // per) * per + per
-        self.key = key_prefix + str(self.reset)
-        self.limit = limit
+    def headers(self):
+        return [('X-RateLimit-Limit', str(self.limit)),
+                ('X-RateLimit-Remaining', str(self.remaining)),
+                ('X-RateLimit-Reset', str(int(self.reset) + 1))]
+
+
+class RateLimit:
+    '''Allow ``limit`` requests every ``per`` seconds for each client
+    identified by ``scope``.
+
+    :param limit: maximum number of requests
+    :param per: period in seconds
+    :param scope: ``ip``, ``token``, ``user`` or a callable returning a
+        key from a request
+    :param name: optional name for counting requests of different routers
+        against the same limit
+    '''
+    def __init__(self, limit, per=60, scope='ip', name=None):
+        if not callable(scope) and scope not in SCOPES:
+            raise ValueError('Unknown rate limit scope "%s"' % scope)
+        self.limit = int(limit)
         self.per = per
-        self.send_x_headers = send_x_headers
-        p = redis.pipeline()
-        p.incr(self.key)
-        p.expireat(self.key, self.reset + self.expiration_window)
-        self.current = min(p.execute()[0], limit)
+        self.scope = scope
+        self.name = name
+
+    def __repr__(self):
+        return '%s(%d/%s)' % (self.__class__.__name__, self.limit, self.per)
+    __str__ = __repr__
+
+    @classmethod
+    def parse(cls, value, scope='ip', name=None):
+        '''Build a :class:`RateLimit` from a ``<limit>/<seconds>`` string
+        '''
+        try:
+            limit, per = value.split('/')
+            return cls(int(limit), float(per), scope, name)
+        except (AttributeError, ValueError):
+            raise ValueError('Invalid rate limit "%s"' % value)
+
+    def key(self, request):
+        '''The key identifying the client of ``request``
+        '''
+        scope = self.scope
+        if callable(scope):
+            return str(scope(request))
+        return SCOPES[scope](request)
+
+
+class RateLimiter:
+    '''Request and response middleware enforcing :class:`RateLimit`.
+
+    .. attribute:: backend
+
+        The :class:`TokenBucket` or :class:`SlidingWindow` counting
+        requests
+
+    .. attribute:: limit
+
+        Optional :class:`RateLimit` of all requests
+    '''
+    def __init__(self, backend, limit=None):
+        self.backend = backend
+        self.limit = limit
+        self.routers = ()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.backend)
+    __str__ = __repr__
+
+    @property
+    def blocking(self):
+        '''``True`` when the :attr:`backend` blocks on I/O, so that the
+        limiter runs on the green pool with :setting:`GREEN_POOL_SELECTIVE`
+        '''
+        return getattr(self.backend, 'blocking', False) is True
 
-    remaining = property(lambda x: x.limit - x.current)
-    over_limit = property(lambda x: x.current >= x.limit)
+    def setup(self, middleware):
+        '''Collect routers with a ``rate_limit`` from the ``middleware``
+        of the application.
+        '''
+        routers = []
+        for wsgi in middleware:
+            if isinstance(wsgi, RouterIndex):
+                routers.extend(wsgi.routers)
+            elif isinstance(wsgi, Router):
+                routers.append(wsgi)
+        while routers and not has_limit(routers[-1]):
+            routers.pop()
+        self.routers = tuple(routers)
 
+    def __call__(self, environ, start_response):
+        if self.limit or self.routers:
+            self.check_request(wsgi_request(environ))
 
-def get_view_rate_limit():
-    return getattr(g, '_view_rate_limit', None)
+    def check_request(self, request):
+        '''Count ``request`` against the :attr:`limit` of all requests
+        and the ``rate_limit`` of the router serving its path.
 
+        :raise: :class:`TooManyRequests` when over a limit
+        '''
+        if self.limit:
+            self.check(request, self.limit, self.limit.name or 'all')
+        if self.routers:
+            path = (request.environ.get('PATH_INFO') or '/')[1:]
+            for router in self.routers:
+                resolved = router.resolve(path)
+                if resolved:
+                    router = resolved[0]
+                    limit = getattr(router, 'rate_limit', None)
+                    if limit:
+                        self.check(request, limit,
+                                   limit.name or router.route.rule)
+                    break
 
-def on_over_limit(limit):
-    return 'You hit the rate limit', 400
+    def check(self, request, limit, name):
+        '''Count ``request`` against ``limit``.
 
+        :raise: :class:`TooManyRequests` when over the limit
+        '''
+        key = 'lux:ratelimit:%s:%s' % (name, limit.key(request))
+        hit = self.backend.hit(key, limit.limit, limit.per)
+        environ = request.environ
+        current = environ.get(HIT)
+        if current is None or hit.remaining <= current.remaining:
+            environ[HIT] = hit
+        if not hit.allowed:
+            retry = str(int(hit.retry) + 1)
+            raise TooManyRequests('Rate limit exceeded, retry in %s seconds'
+                                  % retry, headers=[('Retry-After', retry)])
+
+    def headers(self, environ, response):
+        '''Response middleware adding the rate limit headers
+        '''
+        hit = environ.get(HIT)
+        if hit:
+            for name, value in hit.headers():
+                response[name] = value
+        return response
+
+
+class TokenBucket:
+    '''Count requests in the memory of the process.
+
+    Each key has a bucket of ``limit`` tokens refilled at a rate of
+    ``limit/per`` tokens per second. A request takes a token and is not
+    allowed when the bucket is empty. Buckets are evicted once full, or
+    when more than ``max_entries`` buckets are in use.
+    '''
+    def __init__(self, max_entries=100000):
+        self.buckets = LRUCache(max_entries=max_entries)
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return self.__class__.__name__
+    __str__ = __repr__
+
+    def hit(self, key, limit, per):
+        rate = limit / per
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                tokens = limit
+            else:
+                tokens = min(limit, bucket[0] + (now - bucket[1])*rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # a bucket is full again after the timeout
+            self.buckets.set(key, (tokens, now), (limit - tokens)/rate)
+        return Hit(allowed, limit, int(tokens), now + (limit - tokens)/rate,
+                   0 if allowed else (1 - tokens)/rate)
+
+
+class SlidingWindow:
+    '''Count requests in a ``cache`` server shared by all workers.
+
+    Requests are counted in fixed windows of ``per`` seconds and the count
+    of the sliding window is the count of the current window plus the
+    count of the previous window weighted by its overlap with the sliding
+    window.
+
+    Each worker counts requests locally and adds them to the cache server
+    with one atomic increment every ``batch`` requests, or at every
+    request when the limit is close. The count of other workers is
+    refreshed at each increment, therefore a key can exceed its limit by
+    at most ``batch - 1`` requests per worker.
+    '''
+    # increments talk to the cache server
+    blocking = True
+
+    def __init__(self, cache, batch=10, max_entries=10000):
+        self.cache = cache
+        self.batch = max(int(batch), 1)
+        self.max_entries = max_entries
+        # key -> [window, shared count, local count, previous count]
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.cache)
+    __str__ = __repr__
+
+    def hit(self, key, limit, per):
+        now = time.time()
+        window = int(now // per)
+        state = self.windows.get(key)
+        if state is None or state[0] != window:
+            state = self.start(key, window, per, state)
+        weight = 1 - (now - window*per)/per
+        # the lock is not held while talking to the cache server
+        with self.lock:
+            count = state[3]*weight + state[1] + state[2]
+            allowed = count + 1 <= limit
+            amount = 0
+            if allowed:
+                state[2] += 1
+                count += 1
+                if state[2] >= self.batch or count + self.batch > limit:
+                    amount, state[2] = state[2], 0
+        if amount:
+            total = self.incr(key, window, amount, per)
+            with self.lock:
+                state[1] = max(state[1], total)
+        remaining = max(int(limit - count), 0)
+        reset = (window + 1)*per
+        if allowed:
+            retry = 0
+        else:
+            # wait for the previous window count to slide out
+            excess = count + 1 - limit
+            if excess < state[3]*weight:
+                retry = excess*per/state[3]
+            else:
+                retry = reset - now
+        return Hit(allowed, limit, remaining, reset, retry)
+
+    def start(self, key, window, per, previous=None):
+        '''Start a new ``window`` for ``key``
+        '''
+        if previous:
+            with self.lock:
+                amount, previous[2] = previous[2], 0
+            if amount:
+                self.incr(key, previous[0], amount, per)
+        cache = self.cache
+        state = [window,
+                 int(cache.get(self.window_key(key, window)) or 0), 0,
+                 int(cache.get(self.window_key(key, window - 1)) or 0)]
+        with self.lock:
+            windows = self.windows
+            if len(windows) >= self.max_entries:
+                # discard keys without local counts of past windows
+                for name, value in list(windows.items()):
+                    if value[0] < window and not value[2]:
+                        windows.pop(name)
+            windows[key] = state
+        return state
+
+    def incr(self, key, window, amount, per):
+        name = self.window_key(key, window)
+        total = int(self.cache.incr(name, amount))
+        if total == amount:
+            # the first increment of the window, which is needed until
+            # the end of the next window
+            self.cache.expire(name, int(2*per) + 1)
+        return total
+
+    def window_key(self, key, window):
+        return '%s:%d' % (key, window)
+
+
+def ratelimit(limit, per=60, scope='user', name=None):
+    '''Decorator enforcing a :class:`RateLimit` on a router method.
+
+    The limit is checked after the request middleware, therefore the
+    ``user`` scope identifies authenticated users.
+    '''
+    def decorator(method):
+        rate_limit = RateLimit(limit, per, scope,
+                               name or method.__qualname__)
+
+        @wraps(method)
+        def _(self, request):
+            limiter = getattr(request.app, 'rate_limiter', None)
+            if limiter:
+                limiter.check(request, rate_limit, rate_limit.name)
+            return method(self, request)
+
+        return _
 
-def ratelimit(limit, per=300, send_x_headers=True,
-              over_limit=on_over_limit,
-              scope_func=lambda: request.remote_addr,
-              key_func=lambda: request.endpoint):
-    def decorator(f):
-        def rate_limited(*args, **kwargs):
-            key = 'rate-limit/%s/%s/' % (key_func(), scope_func())
-            rlimit = RateLimit(key, limit, per, send_x_headers)
-            g._view_rate_limit = rlimit
-            if over_limit is not None and rlimit.over_limit:
-                return over_limit(rlimit)
-            return f(*args, **kwargs)
-        return update_wrapper(rate_limited, f)
     return decorator
+
+
+def has_limit(router):
+    if getattr(router, 'rate_limit', None):
+        return True
+    return any((has_limit(child) for child in router.routes))
+
+
+def ip_key(request):
+    return 'ip:%s' % request.environ.get('REMOTE_ADDR', '')
+
+
+def token_key(request):
+    credential = request.cache.credential
+    if credential:
+        return 'token:%s' % hashlib.sha1(
+            str(credential).encode('utf-8')).hexdigest()
+    return ip_key(request)
+
+
+def user_key(request):
+    user = request.cache.user
+    if user and user.is_authenticated():
+        return 'user:%s' % getattr(user, 'id', user)
+    return token_key(request)
+
+
+SCOPES = {'ip': ip_key,
+          'token': token_key,
+          'user': user_key}
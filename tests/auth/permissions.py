@@ -0,0 +1,83 @@
+from lux.extensions.rest import READ, CREATE, UPDATE, DELETE
+from lux.extensions.auth.models import PermissionType
+from lux.utils import test
+
+
+class TestPermissions(test.AppTestCase):
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://'}
+
+    def backend(self):
+        return self.app.auth_backend.backends[0]
+
+    def request(self, user):
+        request = self.app.wsgi_request()
+        request.cache.user = user
+        return request
+
+    def create_user(self, username):
+        request = self.app.wsgi_request()
+        return self.app.auth_backend.create_user(
+            request, username=username, email='%s@foo.com' % username,
+            password='pluto')
+
+    def grant(self, session, owner, table, type):
+        odm = self.app.odm()
+        permission = odm.permission(content_table_name=table, type=type)
+        session.add(owner)
+        session.add(permission)
+        owner.permissions.append(permission)
+
+    def test_levels(self):
+        odm = self.app.odm()
+        user = self.create_user('levels')
+        with odm.begin() as session:
+            group = odm.group(name='editors')
+            self.grant(session, group, 'task', PermissionType.can_change)
+            self.grant(session, user, 'task', PermissionType.can_add)
+            self.grant(session, user, 'person', PermissionType.can_remove)
+            user.groups.append(group)
+            session.add(user)
+        backend = self.backend()
+        request = self.request(user)
+        self.assertEqual(backend.permissions(request),
+                         {'task': frozenset((20, 30)),
+                          'person': frozenset((40,))})
+        self.assertTrue(backend.has_permission(request, 'task', READ))
+        self.assertTrue(backend.has_permission(request, 'task', CREATE))
+        self.assertTrue(backend.has_permission(request, 'task', UPDATE))
+        self.assertFalse(backend.has_permission(request, 'task', DELETE))
+        self.assertTrue(backend.has_permission(request, 'person', DELETE))
+        # permission types are not a hierarchy
+        self.assertFalse(backend.has_permission(request, 'person', UPDATE))
+        self.assertFalse(backend.has_permission(request, 'person', CREATE))
+        self.assertFalse(backend.has_permission(request, 'foo', CREATE))
+        # Anonymous users have no permissions
+        request = self.app.wsgi_request()
+        self.app.auth_backend.request(request)
+        self.assertEqual(backend.permissions(request), {})
+
+    def test_cache(self):
+        odm = self.app.odm()
+        user = self.create_user('cached')
+        backend = self.backend()
+        cache = backend.permissions_cache
+        request = self.request(user)
+        self.assertEqual(backend.permissions(request), {})
+        self.assertEqual(cache.get(user.id), {})
+        # cached in the request
+        cache.set(user.id, {'task': frozenset((40,))})
+        self.assertEqual(backend.permissions(request), {})
+        # cached across requests
+        self.assertEqual(backend.permissions(self.request(user)),
+                         {'task': frozenset((40,))})
+        # a change of the user invalidates its permissions
+        with odm.begin() as session:
+            self.grant(session, user, 'task', PermissionType.can_view)
+        self.assertEqual(cache.get(user.id), None)
+        self.assertEqual(backend.permissions(self.request(user)),
+                         {'task': frozenset((10,))})
+        # a change of a group invalidates all permissions
+        with odm.begin() as session:
+            session.add(odm.group(name='viewers'))
+        self.assertEqual(len(cache), 0)
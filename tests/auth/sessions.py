@@ -0,0 +1,138 @@
+from lux.extensions.rest.backends import Session
+from lux.utils import test
+
+
+class TestSessions(test.AppTestCase):
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'CACHE_SERVER': 'memory://',
+                     'AUTHENTICATION_BACKENDS': [
+                         'lux.extensions.auth.SessionBackend']}
+
+    def backend(self):
+        return self.app.auth_backend.backends[0]
+
+    def stored(self, session):
+        return self.app.cache_server.hgetall('session:%s' % session.id)
+
+    def ttl(self, session):
+        return self.app.cache_server.ttl('session:%s' % session.id)
+
+    def create_user(self, username):
+        request = self.app.wsgi_request()
+        return self.backend().create_user(
+            request, username=username, email='%s@foo.com' % username,
+            password='pluto', active=True)
+
+    def test_dirty_tracking(self):
+        session = Session()
+        self.assertTrue(session.new)
+        self.assertFalse(session.modified)
+        session['foo'] = 1
+        session['foo'] = 1
+        self.assertTrue(session.modified)
+        self.assertEqual(session.changes(), ({'foo': 1}, ()))
+        self.assertFalse(session.new)
+        session['foo'] = 1
+        self.assertFalse(session.modified)
+        del session['foo']
+        session['bla'] = 2
+        self.assertEqual(session.changes(), ({'bla': 2}, ('foo',)))
+        session.info('hello')
+        self.assertEqual(session.get_messages(),
+                         [{'level': 'info', 'message': 'hello'}])
+        self.assertTrue(session.remove_message('hello'))
+        self.assertFalse(session.remove_message('hello'))
+
+    def test_save(self):
+        backend = self.backend()
+        request = self.app.wsgi_request()
+        session = backend.session_create(request)
+        session['foo'] = 'bla'
+        backend.session_save(session)
+        self.assertEqual(self.stored(session),
+                         {'user_id': 'null', 'foo': '"bla"'})
+        self.assertTrue(self.ttl(session) > 0)
+        loaded = backend.get_session(session.id)
+        self.assertFalse(loaded.loaded)
+        self.assertEqual(loaded['foo'], 'bla')
+        self.assertFalse(loaded.modified)
+        loaded['pippo'] = [1, 2]
+        del loaded['foo']
+        backend.session_save(loaded)
+        self.assertEqual(self.stored(session),
+                         {'user_id': 'null', 'pippo': '[1, 2]'})
+
+    def test_session_data(self):
+        backend = self.backend()
+        cache = self.app.cache_server
+        self.assertEqual(backend.session_data('missing'), None)
+        # redis returns the fields and values of a hash as bytes
+        cache.hmset('session:raw', {b'user_id': b'null', b'foo': b'"bla"'})
+        self.assertEqual(backend.session_data('raw'),
+                         {'user_id': None, 'foo': 'bla'})
+
+    def test_blocks(self):
+        backend = self.backend()
+        request = self.app.wsgi_request(extra={'HTTP_COOKIE': 'LUX=foo'})
+        self.assertTrue(backend.blocks(request.environ))
+        request = self.app.wsgi_request()
+        self.assertFalse(backend.blocks(request.environ))
+        self.assertFalse(self.app.auth_backend.blocks(request.environ))
+
+    def test_unknown(self):
+        backend = self.backend()
+        request = self.app.wsgi_request()
+        session = backend.get_session('foo', backend._expiry(request))
+        self.assertEqual(session.user_id, None)
+        self.assertNotEqual(session.id, 'foo')
+        self.assertTrue(session.new)
+        self.assertTrue(session.expiry)
+        session['csrf'] = True
+        backend.session_save(session)
+        self.assertEqual(self.stored(session), {'csrf': 'true'})
+        self.assertTrue(self.ttl(session) > 0)
+        # without expiry the session still expires
+        session = backend.get_session('bla')
+        session['csrf'] = True
+        backend.session_save(session)
+        self.assertTrue(self.ttl(session) > 0)
+
+    def test_login_logout(self):
+        backend = self.backend()
+        user = self.create_user('logout')
+        request = self.client.get('/')
+        anonymous = request.cache.session
+        anonymous['foo'] = 'bla'
+        backend.session_save(anonymous)
+        backend.login(request, user)
+        self.assertEqual(self.stored(anonymous), {})
+        session = request.cache.session
+        self.assertEqual(session.user_id, user.id)
+        backend.session_save(session)
+        self.assertTrue(self.stored(session))
+        backend.logout(request)
+        self.assertEqual(self.stored(session), {})
+        self.assertNotEqual(request.cache.session.id, session.id)
+        self.assertEqual(request.cache.user.is_anonymous(), True)
+
+    def test_anonymous(self):
+        request = self.client.get('/')
+        session = request.cache.session
+        self.assertTrue(session.new)
+        self.assertFalse(session.modified)
+        self.assertFalse('Set-Cookie' in request.response.headers)
+        self.assertEqual(self.stored(session), {})
+
+    def test_cookie(self):
+        backend = self.backend()
+        request = self.app.wsgi_request()
+        user = self.create_user('sessions')
+        session = backend.session_create(request, user)
+        backend.session_save(session)
+        cookie = '%s=%s' % (self.app.config['SESSION_COOKIE_NAME'],
+                            session.id)
+        request = self.client.get('/', HTTP_COOKIE=cookie)
+        self.assertEqual(request.cache.user.id, user.id)
+        self.assertEqual(request.cache.session.id, session.id)
+        self.assertFalse('Set-Cookie' in request.response.headers)
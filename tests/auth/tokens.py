@@ -0,0 +1,111 @@
+from lux.utils import test
+
+
+class TestTokenCache(test.AppTestCase):
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://'}
+
+    def backend(self):
+        return self.app.auth_backend.backends[0]
+
+    def token(self, username):
+        backend = self.app.auth_backend
+        request = self.app.wsgi_request()
+        user = backend.create_user(request, username=username,
+                                   email='%s@foo.com' % username,
+                                   password='pluto', active=True)
+        token = backend.create_token(request, user).decode('utf-8')
+        return user, token
+
+    def get(self, token):
+        request = self.client.get('/',
+                                  HTTP_AUTHORIZATION='bearer %s' % token)
+        return request.cache.user
+
+    def test_cache(self):
+        user, token = self.token('cached')
+        tokens = self.backend().tokens
+        self.assertEqual(self.get(token).id, user.id)
+        data, cached = tokens.get(token)
+        self.assertEqual(data['user_id'], user.id)
+        self.assertTrue(tokens.ttl(token) <= 300)
+        hits = tokens.hits
+        user1 = self.get(token)
+        self.assertEqual(user1.id, user.id)
+        self.assertEqual(tokens.hits, hits + 1)
+        # requests do not share the cached user
+        user1.first_name = 'changed'
+        user2 = self.get(token)
+        self.assertNotEqual(user2, user1)
+        self.assertNotEqual(user2, cached)
+        self.assertEqual(user2.username, 'cached')
+        self.assertNotEqual(user2.first_name, 'changed')
+        self.assertNotEqual(cached.first_name, 'changed')
+
+    def test_revoke_token(self):
+        odm = self.app.odm()
+        user, token = self.token('revoked')
+        tokens = self.backend().tokens
+        self.get(token)
+        self.assertTrue(token in tokens)
+        data, _ = tokens.get(token)
+        with odm.begin() as session:
+            session.delete(session.query(odm.token).get(data['token_id']))
+        self.assertFalse(token in tokens)
+
+    def test_revoke_user(self):
+        odm = self.app.odm()
+        user, token = self.token('deactivated')
+        tokens = self.backend().tokens
+        self.get(token)
+        self.assertTrue(token in tokens)
+        with odm.begin() as session:
+            user.active = False
+            session.add(user)
+        self.assertFalse(token in tokens)
+        self.assertEqual(self.backend().revoke(user_id=user.id), 0)
+
+    def test_revoke_index(self):
+        backend = self.backend()
+        user, token1 = self.token('indexed')
+        token2 = backend.create_token(self.app.wsgi_request(),
+                                      user).decode('utf-8')
+        self.get(token1)
+        self.get(token2)
+        data, _ = backend.tokens.get(token1)
+        self.assertEqual(backend.token_index[('user', user.id)],
+                         set((token1, token2)))
+        self.assertEqual(backend.revoke(token_id=data['token_id']), 1)
+        self.assertFalse(token1 in backend.tokens)
+        self.assertTrue(token2 in backend.tokens)
+        self.assertEqual(backend.revoke(user_id=user.id), 1)
+        self.assertFalse(token2 in backend.tokens)
+        self.assertFalse(('user', user.id) in backend.token_index)
+
+    def test_last_access(self):
+        odm = self.app.odm()
+        user, token = self.token('touched')
+        buffer = self.app.write_behind
+        self.get(token)
+        self.get(token)
+        data, _ = self.backend().tokens.get(token)
+        self.assertTrue(buffer.pending)
+        with odm.begin() as session:
+            last_access = session.query(odm.token).get(
+                data['token_id']).last_access
+        buffer.flush()
+        with odm.begin() as session:
+            self.assertTrue(session.query(odm.token).get(
+                data['token_id']).last_access > last_access)
+
+    def test_blocks(self):
+        user, token = self.token('blocking')
+        backend = self.backend()
+        environ = {'HTTP_AUTHORIZATION': 'bearer %s' % token}
+        self.assertTrue(backend.blocks(environ))
+        self.assertTrue(self.app.auth_backend.blocks(environ))
+        self.get(token)
+        # verified tokens are served from memory
+        self.assertFalse(backend.blocks(environ))
+        self.assertFalse(backend.blocks({}))
+        self.assertFalse(self.app.auth_backend.blocks({}))
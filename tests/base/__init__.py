@@ -0,0 +1,38 @@
+import lux
+from lux.extensions.base import CachePolicy
+from lux.utils.http import RateLimit, ratelimit
+
+
+EXTENSIONS = ['lux.extensions.base']
+
+CACHE_SERVER = 'memory://'
+GZIP_MIN_LENGTH = 0
+
+
+class Counter(lux.Router):
+    response_cache = CachePolicy(timeout=60, stale=60)
+    hits = 0
+
+    def get(self, request):
+        Counter.hits += 1
+        request.response.content = ('%d' % Counter.hits).encode('utf-8')
+        return request.response
+
+
+class Limited(lux.Router):
+    rate_limit = RateLimit(2, per=60)
+
+    def get(self, request):
+        return request.response
+
+    @ratelimit(1, per=60)
+    def post(self, request):
+        return request.response
+
+
+class Extension(lux.Extension):
+
+    def middleware(self, app):
+        return [Counter('counter'),
+                lux.Router('nocache', get=lambda r: r.response),
+                Limited('limited')]
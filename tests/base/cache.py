@@ -0,0 +1,123 @@
+import pickle
+
+from lux.utils import test
+
+from tests.base import Counter
+
+
+class TestResponseCache(test.AppTestCase):
+    config_file = 'tests.base'
+
+    def cache(self):
+        return self.app.extensions['lux.extensions.base'].response_cache
+
+    def test_routers(self):
+        cache = self.cache()
+        self.assertEqual(len(cache.routers), 1)
+        self.assertIsInstance(cache.routers[0], Counter)
+
+    def test_hit(self):
+        counters = self.cache().counters
+        hits = counters['hit']
+        request = self.client.get('/counter?b=2&a=1')
+        response = request.response
+        self.assertEqual(response['X-Cache'], 'MISS')
+        body = response.content
+        request = self.client.get('/counter?a=1&b=2')
+        response = request.response
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.content, body)
+        self.assertEqual(counters['hit'], hits + 1)
+
+    def test_auth_bypass(self):
+        counters = self.cache().counters
+        bypass = counters['bypass:auth']
+        request = self.client.get('/counter',
+                                  HTTP_AUTHORIZATION='bearer 1234')
+        self.assertFalse(request.response.has_header('X-Cache'))
+        self.assertEqual(counters['bypass:auth'], bypass + 1)
+
+    def test_no_cache(self):
+        request = self.client.get('/counter?c=1')
+        body = request.response.content
+        request = self.client.get('/counter?c=1',
+                                  HTTP_CACHE_CONTROL='no-cache')
+        self.assertNotEqual(request.response.content, body)
+        request = self.client.get('/counter?c=1')
+        self.assertEqual(request.response['X-Cache'], 'HIT')
+
+    def test_stale(self):
+        cache = self.cache()
+        request = self.client.get('/counter?d=1')
+        key = cache.routers[0].response_cache.key(
+            request, cache.routers[0], None)
+        server = self.app.cache_server
+        entry = list(pickle.loads(server.get(key)))
+        entry[0] -= 90
+        server.set(key, pickle.dumps(tuple(entry)))
+        # the entry is stale, this request revalidates it
+        request = self.client.get('/counter?d=1')
+        self.assertEqual(request.response['X-Cache'], 'MISS')
+        self.assertEqual(cache.counters['revalidate'], 1)
+        # another request is rendering it, serve stale
+        entry = list(pickle.loads(server.get(key)))
+        entry[0] -= 90
+        server.set(key, pickle.dumps(tuple(entry)))
+        server.set('%s:lock' % key, 1)
+        request = self.client.get('/counter?d=1')
+        self.assertEqual(request.response['X-Cache'], 'STALE')
+        server.delete('%s:lock' % key)
+
+    def test_not_cached(self):
+        request = self.client.get('/nocache')
+        self.assertFalse(request.response.has_header('X-Cache'))
+
+
+class TestEtag(test.TestCase):
+
+    def test_content_etag(self):
+        from lux.extensions.base import content_etag
+        app = self.application()
+        request = app.wsgi_request(path='/')
+        response = request.response
+        response.content = b'hello'
+        etag = content_etag(response)
+        self.assertEqual(len(etag), 34)
+        response.content = (c for c in (b'hel', b'lo'))
+        self.assertEqual(content_etag(response), etag)
+        self.assertEqual(b''.join(response.content), b'hello')
+
+    def test_content_etag_str(self):
+        from lux.extensions.base import content_etag
+        app = self.application()
+        request = app.wsgi_request(path='/')
+        response = request.response
+        response.content = b'{"id":1}\n{"id":2}\n'
+        etag = content_etag(response)
+        # str chunks, such as NDJSON collections, are encoded
+        response.content = (c for c in ('{"id":1}\n', '{"id":2}\n'))
+        self.assertEqual(content_etag(response), etag)
+        self.assertEqual(b''.join(response.content),
+                         b'{"id":1}\n{"id":2}\n')
+
+    def test_content_etag_max_size(self):
+        from lux.extensions.base import content_etag
+        app = self.application()
+        request = app.wsgi_request(path='/')
+        response = request.response
+        response.content = (c for c in (b'hel', b'lo', b' world'))
+        self.assertEqual(content_etag(response, 5), None)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.content), b'hello world')
+        response.content = (c for c in (b'hel', b'lo'))
+        self.assertTrue(content_etag(response, 5))
+
+    def test_content_etag_async(self):
+        from lux.extensions.base import content_etag
+        app = self.application()
+        request = app.wsgi_request(path='/')
+        response = request.response
+        future = object()
+        response.content = (c for c in (b'hel', future, b'lo'))
+        self.assertEqual(content_etag(response), None)
+        self.assertEqual(list(response.content), [b'hel', future, b'lo'])
@@ -0,0 +1,129 @@
+from unittest import mock
+
+from pulsar.apps.data import create_store
+
+from lux.utils import test
+from lux.utils.http import (RateLimit, RateLimiter, TokenBucket,
+                            SlidingWindow)
+
+
+class TestRateLimit(test.TestCase):
+
+    def test_parse(self):
+        limit = RateLimit.parse('100/60', 'token')
+        self.assertEqual(limit.limit, 100)
+        self.assertEqual(limit.per, 60)
+        self.assertEqual(limit.scope, 'token')
+        self.assertRaises(ValueError, RateLimit.parse, '100')
+        self.assertRaises(ValueError, RateLimit, 10, scope='foo')
+
+    def test_scopes(self):
+        app = self.application()
+        extra = {'REMOTE_ADDR': '10.0.0.1'}
+        request = app.wsgi_request(path='/', extra=extra)
+        self.assertEqual(RateLimit(1).key(request), 'ip:10.0.0.1')
+        self.assertEqual(RateLimit(1, scope='token').key(request),
+                         'ip:10.0.0.1')
+        # unverified credentials are keyed by the remote address
+        request = app.wsgi_request(path='/', extra=extra,
+                                   headers=[('Authorization', 'bearer 1')])
+        self.assertEqual(RateLimit(1, scope='user').key(request),
+                         'ip:10.0.0.1')
+        request.cache.credential = '1'
+        key = RateLimit(1, scope='user').key(request)
+        self.assertTrue(key.startswith('token:'))
+        self.assertEqual(RateLimit(1, scope='token').key(request), key)
+        limit = RateLimit(1, scope=lambda r: 'foo')
+        self.assertEqual(limit.key(request), 'foo')
+
+    def test_token_bucket(self):
+        backend = TokenBucket()
+        hits = [backend.hit('a', 3, 60) for _ in range(4)]
+        self.assertEqual([hit.allowed for hit in hits],
+                         [True, True, True, False])
+        self.assertEqual([hit.remaining for hit in hits], [2, 1, 0, 0])
+        self.assertTrue(0 < hits[-1].retry <= 20)
+        self.assertTrue(backend.hit('b', 3, 60).allowed)
+        # the bucket is refilled over time
+        with mock.patch('lux.utils.http.time.time',
+                        return_value=hits[-1].reset):
+            self.assertEqual(backend.hit('a', 3, 60).remaining, 2)
+
+    def test_sliding_window(self):
+        store = create_store('memory://').client()
+        backend = SlidingWindow(store, batch=3)
+        worker = SlidingWindow(store, batch=3)
+        with mock.patch('lux.utils.http.time.time', return_value=600.0):
+            hits = [backend.hit('a', 8, 60) for _ in range(3)]
+            self.assertTrue(all((hit.allowed for hit in hits)))
+            # one increment per batch
+            self.assertEqual(store.get('a:10'), 3)
+            hits = [worker.hit('a', 8, 60) for _ in range(6)]
+        self.assertEqual([hit.allowed for hit in hits],
+                         [True, True, True, True, True, False])
+        self.assertEqual(store.get('a:10'), 8)
+        self.assertEqual(hits[-1].remaining, 0)
+        # half of the previous window is still counted
+        with mock.patch('lux.utils.http.time.time', return_value=690.0):
+            hits = [backend.hit('a', 8, 60) for _ in range(5)]
+        self.assertEqual([hit.allowed for hit in hits],
+                         [True, True, True, True, False])
+        self.assertTrue(hits[-1].retry > 0)
+
+
+class TestRateLimiter(test.AppTestCase):
+    config_file = 'tests.base'
+    config_params = {'RATE_LIMIT': '5/60'}
+
+    def test_limiter(self):
+        limiter = self.app.rate_limiter
+        self.assertIsInstance(limiter, RateLimiter)
+        self.assertIsInstance(limiter.backend, TokenBucket)
+        self.assertEqual(limiter.limit.limit, 5)
+        self.assertEqual(len(limiter.routers), 3)
+        self.assertFalse(limiter.blocking)
+
+    def test_router_limit(self):
+        request = self.client.get('/limited', REMOTE_ADDR='10.0.0.2')
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-RateLimit-Limit'], '2')
+        self.assertEqual(response['X-RateLimit-Remaining'], '1')
+        self.client.get('/limited', REMOTE_ADDR='10.0.0.2')
+        request = self.client.get('/limited', REMOTE_ADDR='10.0.0.2')
+        response = request.response
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+        self.assertTrue(int(response['Retry-After']) > 0)
+        # other clients are not limited
+        request = self.client.get('/limited', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(request.response.status_code, 200)
+
+    def test_global_limit(self):
+        for _ in range(5):
+            request = self.client.get('/nocache', REMOTE_ADDR='10.0.0.4')
+            self.assertEqual(request.response.status_code, 200)
+        request = self.client.get('/nocache', REMOTE_ADDR='10.0.0.4')
+        self.assertEqual(request.response.status_code, 429)
+
+    def test_decorator(self):
+        request = self.client.post('/limited', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(request.response.status_code, 200)
+        request = self.client.post('/limited', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(request.response.status_code, 429)
+
+
+class TestSharedRateLimiter(test.AppTestCase):
+    config_file = 'tests.base'
+    config_params = {'RATE_LIMIT_BACKEND': 'cache',
+                     'RATE_LIMIT_BATCH': 1}
+
+    def test_backend(self):
+        backend = self.app.rate_limiter.backend
+        self.assertIsInstance(backend, SlidingWindow)
+        # counts in the cache server, runs on the green pool
+        self.assertTrue(self.app.rate_limiter.blocking)
+        self.client.get('/limited', REMOTE_ADDR='10.0.0.6')
+        self.client.get('/limited', REMOTE_ADDR='10.0.0.6')
+        request = self.client.get('/limited', REMOTE_ADDR='10.0.0.6')
+        self.assertEqual(request.response.status_code, 429)
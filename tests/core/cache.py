@@ -9,8 +9,77 @@ class TestWrappers(test.TestCase):
         from lux.core.cache import DummyStore
         self.assertIsInstance(cache, DummyStore)
         self.assertEqual(cache.ping(), True)
-        self.assertEqual(cache.hmget('bla'), None)
+        self.assertEqual(cache.hmget('bla', 'name'), [None])
         cache.hmset('foo', {'name': 'pippo'})
-        self.assertEqual(cache.hmget('foo'), None)
+        self.assertEqual(cache.hgetall('foo'), {})
+        self.assertEqual(cache.hdel('foo', 'name'), 0)
         cache.set('h', 56)
         self.assertEqual(cache.get('h'), None)
+
+    def test_memory_cache(self):
+        app = self.application(CACHE_SERVER='memory://')
+        cache = app.cache_server
+        from lux.core.cache import MemoryStore, MAX_ENTRIES
+        self.assertIsInstance(cache, MemoryStore)
+        self.assertEqual(cache.ping(), True)
+        self.assertEqual(cache.hgetall('bla'), {})
+        self.assertEqual(cache.hmget('bla', 'name'), [None])
+        self.assertRaises(TypeError, cache.hmget, 'bla')
+        cache.hmset('foo', {'name': 'pippo'})
+        cache.hmset('foo', {'age': 3})
+        self.assertEqual(cache.hgetall('foo'), {'name': 'pippo', 'age': 3})
+        self.assertEqual(cache.hmget('foo', 'age', 'x'), [3, None])
+        self.assertEqual(cache.hdel('foo', 'age', 'x'), 1)
+        self.assertEqual(cache.hgetall('foo'), {'name': 'pippo'})
+        self.assertEqual(cache.cache.max_entries, MAX_ENTRIES)
+        cache.set('h', 56)
+        self.assertEqual(cache.get('h'), 56)
+        self.assertEqual(cache.add('h', 57), False)
+        self.assertEqual(cache.delete('h', 'foo', 'bla'), 2)
+        self.assertEqual(cache.get('h'), None)
+
+    def test_memory_expiry(self):
+        from lux.core.cache import LRUCache
+        cache = LRUCache()
+        cache.set('a', 1, timeout=-1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats['expirations'], 1)
+        cache.set('b', 1, timeout=100)
+        self.assertTrue(0 < cache.ttl('b') <= 100)
+        self.assertEqual(cache.ttl('a'), -1)
+        cache.set('c', 1)
+        self.assertEqual(cache.ttl('c'), None)
+
+    def test_memory_eviction(self):
+        from lux.core.cache import create_store
+        cache = create_store('memory://?max_entries=2').client()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        stats = cache.stats
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_memory_purge(self):
+        from lux.core.cache import LRUCache
+        cache = LRUCache(purge_interval=60)
+        cache.set('a', 1, timeout=-1)
+        cache.set('b', 1, timeout=-1)
+        self.assertEqual(len(cache), 2)
+        # expired entries never accessed again are purged on writes,
+        # once the purge interval has elapsed
+        cache._next_purge = 0
+        cache.set('c', 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats['expirations'], 2)
+        cache = LRUCache(purge_interval=0)
+        cache.set('a', 1, timeout=-1)
+        cache.set('b', 1)
+        self.assertEqual(len(cache), 2)
+        cache.purge()
+        self.assertEqual(len(cache), 1)
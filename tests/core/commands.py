@@ -1,8 +1,15 @@
 import os
 import io
 import shutil
+import tempfile
 from os import path
 
+from pulsar import get_event_loop, asyncio
+
+import lux
+from lux.core.app import LazyConfig
+from lux.core.manifest import CommandManifest
+from lux.core.commands.generate_secret_key import generate_secret
 from lux.utils import test
 
 
@@ -26,9 +33,25 @@ class CommandTests(test.TestCase):
     def test_serve(self):
         command = self.fetch_command('serve')
         self.assertTrue(command.help)
-        self.assertEqual(len(command.option_list), 0)
+        self.assertEqual(len(command.option_list), 1)
         app = command(['-b', ':9000'], start=False)
         self.assertEqual(app, command.app)
+        self.assertEqual(app.callable._preloaded, None)
+
+    def test_serve_preload(self):
+        command = self.fetch_command('serve')
+        app = command(['-b', ':9000', '--preload'], start=False)
+        callable = app.callable
+        self.assertEqual(callable._preloaded, app)
+        self.assertEqual(callable.setup(), app)
+        self.assertFalse('_preloaded' in callable.__getstate__())
+        events = []
+        app.events['on_worker_start'].append(
+            lambda a, worker: events.append(worker))
+        cache_server = app.cache_server
+        app.on_worker_start('worker')
+        self.assertEqual(events, ['worker'])
+        self.assertNotEqual(app.cache_server, cache_server)
 
     def test_generate_key(self):
         command = self.fetch_command('generate_secret_key')
@@ -46,3 +69,82 @@ class CommandTests(test.TestCase):
         command([])
         data = command.app.stdout.getvalue()
         self.assertTrue(data)
+
+    def test_bench(self):
+        command = self.fetch_command('bench')
+        self.assertTrue(command.help)
+        report = command(['/', 'GET:/xxxx', '--requests', '20',
+                          '--warmup', '2', '--memory', '4'])
+        self.assertEqual(report['requests'], 20)
+        self.assertTrue(report['requests_per_second'] > 0)
+        self.assertEqual(set(report['latency']),
+                         set(('mean', 'p50', 'p95', 'p99', 'max')))
+        self.assertTrue(report['allocated_bytes_per_request'] > 0)
+        self.assertEqual(report['status']['404'], 10)
+        data = command.app.stdout.getvalue()
+        self.assertTrue('"requests_per_second"' in data)
+
+    def test_bench_async(self):
+        # asynchronous responses and chunks are awaited and consumed
+        command = self.fetch_command('bench')
+        request = command.app.wsgi_request()
+        loop = get_event_loop()
+        consumed = []
+
+        def result(value):
+            future = asyncio.Future(loop=loop)
+            loop.call_soon(future.set_result, value)
+            return future
+
+        def body():
+            for value in (b'a', b'b'):
+                yield result(value)
+                consumed.append(value)
+
+        command.app = lambda environ, start_response: result(body())
+        command.wait(command.respond(request))
+        self.assertEqual(consumed, [b'a', b'b'])
+
+    def test_command_manifest(self):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = path.join(dir, 'commands.json')
+            manifest = CommandManifest(['lux', 'tests'], filename)
+            commands = manifest.commands()
+            self.assertEqual(list(commands), ['lux'])
+            self.assertTrue('serve' in commands['lux'])
+            self.assertTrue(path.isfile(filename))
+            self.assertTrue(manifest.read())
+            manifest = CommandManifest(['lux'], filename)
+            self.assertEqual(manifest.read(), None)
+
+    def test_command_manifest_filename(self):
+        cache_home = os.environ.get('XDG_CACHE_HOME')
+        with tempfile.TemporaryDirectory() as dir:
+            os.environ['XDG_CACHE_HOME'] = dir
+            try:
+                filename = CommandManifest.default_filename('tests.config',
+                                                            ['lux'])
+            finally:
+                if cache_home is None:
+                    os.environ.pop('XDG_CACHE_HOME')
+                else:
+                    os.environ['XDG_CACHE_HOME'] = cache_home
+            self.assertEqual(path.dirname(filename), path.join(dir, 'lux'))
+            self.assertEqual(os.stat(path.dirname(filename)).st_mode & 0o77,
+                             0)
+
+    def test_lazy_extensions(self):
+        app = lux.App(self.config_file, argv=['--log-level', 'none'],
+                      SECRET_KEY=generate_secret()).commands()
+        self.assertIsInstance(app.config, LazyConfig)
+        self.assertTrue('generate_secret_key' in app.commands['lux'])
+        self.assertTrue(app.config.loader)
+        command = app.get_command('generate_secret_key')
+        self.assertEqual(len(command([])), 50)
+        self.assertTrue(app.config.loader)
+        # only attributes set by extensions load them
+        self.assertRaises(AttributeError, getattr, app, 'foo')
+        self.assertTrue(app.config.loader)
+        self.assertTrue(app.extensions['lux.extensions.base'])
+        self.assertEqual(app.config.loader, None)
+        self.assertTrue('lux.extensions.base' in app.startup_times)
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from pulsar.utils.httpurl import http_date
+
+import lux
+from lux import Validator, conditional
+from lux.utils import test
+
+
+class Resource(lux.Router):
+    calls = 0
+
+    def validator(self, request):
+        return Validator(etag='v1', last_modified=1000000)
+
+    @conditional()
+    def get(self, request):
+        self.calls += 1
+        request.response.content = b'resource'
+        return request.response
+
+
+class TestConditional(test.TestCase):
+
+    def test_validator(self):
+        state = Validator(etag='abc')
+        self.assertEqual(state.etag, '"abc"')
+        self.assertTrue(state.not_modified({'HTTP_IF_NONE_MATCH': '"abc"'}))
+        self.assertTrue(state.not_modified(
+            {'HTTP_IF_NONE_MATCH': '"foo", W/"abc"'}))
+        self.assertTrue(state.not_modified({'HTTP_IF_NONE_MATCH': '*'}))
+        self.assertFalse(state.not_modified({'HTTP_IF_NONE_MATCH': '"foo"'}))
+        self.assertFalse(state.not_modified({}))
+
+    def test_last_modified(self):
+        state = Validator(last_modified=datetime(2015, 1, 1))
+        self.assertEqual(state.last_modified, 1420070400)
+        self.assertTrue(state.not_modified(
+            {'HTTP_IF_MODIFIED_SINCE': http_date(1420070400)}))
+        self.assertFalse(state.not_modified(
+            {'HTTP_IF_MODIFIED_SINCE': http_date(1420070399)}))
+        # If-None-Match takes precedence
+        self.assertFalse(state.not_modified(
+            {'HTTP_IF_NONE_MATCH': '"foo"',
+             'HTTP_IF_MODIFIED_SINCE': http_date(1420070400)}))
+
+    def test_router(self):
+        app = self.application()
+        router = Resource('/resource')
+        request = app.wsgi_request(path='/resource')
+        response = router(request.environ, None)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertEqual(response['Last-Modified'], http_date(1000000))
+        self.assertEqual(router.calls, 1)
+        request = app.wsgi_request(path='/resource',
+                                   extra={'HTTP_IF_NONE_MATCH': '"v1"'})
+        response = router(request.environ, None)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertEqual(router.calls, 1)
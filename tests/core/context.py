@@ -0,0 +1,106 @@
+import unittest
+import tracemalloc
+
+from lux.core.engines import TemplateContext
+from lux.utils import test
+
+
+def dict_context(app, request, context=None):
+    '''How the context was built before :class:`.TemplateContext`
+    '''
+    context = context if context is not None else {}
+    context.update(request.app.config)
+    for ext in app.extensions.values():
+        if hasattr(ext, 'context'):
+            context = ext.context(request, context) or context
+    return context
+
+
+def html_request(app):
+    return app.wsgi_request(path='/', extra={'HTTP_ACCEPT': 'text/html'})
+
+
+def allocated(callable, *args):
+    tracemalloc.start()
+    try:
+        callable(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TestTemplateContext(test.TestCase):
+
+    def test_layers(self):
+        app = self.application()
+        request = html_request(app)
+        context = app.context(request, {'foo': 'bar'})
+        self.assertIsInstance(context, TemplateContext)
+        self.assertEqual(context['foo'], 'bar')
+        self.assertEqual(context['APP_NAME'], app.config['APP_NAME'])
+        context['APP_NAME'] = 'new name'
+        self.assertEqual(context['APP_NAME'], 'new name')
+        self.assertNotEqual(app.config['APP_NAME'], 'new name')
+
+    def test_precedence(self):
+        # the configuration overrides the initial context
+        app = self.application()
+        request = html_request(app)
+        initial = {'APP_NAME': 'foo', 'foo': 'bar'}
+        context = app.context(request, dict(initial))
+        expected = dict_context(app, request, dict(initial))
+        self.assertEqual(context['APP_NAME'], app.config['APP_NAME'])
+        self.assertEqual(context['APP_NAME'], expected['APP_NAME'])
+        self.assertEqual(context['foo'], 'bar')
+
+    def test_render(self):
+        app = self.application()
+        request = html_request(app)
+        context = app.context(request, {'status_code': 404})
+        text = app.render_template('error.html', context)
+        self.assertTrue('404' in text)
+        self.assertEqual(text, app.render_template(
+            'error.html', dict_context(app, request, {'status_code': 404})))
+
+    def test_memory(self):
+        app = self.application()
+        request = html_request(app)
+        layered = allocated(app.context, request)
+        copied = allocated(dict_context, app, request)
+        self.assertTrue(layered < copied)
+
+    def test_html_response(self):
+        app = self.application()
+        request = html_request(app)
+        response = app.html_response(request, 'home.html')
+        self.assertEqual(response.status_code, 200)
+
+
+class BenchTemplateContext(unittest.TestCase, test.TestMixin):
+    '''Latency of :meth:`.Application.html_response` with the layered
+    context against the dictionary copy of the config.
+
+    Run with ``python -m runtests core.context --benchmark``
+    '''
+    __benchmark__ = True
+    __number__ = 1000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = test.test_app(cls)
+        cls.context = cls.app.context
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.context = cls.context
+
+    def test_html_response_layered(self):
+        app = self.app
+        app.context = self.context
+        app.html_response(html_request(app), 'home.html')
+
+    def test_html_response_dict(self):
+        app = self.app
+        app.context = lambda request, context=None: dict_context(
+            app, request, context)
+        app.html_response(html_request(app), 'home.html')
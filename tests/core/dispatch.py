@@ -0,0 +1,107 @@
+import unittest
+
+from pulsar.apps.wsgi import WsgiHandler, test_wsgi_environ
+
+import lux
+from lux.core.dispatch import RouterIndex, index_middleware, static_prefix
+from lux.utils import test
+
+
+def get(request):
+    return request.response
+
+
+def routers(size):
+    return [lux.Router('route%d/<id>' % n, get=get) for n in range(size)]
+
+
+def middleware(environ, start_response):
+    pass
+
+
+class TestRouterIndex(test.TestCase):
+
+    def test_static_prefix(self):
+        self.assertEqual(static_prefix(lux.Router('foo/bar/<id>')),
+                         ('foo', 'bar'))
+        self.assertEqual(static_prefix(lux.Router('<id>')), ())
+        self.assertEqual(static_prefix(lux.Router('/')), ())
+
+    def test_candidates(self):
+        index = RouterIndex([lux.Router('foo/<id>'),
+                             lux.Router('<name>'),
+                             lux.Router('foo/bar'),
+                             lux.Router('bla')])
+        self.assertEqual(list(index.candidates('foo/bar')), [0, 1, 2])
+        self.assertEqual(list(index.candidates('bla')), [1, 3])
+        self.assertEqual(list(index.candidates('xyz')), [1])
+
+    def test_index_middleware(self):
+        chain = index_middleware([middleware] + routers(3) +
+                                 [middleware] + routers(1))
+        self.assertEqual(len(chain), 4)
+        self.assertEqual(chain[0], middleware)
+        self.assertIsInstance(chain[1], RouterIndex)
+        self.assertEqual(len(chain[1].routers), 3)
+        self.assertEqual(chain[2], middleware)
+        self.assertIsInstance(chain[3], lux.Router)
+
+    def test_dispatch(self):
+        index = RouterIndex(routers(10))
+        app = self.application()
+        request = app.wsgi_request(path='/route7/4')
+        response = index(request.environ, None)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request.environ['pulsar.cache'].urlargs,
+                         {'id': '4'})
+        request = app.wsgi_request(path='/route70/4')
+        self.assertEqual(index(request.environ, None), None)
+
+    def test_config(self):
+        app = self.application(INDEX_ROUTERS=True)
+        self.assertTrue(app.config['INDEX_ROUTERS'])
+        request = self.request(app, path='/static/lux/see.jpg')
+        self.assertEqual(request.response.status_code, 404)
+
+
+class BenchRouterIndex(unittest.TestCase):
+    '''Compare the cost of dispatching a request to the last route of a
+    list of routers against the :class:`.RouterIndex`.
+
+    Run with ``python -m runtests core.dispatch --benchmark``
+    '''
+    __benchmark__ = True
+    __number__ = 1000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.handlers = {}
+        for size in (10, 100, 1000):
+            chain = routers(size)
+            cls.handlers[size] = (WsgiHandler(chain),
+                                  WsgiHandler(index_middleware(chain)),
+                                  '/route%d/1' % (size - 1))
+
+    def dispatch(self, size, indexed):
+        handler = self.handlers[size][1 if indexed else 0]
+        environ = test_wsgi_environ(path=self.handlers[size][2])
+        response = handler(environ, None)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_10(self):
+        self.dispatch(10, False)
+
+    def test_index_10(self):
+        self.dispatch(10, True)
+
+    def test_list_100(self):
+        self.dispatch(100, False)
+
+    def test_index_100(self):
+        self.dispatch(100, True)
+
+    def test_list_1000(self):
+        self.dispatch(1000, False)
+
+    def test_index_1000(self):
+        self.dispatch(1000, True)
@@ -0,0 +1,121 @@
+import threading
+
+from pulsar.apps.wsgi import WsgiHandler, wait_for_body_middleware
+
+import lux
+from lux.extensions.base.cache import ResponseCache, sleep
+from lux.core.green import GreenDispatch, GreenMiddleware, GreenResponse
+from lux.core.metrics import Metrics
+from lux.utils import test
+
+
+class Articles(lux.Router):
+
+    def get(self, request):
+        return request.response
+
+    @lux.blocking
+    def post(self, request):
+        return request.response
+
+
+class Users(lux.Router):
+    blocking = True
+
+    def get(self, request):
+        return request.response
+
+
+class Middleware:
+    blocking = True
+
+    def __call__(self, environ, start_response):
+        pass
+
+
+def middleware(environ, start_response):
+    pass
+
+
+class TestGreenDispatch(test.TestCase):
+
+    def test_router_methods(self):
+        dispatch = GreenDispatch(self.application())
+        router = Articles('articles')
+        self.assertEqual(dispatch.instrument_router(router), 1)
+        self.assertIsInstance(router.response, GreenResponse)
+        self.assertEqual(router.response.methods, frozenset(('POST',)))
+
+    def test_blocking_router(self):
+        dispatch = GreenDispatch(self.application())
+        router = Users('users', lux.Router('<id>'))
+        self.assertEqual(dispatch.instrument_router(router), 2)
+        self.assertEqual(router.response.methods, None)
+        self.assertIsInstance(router.routes[0].response, GreenResponse)
+        router = lux.Router('home', get=lambda r: r.response)
+        self.assertEqual(dispatch.instrument_router(router), 0)
+        self.assertNotIsInstance(router.response, GreenResponse)
+
+    def test_middleware(self):
+        dispatch = GreenDispatch(self.application())
+        handler = WsgiHandler([middleware, Middleware(), Articles('a')])
+        self.assertEqual(dispatch.instrument(handler), 2)
+        self.assertEqual(handler.middleware[0], middleware)
+        self.assertIsInstance(handler.middleware[1], GreenMiddleware)
+
+    def test_selective(self):
+        app = self.application(GREEN_POOL=10, GREEN_POOL_SELECTIVE=True)
+        self.assertIsInstance(app.green_dispatch, GreenDispatch)
+        self.assertEqual(app.handler.middleware[0], wait_for_body_middleware)
+        app = self.application(GREEN_POOL=10)
+        self.assertEqual(app.green_dispatch, None)
+
+    def test_metrics(self):
+        app = self.application(METRICS_URL='/metrics', GREEN_POOL=10,
+                               GREEN_POOL_SELECTIVE=True)
+        self.assertIsInstance(app.metrics, Metrics)
+        text = app.metrics.prometheus()
+        self.assertTrue('# TYPE lux_green_pool_queued gauge' in text)
+        self.assertTrue('lux_green_pool_active 0' in text)
+        self.assertTrue('lux_green_pool_wait_seconds_count 0' in text)
+
+
+class TestSelectiveResponseCache(test.TestCase):
+    config_file = 'tests.base'
+
+    def test_response_cache(self):
+        app = self.application(GREEN_POOL=10, GREEN_POOL_SELECTIVE=True)
+        middleware = [wsgi for wsgi in app.handler.middleware
+                      if isinstance(wsgi, GreenMiddleware)]
+        caches = [wsgi for wsgi in middleware
+                  if isinstance(wsgi.wsgi, ResponseCache)]
+        self.assertEqual(len(caches), 1)
+        cache = app.extensions['lux.extensions.base'].response_cache
+        self.assertEqual(caches[0].wsgi, cache)
+        self.assertEqual(caches[0].blocks, cache.blocks)
+        request = app.wsgi_request(path='/counter')
+        self.assertTrue(cache.blocks(request.environ))
+        request = app.wsgi_request(path='/nocache')
+        self.assertFalse(cache.blocks(request.environ))
+
+    def test_media_on_loop(self):
+        app = self.application(GREEN_POOL=10, GREEN_POOL_SELECTIVE=True,
+                               SERVE_STATIC_FILES=True)
+        submitted = []
+        app.green_dispatch.submit = lambda wsgi, environ, arg: (
+            submitted.append(environ['PATH_INFO']))
+        for path in ('/media/lux/lux.js', '/nocache', '/counter'):
+            environ = app.wsgi_request(path=path).environ
+            for wsgi in app.handler.middleware:
+                if isinstance(wsgi, GreenMiddleware):
+                    wsgi(environ, None)
+        self.assertEqual(submitted, ['/counter'])
+
+    def test_sleep(self):
+        # the single-flight wait is not possible on the event loop thread
+        self.assertFalse(sleep(0))
+        result = []
+        thread = threading.Thread(target=lambda: result.append(sleep(0)))
+        thread.start()
+        thread.join()
+        self.assertEqual(result, [True])
@@ -0,0 +1,123 @@
+import unittest
+from copy import deepcopy
+
+import pulsar
+
+from lux import static_html
+from lux.core.extension import EventMixin
+from lux.core.html import check_pulsar, PULSAR_VERSIONS
+from lux.utils import test
+
+
+CONFIG = {'HTML_TITLE': 'Skeleton',
+          'FAVICON': 'lux/favicon.ico',
+          'HTML_META': [{'name': 'description', 'content': 'static'}],
+          'HTML_LINKS': ['lux/site']}
+
+
+def deepcopy_document(app, request):
+    '''How the document was built before :class:`.StaticDocument`
+    '''
+    doc = deepcopy(app.html_skeleton)
+    app.fire('on_html_document', request, doc)
+    links = doc.head.links
+    for link in app.config['HTML_LINKS']:
+        if isinstance(link, dict):
+            links.append(**link)
+        else:
+            links.append(link)
+    return doc
+
+
+class StaticExtension:
+
+    @static_html
+    def on_html_document(self, app, request, doc):
+        doc.jscontext['static'] = request is None
+
+
+class TestHtmlDocument(test.TestCase):
+    config_params = CONFIG
+
+    def test_skeleton(self):
+        app = self.application()
+        skeleton = app.html_skeleton
+        self.assertEqual(skeleton.head.title, 'Skeleton')
+        # favicon is a static contribution of the base extension
+        self.assertTrue(skeleton.head.links.children)
+        self.assertEqual(app.html_skeleton, skeleton)
+        self.assertEqual(app.static_document, app.static_document)
+
+    def test_document_per_request(self):
+        app = self.application()
+        request1, _ = self.request_start_response(app)
+        request2, _ = self.request_start_response(app)
+        doc1 = request1.html_document
+        doc2 = request2.html_document
+        self.assertNotEqual(doc1, doc2)
+        self.assertNotEqual(doc1, app.html_skeleton)
+        doc1.jscontext['foo'] = 'bar'
+        doc1.head.add_meta(name='robots', content='noindex')
+        doc1.head.replace_meta('description', 'changed')
+        self.assertFalse('foo' in doc2.jscontext)
+        self.assertFalse('foo' in app.html_skeleton.jscontext)
+        self.assertEqual(len(doc1.head.meta.children),
+                         len(doc2.head.meta.children) + 1)
+        self.assertEqual(doc1.head.get_meta('description'), 'changed')
+        self.assertEqual(doc2.head.get_meta('description'), 'static')
+        self.assertEqual(app.html_skeleton.head.get_meta('description'),
+                         'static')
+        self.assertEqual(len(doc1.head.links.children),
+                         len(doc2.head.links.children))
+
+    def test_render(self):
+        app = self.application()
+        request, _ = self.request_start_response(app)
+        expected = deepcopy_document(app, request).render(request)
+        self.assertTrue('content="static"' in expected)
+        for _ in range(2):
+            request, _ = self.request_start_response(app)
+            doc = app.html_document(request)
+            self.assertEqual(doc.render(request), expected)
+
+    def test_pulsar_internals(self):
+        # documents share internals of pulsar Html elements, a new pulsar
+        # version must be checked before it is added to PULSAR_VERSIONS
+        self.assertTrue(tuple(pulsar.VERSION[:2]) in PULSAR_VERSIONS)
+        check_pulsar()
+
+    def test_static_html(self):
+        events = EventMixin()
+        events.bind_events(StaticExtension())
+        self.assertEqual(events.events['on_html_document'], [])
+        handlers = events.events['on_html_skeleton']
+        self.assertEqual(len(handlers), 1)
+        doc = self.application().html_skeleton
+        handlers[0](events, doc)
+        self.assertEqual(doc.jscontext['static'], True)
+
+
+class BenchHtmlDocument(unittest.TestCase, test.TestMixin):
+    '''Latency of :meth:`.Application.html_document` built from the
+    pre-rendered :class:`.StaticDocument` against a deep copy of the
+    skeleton, both rendered.
+
+    Run with ``python -m runtests core.html --benchmark``
+    '''
+    __benchmark__ = True
+    __number__ = 1000
+    config_params = CONFIG
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = test.test_app(cls)
+
+    def test_html_document_static(self):
+        app = self.app
+        request = app.wsgi_request()
+        app.html_document(request).render(request)
+
+    def test_html_document_deepcopy(self):
+        app = self.app
+        request = app.wsgi_request()
+        deepcopy_document(app, request).render(request)
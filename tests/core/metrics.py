@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+from lux.core.metrics import Metrics, Histogram, BUCKETS
+from lux.utils import test
+
+
+class TestMetrics(test.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram('foo')
+        histogram.observe(0.001)
+        histogram.observe(0.002)
+        histogram.observe(100)
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(histogram.counts[BUCKETS.index(0.001)], 1)
+        self.assertEqual(histogram.counts[BUCKETS.index(0.0025)], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+
+    def test_no_metrics(self):
+        app = self.application()
+        self.assertEqual(app.metrics, None)
+
+    def test_endpoint(self):
+        app = self.application(METRICS_URL='/metrics')
+        metrics = app.metrics
+        self.assertIsInstance(metrics, Metrics)
+        self.request(app, path='/')
+        self.assertEqual(metrics.request.count, 1)
+        request = self.request(app, path='/metrics')
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.content[0].decode('utf-8')
+        self.assertTrue('lux_request_duration_seconds_count 1' in text)
+        self.assertTrue('lux_event_duration_seconds_bucket' in text)
+        self.assertTrue('lux_router_duration_seconds_bucket' in text)
+
+    def test_runtime_switch(self):
+        app = self.application(METRICS_URL='/metrics',
+                               METRICS_ENABLED=False)
+        self.request(app, path='/')
+        self.assertEqual(app.metrics.request.count, 0)
+        app.metrics.enabled = True
+        self.request(app, path='/')
+        self.assertEqual(app.metrics.request.count, 1)
+
+    def test_aggregate(self):
+        with tempfile.TemporaryDirectory() as dir:
+            metrics = Metrics(directory=dir)
+            metrics.request.observe(0.01)
+            metrics.dump(force=True)
+            filename = os.path.join(dir, '%d.json' % os.getpid())
+            self.assertTrue(os.path.isfile(filename))
+            os.rename(filename, os.path.join(dir, '1.json'))
+            metrics.request.observe(0.01)
+            workers, data = metrics.aggregate()
+            self.assertEqual(workers, 2)
+            counts, total = data[(metrics.request.name, ())]
+            self.assertEqual(sum(counts), 3)
+            metrics.clear_snapshots()
+            self.assertEqual(os.listdir(dir), [])
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+from lux.core.engines import TemplateRegistry
+from lux.utils import test
+
+
+class TestTemplateRegistry(test.TestCase):
+
+    def test_app_registry(self):
+        app = self.application()
+        templates = app.templates
+        self.assertIsInstance(templates, TemplateRegistry)
+        self.assertTrue('error.html' in templates.index)
+        self.assertEqual(app.template_full_path('error.html'),
+                         templates.index['error.html'])
+
+    def test_render_template(self):
+        app = self.application()
+        templates = app.templates
+        text = app.render_template('error.html', {'status_code': 404,
+                                                  'status_message': 'bla'})
+        self.assertTrue('404' in text)
+        misses = templates.misses
+        hits = templates.hits
+        text2 = app.render_template('error.html', {'status_code': 404,
+                                                   'status_message': 'bla'})
+        self.assertEqual(text, text2)
+        self.assertEqual(templates.misses, misses)
+        self.assertEqual(templates.hits, hits + 1)
+
+    def test_not_found(self):
+        app = self.application()
+        self.assertEqual(app.template('xxxxx.html'), '')
+        self.assertEqual(app.render_template('xxxxx.html'), '')
+        self.assertTrue(app.templates.misses)
+
+    def test_debug_mtime(self):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'foo.html')
+            with open(filename, 'w') as f:
+                f.write('Hello $name')
+            templates = TemplateRegistry([dir], debug=True)
+            self.assertEqual(templates.compiled('foo.html')({'name': 'luca'}),
+                             'Hello luca')
+            with open(filename, 'w') as f:
+                f.write('Ciao $name')
+            os.utime(filename, (0, 0))
+            self.assertEqual(templates.compiled('foo.html')({'name': 'luca'}),
+                             'Ciao luca')
+            self.assertEqual(templates.misses, 2)
+            self.assertEqual(templates.hits, 0)
+            # new files are found in debug mode
+            with open(os.path.join(dir, 'bla.html'), 'w') as f:
+                f.write('bla')
+            self.assertEqual(templates.text('bla.html'), 'bla')
+
+    def test_production_no_disk(self):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'foo.html')
+            with open(filename, 'w') as f:
+                f.write('Hello $name')
+            templates = TemplateRegistry([dir])
+            self.assertEqual(templates.text('foo.html'), 'Hello $name')
+            os.remove(filename)
+            self.assertEqual(templates.text('foo.html'), 'Hello $name')
+            self.assertEqual(templates.stats['hits'], 1)
@@ -48,3 +48,21 @@ class Task(odm.Model):
     done = Column(Boolean, default=False)
     created = Column(DateTime, default=datetime.utcnow)
     assigned = Column(Integer, ForeignKey('person.id'))
+
+
+PEOPLE = ('luca', 'anna', 'mario', 'bruno', 'carla')
+
+
+class PeopleMixin:
+    '''Add the :data:`PEOPLE` to the database once per test class
+    '''
+    populated = False
+
+    def populate(self):
+        cls = self.__class__
+        if not cls.populated:
+            cls.populated = True
+            odm = self.app.odm()
+            with odm.begin() as session:
+                for name in PEOPLE:
+                    session.add(odm.person(name=name))
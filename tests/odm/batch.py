@@ -0,0 +1,82 @@
+import json
+
+from lux.utils import test
+
+
+class TestBatch(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'API_BATCH_LIMIT': 5}
+
+    def batch(self, body, status=200):
+        request = self.client.post('/batch',
+                                   body=json.dumps(body).encode('utf-8'),
+                                   content_type='application/json')
+        response = request.response
+        self.assertEqual(response.status_code, status)
+        return self.json(response)
+
+    def test_apis(self):
+        request = self.client.get('/')
+        data = self.json(request.response)
+        self.assertTrue('people_url' in data)
+        self.assertFalse('batch' in json.dumps(data))
+
+    def test_batch(self):
+        data = self.batch([{'path': 'people',
+                            'method': 'post',
+                            'body': {'name': 'luca'}},
+                           {'path': '/people?sortby=id:desc&limit=1'},
+                           {'path': 'tasks/metadata'}])
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0]['status'], 201)
+        person = data[0]['body']
+        self.assertEqual(person['name'], 'luca')
+        self.assertEqual(data[1]['status'], 200)
+        self.assertEqual(data[1]['body']['result'], [person])
+        self.assertEqual(data[2]['status'], 200)
+        self.assertTrue(data[2]['body']['columns'])
+
+    def test_envelope(self):
+        data = self.batch({'requests': [{'path': 'people'}]})
+        self.assertEqual(data[0]['status'], 200)
+        self.assertTrue('application/json' in
+                        data[0]['headers']['Content-Type'])
+
+    def test_errors(self):
+        data = self.batch([{'path': 'foo'},
+                           {'path': 'people/99999'},
+                           {'path': 'batch', 'method': 'post',
+                            'body': []},
+                           {'path': 'people?fields=foo'}])
+        status = [result['status'] for result in data]
+        self.assertEqual(status, [404, 404, 400, 400])
+        self.assertEqual(data[3]['body']['status'], 400)
+
+    def test_invalid(self):
+        self.batch({'path': 'people'}, 400)
+        self.batch([{'method': 'get'}], 400)
+        self.batch([{'path': 'people'}]*6, 400)
+
+
+class TestBatchRateLimit(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'RATE_LIMIT': '3/60'}
+
+    def test_rate_limit(self):
+        body = [{'path': 'people'}, {'path': 'tasks'}, {'path': 'people'}]
+        request = self.client.post('/batch',
+                                   body=json.dumps(body).encode('utf-8'),
+                                   content_type='application/json')
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        # the batch request and each sub-request are counted
+        data = self.json(response)
+        status = [result['status'] for result in data]
+        self.assertEqual(status, [200, 200, 429])
+        self.assertTrue(data[2]['headers']['Retry-After'])
+        request = self.client.post('/batch',
+                                   body=json.dumps(body).encode('utf-8'),
+                                   content_type='application/json')
+        self.assertEqual(request.response.status_code, 429)
@@ -0,0 +1,66 @@
+import json
+
+from lux.utils import test
+
+
+class TestBulk(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'API_BULK_CHUNK': 2}
+
+    def bulk(self, path, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body)
+        request = self.client.post(path, body=body.encode('utf-8'),
+                                   content_type=content_type)
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        return self.json(response)
+
+    def people(self):
+        request = self.client.get('/people?sortby=id')
+        return self.json(request.response)['result']
+
+    def test_create(self):
+        data = self.bulk('/people/bulk', [{'name': 'luca'}, {'name': ''},
+                                          {'name': 'anna'}, {'name': 'bea'}])
+        self.assertEqual(data['success'], 3)
+        self.assertEqual(data['failed'], 1)
+        status = [item['status'] for item in data['result']]
+        self.assertEqual(status, [201, 422, 201, 201])
+        names = [p['name'] for p in self.people()]
+        self.assertTrue('anna' in names)
+        self.assertTrue('bea' in names)
+
+    def test_create_ndjson(self):
+        body = '{"name": "mario"}\n\n{"name": "carla"}\n'
+        data = self.bulk('/people/bulk', body, 'application/x-ndjson')
+        self.assertEqual(data['success'], 2)
+
+    def test_create_envelope(self):
+        data = self.bulk('/people/bulk', {'items': [{'name': 'bruno'}]})
+        self.assertEqual(data['result'], [{'status': 201}])
+
+    def test_update_delete(self):
+        self.bulk('/people/bulk', [{'name': 'x1'}, {'name': 'x2'}])
+        people = [p for p in self.people() if p['name'] in ('x1', 'x2')]
+        ids = [p['id'] for p in people]
+        data = self.bulk('/people/bulk/update',
+                         [{'id': ids[0], 'name': 'y1'}, {'name': 'y2'},
+                          {'id': 99999, 'name': 'y3'}])
+        status = [item['status'] for item in data['result']]
+        self.assertEqual(status, [200, 400, 404])
+        names = dict(((p['id'], p['name']) for p in self.people()))
+        self.assertEqual(names[ids[0]], 'y1')
+        data = self.bulk('/people/bulk/delete', [ids[0], {'id': ids[1]},
+                                                 99999])
+        status = [item['status'] for item in data['result']]
+        self.assertEqual(status, [204, 204, 404])
+        remaining = [p['id'] for p in self.people()]
+        self.assertFalse(ids[0] in remaining)
+        self.assertFalse(ids[1] in remaining)
+
+    def test_invalid_body(self):
+        request = self.client.post('/people/bulk', body=b'{"name": "foo"}',
+                                   content_type='application/json')
+        self.assertEqual(request.response.status_code, 400)
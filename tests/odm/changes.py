@@ -0,0 +1,112 @@
+import json
+
+from lux.extensions.odm import ModelChange
+from lux.utils import test
+
+
+class TestModelChanges(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'TOTAL_COUNT': 'lux.extensions.odm.CachedCount'}
+
+    def setUp(self):
+        self.batches = []
+        self.app.events['on_model_changes'].append(self.record)
+
+    def tearDown(self):
+        self.app.events['on_model_changes'].remove(self.record)
+
+    def record(self, app, changes, remote):
+        self.batches.append((changes, remote))
+
+    def test_commit(self):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            luca = odm.person(name='luca')
+            anna = odm.person(name='anna')
+            session.add(luca)
+            session.add(anna)
+            session.flush()
+            # an update of a new row is an insert
+            anna.name = 'anna maria'
+        self.assertEqual(len(self.batches), 1)
+        changes, remote = self.batches[0]
+        self.assertFalse(remote)
+        self.assertEqual(len(changes), 2)
+        for change in changes:
+            self.assertEqual(change.table, 'person')
+            self.assertEqual(change.operation, 'insert')
+        self.assertEqual(set((c.pk for c in changes)),
+                         set((luca.id, anna.id)))
+        with odm.begin() as session:
+            person = session.query(odm.person).get(luca.id)
+            person.name = 'luca sbardella'
+            session.delete(session.query(odm.person).get(anna.id))
+        changes, _ = self.batches[1]
+        changes = dict(((c.operation, c) for c in changes))
+        self.assertEqual(changes['update'].pk, luca.id)
+        self.assertEqual(changes['update'].columns, ('name',))
+        self.assertEqual(changes['delete'].pk, anna.id)
+
+    def test_no_changes(self):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            session.add(odm.person(name='mario'))
+        with odm.begin() as session:
+            person = session.query(odm.person).first()
+            person.name = person.name
+        self.assertEqual(len(self.batches), 1)
+
+    def test_rollback(self):
+        odm = self.app.odm()
+        session = odm.session()
+        session.add(odm.person(name='bruno'))
+        session.flush()
+        session.rollback()
+        self.assertEqual(self.batches, [])
+
+    def test_savepoint_rollback(self):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            luca = odm.person(name='luca')
+            session.add(luca)
+            session.begin_nested()
+            session.add(odm.person(name='anna'))
+            session.flush()
+            session.rollback()
+        self.assertEqual(len(self.batches), 1)
+        changes, _ = self.batches[0]
+        self.assertEqual(changes, [ModelChange('person', luca.id,
+                                               'insert', ())])
+
+    def test_total_count(self):
+        odm = self.app.odm()
+        strategy = self.app.total_count
+        with odm.begin() as session:
+            total, _ = strategy(session.query(odm.person))
+        self.app.model_changes.publish(
+            [ModelChange('person', 1, 'update', ('name',))])
+        with odm.begin() as session:
+            self.assertEqual(strategy(session.query(odm.person)),
+                             (total, True))
+        self.assertEqual(strategy.cache.hits, 1)
+        with odm.begin() as session:
+            session.add(odm.person(name='carla'))
+        with odm.begin() as session:
+            self.assertEqual(strategy(session.query(odm.person)),
+                             (total + 1, True))
+
+    def test_remote(self):
+        feed = self.app.model_changes
+        message = json.dumps({'origin': feed.origin,
+                              'changes': [['task', 1, 'delete', []]]})
+        feed('channel', message)
+        self.assertEqual(self.batches, [])
+        message = json.dumps({'origin': 'other',
+                              'changes': [['task', 1, 'delete', []]]})
+        feed('channel', message.encode('utf-8'))
+        changes, remote = self.batches[0]
+        self.assertTrue(remote)
+        self.assertEqual(changes, [ModelChange('task', 1, 'delete', ())])
+        feed('channel', 'not json')
+        self.assertEqual(len(self.batches), 1)
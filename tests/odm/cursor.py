@@ -0,0 +1,61 @@
+from urllib.parse import urlparse, parse_qs
+
+from lux.extensions.odm.views import keyset_predicate
+from lux.utils import test
+
+from tests.odm import PeopleMixin
+
+
+class TestCursorPagination(PeopleMixin, test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'PAGINATION': 'lux.extensions.rest.CursorPagination'}
+
+    def page(self, path):
+        self.populate()
+        request = self.client.get(path)
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        return self.json(response)
+
+    def cursor(self, link):
+        return parse_qs(urlparse(link).query)['cursor'][0]
+
+    def test_pages(self):
+        data = self.page('/people?limit=2')
+        self.assertFalse('total' in data)
+        self.assertFalse('first' in data)
+        ids = [p['id'] for p in data['result']]
+        self.assertEqual(len(ids), 2)
+        cursor = self.cursor(data['next'])
+        data = self.page('/people?limit=2&cursor=%s' % cursor)
+        self.assertTrue(data['first'])
+        ids.extend((p['id'] for p in data['result']))
+        data = self.page('/people?limit=2&cursor=%s' %
+                         self.cursor(data['next']))
+        ids.extend((p['id'] for p in data['result']))
+        self.assertFalse('next' in data)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_sortby(self):
+        data = self.page('/people?limit=3&sortby=name:desc')
+        names = [p['name'] for p in data['result']]
+        data = self.page('/people?limit=3&sortby=name:desc&cursor=%s' %
+                         self.cursor(data['next']))
+        names.extend((p['name'] for p in data['result']))
+        self.assertEqual(names, ['mario', 'luca', 'carla', 'bruno', 'anna'])
+
+    def test_invalid_cursor(self):
+        request = self.client.get('/people?cursor=xyz')
+        self.assertEqual(request.response.status_code, 400)
+
+    def test_row_values(self):
+        from tests.odm import Person
+        table = Person.__table__
+        keys = [(table.c.name, 'asc'), (table.c.id, 'asc')]
+        predicate = keyset_predicate(keys, ['foo', 3], 'postgresql')
+        self.assertTrue(str(predicate).startswith(
+            '(person.name, person.id) > '))
+        predicate = keyset_predicate(keys, ['foo', 3], 'sqlite')
+        self.assertTrue(' OR ' in str(predicate))
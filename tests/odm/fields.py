@@ -0,0 +1,69 @@
+from lux.extensions.odm.models import serialiser
+from lux.utils import test
+
+from tests.odm import Task
+
+
+class TestFields(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://'}
+
+    def _create_task(self, subject):
+        request = self.client.post('/tasks', body={'subject': subject},
+                                   content_type='application/json')
+        self.assertEqual(request.response.status_code, 201)
+        return self.json(request.response)
+
+    def test_projection(self):
+        task = Task(id=1, subject='hello', done=True)
+        s = serialiser(Task)
+        self.assertEqual(s(task, fields=('subject',)), {'subject': 'hello'})
+        self.assertEqual(s(task, fields=('id', 'done')),
+                         {'id': 1, 'done': True})
+        self.assertEqual(s(task, fields=()), {})
+        values, names = s.projection(fields=('subject',))
+        self.assertEqual(s.projection(fields=('subject',))[0], values)
+        projection = s.projection(fields=('done', 'id'))
+        self.assertIs(s.projection(fields=('id', 'done')), projection)
+        self.assertIs(s.projection(fields=('id', 'done', 'id')), projection)
+
+    def test_collection_fields(self):
+        self._create_task('first')
+        request = self.client.get('/tasks?fields=subject,done')
+        data = self.json(request.response)
+        self.assertTrue(data['result'])
+        for task in data['result']:
+            self.assertEqual(set(task), set(('subject', 'done')))
+
+    def test_read_fields(self):
+        task = self._create_task('second')
+        request = self.client.get('/tasks/%s?fields=subject' % task['id'])
+        data = self.json(request.response)
+        self.assertEqual(data, {'subject': 'second'})
+
+    def test_fields_cache(self):
+        from tests.odm import CRUDTask
+        router = CRUDTask('tasks')
+        request = self.app.wsgi_request(path='/tasks?fields=subject,done')
+        fields = router.fields(request, True)
+        self.assertEqual(fields, ['subject', 'done'])
+        self.assertIs(router.fields(request, True), fields)
+        self.assertEqual(request.cache.rest_fields,
+                         {(router.model, True): fields})
+
+    def test_invalid_fields(self):
+        request = self.client.get('/tasks?fields=subject,foo')
+        self.assertEqual(request.response.status_code, 400)
+
+    def test_default_fields(self):
+        from tests.odm import CRUDTask
+        self._create_task('third')
+        model = CRUDTask.model
+        model.list_fields = ['id']
+        try:
+            request = self.client.get('/tasks')
+            data = self.json(request.response)
+            for task in data['result']:
+                self.assertEqual(list(task), ['id'])
+        finally:
+            model.list_fields = None
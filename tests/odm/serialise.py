@@ -0,0 +1,89 @@
+import json
+import unittest
+from datetime import date, datetime
+
+import pytz
+
+from sqlalchemy_utils.functions import get_columns
+
+from lux.extensions.odm.models import serialiser, Serialiser
+from lux.utils import test
+
+from tests.odm import Task
+
+
+ROWS = 10000
+
+
+def get_columns_tojson(obj):
+    '''The serialisation of RestModel.tojson before compiled serialisers
+    '''
+    fields = {}
+    for field in get_columns(obj):
+        try:
+            data = obj.__getattribute__(field.name)
+            if isinstance(data, date):
+                if isinstance(data, datetime) and not data.tzinfo:
+                    data = pytz.utc.localize(data)
+                data = data.isoformat()
+            else:
+                json.dumps(data)
+        except TypeError:
+            continue
+        if data is not None:
+            fields[field.name] = data
+    return fields
+
+
+def tasks(number):
+    created = datetime(2016, 1, 1, 12)
+    return [Task(id=n, subject='Task %d' % n, done=bool(n % 2),
+                 created=created, assigned=n % 10 or None)
+            for n in range(number)]
+
+
+class TestSerialiser(test.TestCase):
+
+    def test_serialiser(self):
+        s = serialiser(Task)
+        self.assertIsInstance(s, Serialiser)
+        self.assertEqual(serialiser(Task), s)
+        self.assertEqual(str(s), 'Serialiser(Task)')
+
+    def test_tojson(self):
+        for task in tasks(20):
+            data = serialiser(Task)(task)
+            self.assertEqual(data, get_columns_tojson(task))
+        self.assertEqual(data['created'], '2016-01-01T12:00:00+00:00')
+        self.assertFalse('assigned' in serialiser(Task)(tasks(1)[0]))
+
+    def test_many(self):
+        objs = tasks(20)
+        self.assertEqual(serialiser(Task).many(objs),
+                         [get_columns_tojson(o) for o in objs])
+
+    def test_exclude(self):
+        data = serialiser(Task).many(tasks(2), exclude=('created',))
+        self.assertEqual(data[1], {'id': 1, 'subject': 'Task 1',
+                                   'done': True, 'assigned': 1})
+
+
+class TestSerialiserBenchmark(unittest.TestCase):
+    '''Run with the ``--benchmark`` option
+    '''
+    __benchmark__ = True
+    __number__ = 1
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tasks = tasks(ROWS)
+
+    def test_get_columns(self):
+        [get_columns_tojson(o) for o in self.tasks]
+
+    def test_serialiser(self):
+        s = serialiser(Task)
+        [s(o) for o in self.tasks]
+
+    def test_serialiser_many(self):
+        serialiser(Task).many(self.tasks)
@@ -0,0 +1,97 @@
+import json
+from unittest import mock
+
+from lux.utils import test
+
+from tests.odm import PeopleMixin
+
+
+class TestStream(PeopleMixin, test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'API_STREAM_BATCH': 2}
+
+    def stream(self, path, **extra):
+        self.populate()
+        request = self.client.get(path, **extra)
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        return response, b''.join(response).decode('utf-8')
+
+    def test_json(self):
+        response, body = self.stream('/people?stream=1&sortby=name')
+        data = json.loads(body)
+        self.assertEqual([p['name'] for p in data['result']],
+                         ['anna', 'bruno', 'carla', 'luca', 'mario'])
+        self.assertEqual(data['total'], 5)
+        self.assertTrue(data['total_exact'])
+        self.assertEqual(response['X-Total-Count'], '5')
+
+    def test_json_limit(self):
+        response, body = self.stream('/people?stream=1&limit=3')
+        data = json.loads(body)
+        self.assertEqual(len(data['result']), 3)
+        self.assertTrue(data['next'])
+
+    def test_ndjson(self):
+        response, body = self.stream('/people?sortby=name:desc',
+                                     HTTP_ACCEPT='application/x-ndjson')
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['name'], 'mario')
+        self.assertEqual(response['X-Total-Exact'], 'true')
+
+    def test_green_pool(self):
+        # on the event loop each batch is fetched on the green pool
+        submitted = []
+
+        class Pool:
+
+            def submit(self, chunk):
+                submitted.append(chunk)
+                return chunk()
+
+        self.app.__dict__['_lazy_green_pool'] = Pool()
+        try:
+            with mock.patch('lux.extensions.odm.views.on_event_loop',
+                            return_value=True):
+                _, body = self.stream('/people?stream=1&sortby=name')
+        finally:
+            self.app.__dict__.pop('_lazy_green_pool')
+        self.assertEqual(len(json.loads(body)['result']), 5)
+        self.assertEqual(len(submitted), 3)
+
+    def test_not_streamed(self):
+        self.populate()
+        request = self.client.get('/people?stream=0')
+        data = self.json(request.response)
+        self.assertEqual(len(data['result']), 5)
+
+
+class TestStreamCursor(TestStream):
+    config_params = {'DATASTORE': 'sqlite://',
+                     'API_STREAM_BATCH': 2,
+                     'PAGINATION': 'lux.extensions.rest.CursorPagination'}
+
+    def test_json(self):
+        response, body = self.stream('/people?stream=1&sortby=name')
+        data = json.loads(body)
+        self.assertEqual([p['name'] for p in data['result']],
+                         ['anna', 'bruno', 'carla', 'luca', 'mario'])
+        self.assertFalse('total' in data)
+        self.assertFalse('next' in data)
+
+    def test_ndjson(self):
+        response, body = self.stream('/people?sortby=name:desc',
+                                     HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(len(body.splitlines()), 5)
+
+    def test_json_limit(self):
+        response, body = self.stream('/people?stream=1&limit=2')
+        data = json.loads(body)
+        self.assertEqual(len(data['result']), 2)
+        _, body = self.stream('/people?stream=1&limit=2&cursor=%s' %
+                              data['next'].split('cursor=')[1])
+        data = json.loads(body)
+        self.assertEqual(len(data['result']), 2)
@@ -0,0 +1,51 @@
+from lux.extensions.odm import CachedCount, EstimatedCount
+from lux.utils import test
+
+
+class TestTotalCount(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'TOTAL_COUNT': 'lux.extensions.odm.CachedCount'}
+
+    def add_people(self, *names):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            for name in names:
+                session.add(odm.person(name=name))
+
+    def count(self, strategy):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            return strategy(session.query(odm.person))
+
+    def test_cached_count(self):
+        strategy = self.app.total_count
+        self.assertIsInstance(strategy, CachedCount)
+        total, exact = self.count(strategy)
+        self.assertTrue(exact)
+        self.assertEqual(len(strategy.cache), 1)
+        self.assertEqual(self.count(strategy), (total, True))
+        self.assertEqual(strategy.cache.hits, 1)
+        # an insert invalidates the cached total
+        self.add_people('luca', 'anna')
+        self.assertEqual(self.count(strategy), (total + 2, True))
+
+    def test_estimated_count(self):
+        strategy = EstimatedCount(self.app)
+        self.add_people('mario')
+        total, exact = self.count(strategy)
+        self.assertTrue(exact)
+        strategy.threshold = 0
+        odm = self.app.odm()
+        with odm.begin() as session:
+            session.execute('ANALYZE', mapper=odm.person)
+        self.assertEqual(self.count(strategy), (total, False))
+
+    def test_collection(self):
+        self.add_people('bruno')
+        request = self.client.get('/people')
+        data = self.json(request.response)
+        self.assertTrue(data['total_exact'])
+        request = self.client.get('/people/metadata')
+        data = self.json(request.response)
+        self.assertTrue(data['total_exact'])
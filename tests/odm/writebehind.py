@@ -0,0 +1,86 @@
+from lux.extensions.odm import WriteBehind
+from lux.utils import test
+
+
+class TestWriteBehind(test.AppTestCase):
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'WRITE_BEHIND_ENTRIES': 3,
+                     'METRICS_URL': '/metrics'}
+
+    def setUp(self):
+        self.batches = []
+        self.app.events['on_model_changes'].append(self.record)
+
+    def tearDown(self):
+        self.app.events['on_model_changes'].remove(self.record)
+
+    def record(self, app, changes, remote):
+        self.batches.append(changes)
+
+    def people(self, *names):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            people = [odm.person(name=name) for name in names]
+            session.add_all(people)
+        del self.batches[:]
+        return [person.id for person in people]
+
+    def names(self, ids):
+        odm = self.app.odm()
+        with odm.begin() as session:
+            query = session.query(odm.person)
+            return [query.get(pk).name for pk in ids]
+
+    def test_coalesce(self):
+        buffer = self.app.write_behind
+        ids = self.people('a', 'b')
+        buffer.touch('person', ids[0], 'name', 'a1')
+        buffer.touch('person', ids[0], 'name', 'a2')
+        buffer.touch('person', ids[1], 'name', 'b1')
+        self.assertEqual(buffer.pending, 2)
+        self.assertTrue(buffer.lag >= 0)
+        self.assertEqual(self.names(ids), ['a', 'b'])
+        flushed = buffer.flushed
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.flushed, flushed + 2)
+        self.assertEqual(buffer.pending, 0)
+        self.assertEqual(buffer.lag, 0)
+        self.assertEqual(self.names(ids), ['a2', 'b1'])
+        self.assertEqual(buffer.flush(), 0)
+        # bulk updates are not published
+        self.assertEqual(self.batches, [])
+        self.assertTrue(buffer.histogram.count)
+
+    def test_max_entries(self):
+        buffer = self.app.write_behind
+        ids = self.people('c', 'd', 'e')
+        for pk in ids:
+            buffer.touch('person', pk, 'name', 'x')
+        if self.app._loop is None:
+            self.assertEqual(buffer.pending, 0)
+            self.assertEqual(self.names(ids), ['x', 'x', 'x'])
+        else:
+            self.assertEqual(buffer.flush(), 3)
+
+    def test_deleted(self):
+        buffer = self.app.write_behind
+        ids = self.people('f', 'g')
+        buffer.touch('person', ids[0], 'name', 'f1')
+        buffer.touch('person', ids[1], 'name', 'g1')
+        odm = self.app.odm()
+        with odm.begin() as session:
+            session.delete(session.query(odm.person).get(ids[0]))
+        errors = buffer.errors
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.errors, errors)
+        self.assertEqual(buffer.pending, 0)
+        self.assertEqual(self.names(ids[1:]), ['g1'])
+
+    def test_error(self):
+        buffer = WriteBehind(self.app)
+        buffer.touch('foo', 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.errors, 1)
+        self.assertEqual(buffer.pending, 1)
+        self.assertTrue(buffer.lag >= 0)